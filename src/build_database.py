@@ -1,17 +1,19 @@
 import os
+import json
 import sqlite3
 import time
-import text2term
 import bioregistry
 import pandas as pd
-from tqdm import tqdm
 from pathlib import Path
-from metapub import PubMedFetcher
+from datetime import datetime
 from generate_ontology_tables import get_semsql_tables_for_ontology
-from generate_mapping_report import get_mapping_counts
-from text2term import Mapper
+from generate_mapping_report import get_mapping_counts, get_mapping_counts_for_terms
+from fetch_pubmed_articles import fetch_pubmed_articles, PUBMED_EFETCH_URL
+from ontology_mapping import map_terms
+from ontology_term_index import get_ontology_file
+from build_pipeline import Stage, run_stages, clear_checkpoints, MAX_WORKERS
 
-__version__ = "1.4.2"
+__version__ = "1.17.0"
 
 DB_RESOURCES_FOLDER = os.path.join("..", "resources")
 
@@ -22,6 +24,29 @@ t2t_mapping_mapped_term_iri_col = "MappedTermIRI"
 t2t_mapping_mapped_term_curie_col = "MappedTermCURIE"
 t2t_mapping_score_col = "MappingScore"
 
+# Number of rows inserted into the database in each executemany call when importing a table
+IMPORT_CHUNK_SIZE = 100000
+
+# Page size (in bytes) of the output database, which is applied when the database is vacuumed at the end of the build
+DB_PAGE_SIZE = 8192
+
+# Column of the (row number) identifiers given to associations when counting the associations mapped to each term
+ASSOCIATION_ID_COL = "AssociationID"
+
+# Suffix of the tables into which the new versions of tables are imported when updating a database incrementally
+STAGED_TABLE_SUFFIX = "_staged"
+
+# Suffix of the FTS5 full-text search tables of the text columns used in free-text search, and the tokenizers of the
+#  short texts (labels, synonyms and traits, indexed by trigrams so that any substring of 3 or more characters is
+#  matched, as by LIKE '%...%') and of the long texts (abstracts, indexed by their stemmed words)
+TEXT_SEARCH_TABLE_SUFFIX = "_fts"
+SHORT_TEXT_TOKENIZER = "trigram"
+LONG_TEXT_TOKENIZER = "porter unicode61 remove_diacritics 2"
+
+# Suffix of the table (named after the ontology) of the resources annotated with each ontology term, either directly or
+#  through any of its subclasses
+TERM_RESOURCES_TABLE_SUFFIX = "_term_studies"
+
 
 # Assemble a SQLite database that contains:
 # 1) The original user-specified metadata table
@@ -34,10 +59,11 @@ def build_database(metadata_df, dataset_name, ontology_name, output_database_fil
                    ontology_term_col=t2t_mapping_mapped_term_col,
                    ontology_term_iri_col=t2t_mapping_mapped_term_iri_col,
                    ontology_term_curie_col=t2t_mapping_mapped_term_curie_col,
-                   ontology_semsql_db_url="", ontology_url="", pmid_col="",
+                   ontology_semsql_db_url="", ontology_url="", ontology_version="", pmid_col="",
                    compute_mappings=False, ontology_mappings_df=None, min_mapping_score=0.7, max_mappings=3,
                    mapping_base_iris=(), include_cross_ontology_references_table=False, additional_tables=(),
-                   additional_ontologies=()):
+                   additional_ontologies=(), verify_mapping_counts=False, associations_df=None,
+                   association_term_iri_col="", additional_indexes=(), max_workers=MAX_WORKERS):
     ontology_name = ontology_name.lower()
 
     # Get target ontology URL from the specified ontology name
@@ -47,91 +73,291 @@ def build_database(metadata_df, dataset_name, ontology_name, output_database_fil
     # Create SQLite database
     if output_database_filepath == "":
         output_database_filepath = os.path.join("..", dataset_name + "_search.db")
-    Path(output_database_filepath).touch()
-    db_connection = sqlite3.connect(output_database_filepath)
+    db_connection = connect_to_database(output_database_filepath)
 
     # Add the given metadata table to the database
-    import_df_to_db(db_connection, data_frame=metadata_df, table_name=dataset_name + "_metadata")
+    import_df_to_db(db_connection, data_frame=metadata_df, table_name=dataset_name + "_metadata",
+                    primary_key=[resource_id_col] if resource_id_col in metadata_df.columns else [])
+
+    # Get the ontology tables, the details of the references, the ontology mappings and their counts, in stages that
+    #  run concurrently when they do not depend on each other, and that a failed build resumes from where it stopped
+    stages = _get_build_stages(metadata_df, dataset_name, ontology_name, resource_col=resource_col,
+                               resource_id_col=resource_id_col, ontology_term_col=ontology_term_col,
+                               ontology_term_iri_col=ontology_term_iri_col,
+                               ontology_term_curie_col=ontology_term_curie_col,
+                               ontology_semsql_db_url=ontology_semsql_db_url, ontology_url=ontology_url,
+                               ontology_version=ontology_version, pmid_col=pmid_col, compute_mappings=compute_mappings,
+                               ontology_mappings_df=ontology_mappings_df, min_mapping_score=min_mapping_score,
+                               max_mappings=max_mappings, mapping_base_iris=mapping_base_iris,
+                               additional_ontologies=additional_ontologies,
+                               verify_mapping_counts=verify_mapping_counts, associations_df=associations_df,
+                               association_term_iri_col=association_term_iri_col)
+    stage_outputs, stage_timings_df = run_stages(stages, max_workers=max_workers)
 
     # Add ontology tables to the database
-    primary_ontology_labels_df = import_ontology_tables(db_connection, ontology_name=ontology_name,
-                                                        ontology_semsql_db_url=ontology_semsql_db_url,
-                                                        include_crossrefs_table=include_cross_ontology_references_table,
-                                                        primary_ontology=True)
+    primary_ontology_labels_df = \
+        import_ontology_tables(db_connection, ontology_name=ontology_name,
+                               ontology_tables=stage_outputs[ontology_name + "_tables"],
+                               include_crossrefs_table=include_cross_ontology_references_table,
+                               primary_ontology=True)
     for ontology in additional_ontologies:
-        import_ontology_tables(db_connection, ontology_name=ontology.lower(), ontology_semsql_db_url="",
+        import_ontology_tables(db_connection, ontology_name=ontology.lower(),
+                               ontology_tables=stage_outputs[ontology.lower() + "_tables"],
                                include_crossrefs_table=False, primary_ontology=False)
 
-    # Get details (title, abstract, journal) from PubMed about references in the specified PMID column
-    references_table_filename = os.path.join(DB_RESOURCES_FOLDER, dataset_name + "_references.tsv")
-    if not os.path.isfile(references_table_filename):
-        references_df = get_pubmed_details(metadata_df=metadata_df, dataset_name=dataset_name, pmid_col=pmid_col)
-    else:
-        # TODO incrementally update the existing table with any new references in the metadata
-        references_df = pd.read_csv(references_table_filename, sep="\t")
-    import_df_to_db(db_connection, data_frame=references_df, table_name=dataset_name + "_references")
+    # Add the details (title, abstract, journal) from PubMed about references in the specified PMID column
+    import_df_to_db(db_connection, data_frame=stage_outputs["references"], table_name=dataset_name + "_references",
+                    primary_key=[pmid_col])
 
-    # Map the values in the specified metadata table column to the specified ontology
-    if ontology_mappings_df is None or compute_mappings:
-        t2t_mappings_df = map_metadata_to_ontologies(metadata_df=metadata_df, dataset_name=dataset_name,
-                                                     ontology_url=ontology_url, min_score=min_mapping_score,
-                                                     source_term_col=resource_col,
-                                                     source_term_id_col=resource_id_col,
-                                                     base_iris=mapping_base_iris,
-                                                     max_mappings=max_mappings)
-        t2t_mappings_df.columns = t2t_mappings_df.columns.str.replace(' ', '')
-        t2t_mappings_df["Source"] = "text2term"
-        if ontology_mappings_df is None:
-            resource_col = t2t_mapping_source_term_col
-            resource_id_col = t2t_mapping_source_term_id_col
-            ontology_term_iri_col = t2t_mapping_mapped_term_iri_col
-            ontology_mappings_df = t2t_mappings_df
-        else:
-            # combine t2t mappings with the given mappings table
-            t2t_mappings_df = t2t_mappings_df.rename(
-                columns={t2t_mapping_source_term_col: resource_col,
-                         t2t_mapping_source_term_id_col: resource_id_col,
-                         t2t_mapping_mapped_term_col: ontology_term_col,
-                         t2t_mapping_mapped_term_iri_col: ontology_term_iri_col,
-                         t2t_mapping_mapped_term_curie_col: ontology_term_curie_col})
-            ontology_mappings_df = pd.concat([t2t_mappings_df, ontology_mappings_df])
+    # Add the mappings of the values in the specified metadata table column to the specified ontology
+    ontology_mappings_df, resource_col, resource_id_col, ontology_term_iri_col = stage_outputs["mappings"]
     import_df_to_db(db_connection, data_frame=ontology_mappings_df, table_name=dataset_name + "_mappings")
 
-    # Get counts of mappings
-    counts_df = get_mapping_counts(mappings_df=ontology_mappings_df, ontology_iri=ontology_url,
-                                   source_term_col=resource_col, save_ontology=True,
-                                   source_term_id_col=resource_id_col,
-                                   mapped_term_iri_col=ontology_term_iri_col)
-    counts_df.to_csv(os.path.join(DB_RESOURCES_FOLDER, ontology_name + "_mappings_counts.tsv"), sep="\t", index=False)
-
     # Merge the counts table with the labels table on the "IRI" column
+    counts_df = stage_outputs["mapping_counts"]
+    counts_df.to_csv(os.path.join(DB_RESOURCES_FOLDER, ontology_name + "_mappings_counts.tsv"), sep="\t", index=False)
     merged_df = pd.merge(primary_ontology_labels_df, counts_df, on="IRI")
 
+    # Merge the counts of the associations mapped—either directly or indirectly—to each ontology term, if given
+    if associations_df is not None:
+        association_counts_df = stage_outputs["association_counts"].rename(
+            columns={"Direct": "DirectAssociations", "Inherited": "InheritedAssociations"})
+        merged_df = pd.merge(merged_df, association_counts_df, on="IRI", how="left")
+
     # Save the merged table to disk and add it to the database
     merged_df.to_csv(os.path.join(DB_RESOURCES_FOLDER, ontology_name + "_labels.tsv"), sep="\t", index=False)
-    import_df_to_db(db_connection, data_frame=merged_df, table_name=ontology_name + "_labels")
+    import_df_to_db(db_connection, data_frame=merged_df, table_name=ontology_name + "_labels", primary_key=["Subject"])
 
     # Add any additional tables given
     if len(additional_tables) > 0:
         for table_name in additional_tables.keys():
             import_df_to_db(db_connection, data_frame=additional_tables[table_name], table_name=table_name)
 
+    # Record the time taken by each stage of the build
+    import_df_to_db(db_connection, data_frame=stage_timings_df, table_name="build_stages")
 
-def import_ontology_tables(db_connection, ontology_name, ontology_semsql_db_url,
-                           include_crossrefs_table, primary_ontology=True):
-    # Get SemanticSQL ontology tables and add them to the database
+    # Index the tables used in search, and report the latency of typical search queries before and after indexing
+    search_queries = _get_search_queries(db_connection, dataset_name=dataset_name, ontology_name=ontology_name,
+                                         resource_id_col=resource_id_col,
+                                         ontology_term_curie_col=ontology_term_curie_col)
+    latencies_before = _get_query_latencies(db_connection, search_queries)
+    indexes = [(ontology_name + "_entailed_edges", ["Object", "Subject"]),
+               (ontology_name + "_entailed_edges", ["Subject", "Object"]),
+               (ontology_name + "_edges", ["Object", "Subject"]),
+               (ontology_name + "_edges", ["Subject", "Object"]),
+               (dataset_name + "_mappings", [ontology_term_curie_col, resource_id_col]),
+               (dataset_name + "_metadata", [resource_id_col])]
+    create_indexes(db_connection, indexes + list(additional_indexes))
+    create_term_resources_table(db_connection, ontology_name, dataset_name + "_mappings", resource_id_col=resource_id_col,
+                                ontology_term_curie_col=ontology_term_curie_col)
+    check_term_resources_table(db_connection, ontology_name)
+    create_text_search_tables(db_connection, _get_text_search_tables(dataset_name, ontology_name, resource_col,
+                                                                     resource_id_col, pmid_col))
+    latencies_after = _get_query_latencies(db_connection, search_queries)
+    latency_report_df = pd.DataFrame({"Query": list(search_queries.keys()),
+                                      "BeforeIndexing(ms)": [latencies_before[query] for query in search_queries],
+                                      "AfterIndexing(ms)": [latencies_after[query] for query in search_queries]})
+    latency_report_df.to_csv(os.path.join(DB_RESOURCES_FOLDER, dataset_name + "_query_latency.tsv"), sep="\t",
+                             index=False)
+    print("Search query latency before and after indexing:")
+    print(latency_report_df.round(2).to_string(index=False))
+
+    # Rebuild the database file compactly (and with the configured page size) now that all the data is in
+    db_connection.execute("VACUUM")
+    db_connection.close()
+    clear_checkpoints(stages)  # the build completed, so it does not need to be resumed
+
+
+# Update a SQLite database previously assembled by build_database with the given (newer) metadata, rather than
+#  rebuilding it. The new versions of the metadata, references, mappings, associations (streamed into the staged
+#  associations table beforehand, if given) and additional tables are imported into staging tables, and only the rows
+#  of the resources (identified by their resource ID) whose rows differ are replaced. The mapping counts are then
+#  recomputed only for the ontology terms mapped to by the replaced rows, and their ancestors. The updated tables have
+#  the same contents as those of a database built from scratch with the same inputs (though not in the same row
+#  order). The update is done in a single transaction, and the database is left as is if the new tables cannot be
+#  merged into it (e.g., because a column was added to the metadata), in which case a ValueError is raised
+def update_database(metadata_df, dataset_name, ontology_name, output_database_filepath="",
+                    resource_col=t2t_mapping_source_term_col,
+                    resource_id_col=t2t_mapping_source_term_id_col,
+                    ontology_term_col=t2t_mapping_mapped_term_col,
+                    ontology_term_iri_col=t2t_mapping_mapped_term_iri_col,
+                    ontology_term_curie_col=t2t_mapping_mapped_term_curie_col,
+                    ontology_semsql_db_url="", ontology_url="", ontology_version="", pmid_col="",
+                    compute_mappings=False, ontology_mappings_df=None, min_mapping_score=0.7, max_mappings=3,
+                    mapping_base_iris=(), additional_tables=(), staged_associations_table="",
+                    association_key_col="", association_term_iri_col=""):
+    print("Updating database incrementally...")
     start = time.time()
+    ontology_name = ontology_name.lower()
+    if ontology_url == "":
+        ontology_url = bioregistry.get_owl_download(ontology_name)
+    if output_database_filepath == "":
+        output_database_filepath = os.path.join("..", dataset_name + "_search.db")
+    db_connection = sqlite3.connect(output_database_filepath)
+    db_connection.execute("PRAGMA cache_size=-262144")
+    db_connection.execute("PRAGMA temp_store=MEMORY")
+
+    # Stage the new tables, and find the resources whose rows changed. The mappings are only recomputed when the
+    #  metadata changed (text2term mappings depend on all the metadata values, so they are computed for all of them)
+    metadata_table, mappings_table = dataset_name + "_metadata", dataset_name + "_mappings"
+    key_cols = {metadata_table: resource_id_col}
+    import_df_to_db(db_connection, data_frame=metadata_df, table_name=metadata_table + STAGED_TABLE_SUFFIX)
+    changed_keys = {metadata_table: _get_changed_keys(db_connection, metadata_table, resource_id_col)}
+    references_df = get_pubmed_details(metadata_df=metadata_df, dataset_name=dataset_name, pmid_col=pmid_col)
+    references_table = dataset_name + "_references"
+    key_cols[references_table] = pmid_col
+    import_df_to_db(db_connection, data_frame=references_df, table_name=references_table + STAGED_TABLE_SUFFIX)
+    changed_keys[references_table] = _get_changed_keys(db_connection, references_table, pmid_col)
+    if len(changed_keys[metadata_table]) > 0:
+        ontology_mappings_df, resource_col, resource_id_col, ontology_term_iri_col = \
+            get_ontology_mappings(metadata_df, dataset_name, ontology_url, ontology_mappings_df=ontology_mappings_df,
+                                  ontology_name=ontology_name, ontology_version=ontology_version,
+                                  compute_mappings=compute_mappings, min_mapping_score=min_mapping_score,
+                                  max_mappings=max_mappings, mapping_base_iris=mapping_base_iris,
+                                  resource_col=resource_col, resource_id_col=resource_id_col,
+                                  ontology_term_col=ontology_term_col, ontology_term_iri_col=ontology_term_iri_col,
+                                  ontology_term_curie_col=ontology_term_curie_col)
+        import_df_to_db(db_connection, data_frame=ontology_mappings_df, table_name=mappings_table + STAGED_TABLE_SUFFIX)
+        key_cols[mappings_table] = resource_id_col
+        changed_keys[mappings_table] = _get_changed_keys(db_connection, mappings_table, resource_id_col)
+    associations_table = ""
+    if staged_associations_table != "":
+        associations_table = staged_associations_table[:-len(STAGED_TABLE_SUFFIX)]
+        key_cols[associations_table] = association_key_col
+        changed_keys[associations_table] = _get_changed_keys(db_connection, associations_table, association_key_col)
+    _stage_additional_tables(db_connection, additional_tables)
+    for table_name, keys in changed_keys.items():
+        print(f"\t{len(keys)} resources changed in table {table_name}")
+
+    # Get the (full) ontology labels and entailed edges tables, which identify the terms that the mappings count toward,
+    #  as in a build from scratch. They come from the same SemanticSQL build as the ontology tables in the database
+    #  (which an incremental update is only run on if the build has not changed), so the counts follow the same class
+    #  hierarchy as the term resources table
+    _, entailed_edges_df, labels_df = get_ontology_tables(ontology_name, ontology_semsql_db_url)[:3]
+
+    labels_table = ontology_name + "_labels"
+    with db_connection:
+        db_connection.execute("BEGIN")
+        iri_cols = {mappings_table: ontology_term_iri_col, associations_table: association_term_iri_col}
+        affected_iris = {table_name: _replace_changed_rows(db_connection, table_name, key_cols[table_name], keys,
+                                                           iri_cols.get(table_name))
+                         for table_name, keys in changed_keys.items()}
+        if len(changed_keys.get(mappings_table, [])) > 0:
+            create_term_resources_table(db_connection, ontology_name, mappings_table, resource_id_col=resource_id_col,
+                                        ontology_term_curie_col=ontology_term_curie_col,
+                                        resource_ids=changed_keys[mappings_table])
+        _replace_additional_tables(db_connection, additional_tables)
+
+        # Recompute the counts of the terms (and their ancestors) mapped to by the rows replaced
+        #  (mappings are counted by resource, whereas each association, i.e. each row, is counted)
+        counted_tables = [(mappings_table, resource_id_col, ontology_term_iri_col, "Direct", "Inherited"),
+                          (associations_table, "rowid", association_term_iri_col, "DirectAssociations",
+                           "InheritedAssociations")]
+        for table_name, id_col, iri_col, direct_col, inherited_col in counted_tables:
+            if len(affected_iris.get(table_name, [])) > 0:
+                _update_term_counts(db_connection, labels_table, table_name, id_col, iri_col, direct_col,
+                                    inherited_col, affected_iris[table_name], labels_df, entailed_edges_df)
+        check_term_resources_table(db_connection, ontology_name)  # the update is rolled back if they differ
+
+    # Update the saved labels and counts tables, and the statistics of the tables for the query planner
+    merged_df = pd.read_sql_query(f"SELECT * FROM `{labels_table}`", db_connection)
+    merged_df.to_csv(os.path.join(DB_RESOURCES_FOLDER, ontology_name + "_labels.tsv"), sep="\t", index=False)
+    merged_df[["IRI", "Direct", "Inherited"]].to_csv(
+        os.path.join(DB_RESOURCES_FOLDER, ontology_name + "_mappings_counts.tsv"), sep="\t", index=False)
+    create_text_search_tables(db_connection, _get_text_search_tables(dataset_name, ontology_name, resource_col,
+                                                                     resource_id_col, pmid_col))
+    db_connection.execute("ANALYZE")
+    db_connection.commit()
+    db_connection.close()
+    print(f"...done ({time.time() - start:.1f} seconds)")
+
+
+# Get the stages of a build (see build_database): the extraction of the tables of each ontology, the retrieval of the
+#  PubMed details of the references and the ontology mapping of the metadata, which are independent of each other, and
+#  the counts of the mappings and associations to each ontology term, which depend on the tables of the primary
+#  ontology and on the mappings
+def _get_build_stages(metadata_df, dataset_name, ontology_name, resource_col, resource_id_col, ontology_term_col,
+                      ontology_term_iri_col, ontology_term_curie_col, ontology_semsql_db_url, ontology_url,
+                      ontology_version, pmid_col, compute_mappings, ontology_mappings_df, min_mapping_score,
+                      max_mappings, mapping_base_iris, additional_ontologies, verify_mapping_counts, associations_df,
+                      association_term_iri_col):
+    stages = [Stage(ontology_name + "_tables", get_ontology_tables,
+                    arguments=dict(ontology_name=ontology_name, ontology_semsql_db_url=ontology_semsql_db_url,
+                                   primary_ontology=True))]
+    for ontology in additional_ontologies:
+        stages.append(Stage(ontology.lower() + "_tables", get_ontology_tables,
+                            arguments=dict(ontology_name=ontology.lower(), ontology_semsql_db_url="",
+                                           primary_ontology=False)))
+    stages.append(Stage("references", get_pubmed_details,
+                        arguments=dict(metadata_df=metadata_df, dataset_name=dataset_name, pmid_col=pmid_col)))
+    stages.append(Stage("mappings", get_ontology_mappings,
+                        arguments=dict(metadata_df=metadata_df, dataset_name=dataset_name, ontology_url=ontology_url,
+                                       ontology_name=ontology_name, ontology_version=ontology_version,
+                                       ontology_mappings_df=ontology_mappings_df, compute_mappings=compute_mappings,
+                                       min_mapping_score=min_mapping_score, max_mappings=max_mappings,
+                                       mapping_base_iris=mapping_base_iris, resource_col=resource_col,
+                                       resource_id_col=resource_id_col, ontology_term_col=ontology_term_col,
+                                       ontology_term_iri_col=ontology_term_iri_col,
+                                       ontology_term_curie_col=ontology_term_curie_col)))
+    stages.append(Stage("mapping_counts", _get_ontology_mapping_counts,
+                        arguments=dict(ontology_url=ontology_url, ontology_name=ontology_name,
+                                       ontology_version=ontology_version, verify=verify_mapping_counts),
+                        inputs=dict(ontology_tables=ontology_name + "_tables", ontology_mappings="mappings")))
+    if associations_df is not None:
+        stages.append(Stage("association_counts", _get_association_counts,
+                            arguments=dict(associations_df=associations_df, ontology_url=ontology_url,
+                                           association_term_iri_col=association_term_iri_col),
+                            inputs=dict(ontology_tables=ontology_name + "_tables")))
+    return stages
+
+
+# Get counts of mappings from the entailed class hierarchy (optionally verified against the owlready2 counts, on the
+#  local copy of the ontology shared with the mapping stage)
+def _get_ontology_mapping_counts(ontology_tables, ontology_mappings, ontology_url, ontology_name="", ontology_version="",
+                                 verify=False):
+    edges_df, entailed_edges_df, labels_df = ontology_tables[:3]
+    ontology_mappings_df, resource_col, resource_id_col, ontology_term_iri_col = ontology_mappings
+    if verify:
+        ontology_url = get_ontology_file(ontology_url, ontology_name=ontology_name, ontology_version=ontology_version)
+    return get_mapping_counts(mappings_df=ontology_mappings_df, ontology_iri=ontology_url,
+                              source_term_col=resource_col, save_ontology=True,
+                              source_term_id_col=resource_id_col,
+                              mapped_term_iri_col=ontology_term_iri_col,
+                              ontology_terms_df=labels_df,
+                              entailed_edges_df=entailed_edges_df,
+                              edges_df=edges_df,
+                              verify=verify)
+
+
+# Get counts of the associations mapped—either directly or indirectly—to each ontology term
+def _get_association_counts(ontology_tables, associations_df, ontology_url, association_term_iri_col):
+    edges_df, entailed_edges_df, labels_df = ontology_tables[:3]
+    association_mappings_df = associations_df.rename_axis(ASSOCIATION_ID_COL).reset_index()
+    return get_mapping_counts(mappings_df=association_mappings_df, ontology_iri=ontology_url,
+                              source_term_id_col=ASSOCIATION_ID_COL,
+                              mapped_term_iri_col=association_term_iri_col,
+                              ontology_terms_df=labels_df,
+                              entailed_edges_df=entailed_edges_df,
+                              edges_df=edges_df)
+
+
+# Get the SemanticSQL tables of the given ontology, saving them to the resources folder
+def get_ontology_tables(ontology_name, ontology_semsql_db_url, primary_ontology=True):
     if ontology_semsql_db_url == "":
         ontology_semsql_db_url = "https://s3.amazonaws.com/bbop-sqlite/" + ontology_name + ".db.gz"
-    edges_df, entailed_edges_df, labels_df, dbxrefs_df, synonyms_df, ontology_version = \
-        get_semsql_tables_for_ontology(
-            ontology_url=ontology_semsql_db_url,
-            ontology_name=ontology_name.upper(),
-            tables_output_folder=DB_RESOURCES_FOLDER,
-            db_output_folder=DB_RESOURCES_FOLDER,
-            save_tables=True,
-            include_disease_locations=primary_ontology)
-    print(f"...done ({time.time() - start:.1f} seconds)")
+    return get_semsql_tables_for_ontology(ontology_url=ontology_semsql_db_url,
+                                          ontology_name=ontology_name.upper(),
+                                          tables_output_folder=DB_RESOURCES_FOLDER,
+                                          db_output_folder=DB_RESOURCES_FOLDER,
+                                          save_tables=True,
+                                          include_disease_locations=primary_ontology)
+
+
+# Add the given SemanticSQL tables of the given ontology to the database (the labels table of the primary ontology is
+#  added later, with the mapping counts). Returns the labels table
+def import_ontology_tables(db_connection, ontology_name, ontology_tables, include_crossrefs_table,
+                           primary_ontology=True):
+    edges_df, entailed_edges_df, labels_df, dbxrefs_df, synonyms_df, ontology_version = ontology_tables
     import_df_to_db(db_connection, data_frame=edges_df, table_name=ontology_name + "_edges")
     import_df_to_db(db_connection, data_frame=entailed_edges_df, table_name=ontology_name + "_entailed_edges")
     import_df_to_db(db_connection, data_frame=synonyms_df, table_name=ontology_name + "_synonyms")
@@ -146,22 +372,377 @@ dtypes = {'int64': 'INTEGER', 'float64': 'REAL', 'object': 'TEXT', 'datetime64':
 
 
 # Import the given data frame to the SQLite database through the specified connection
-# The CREATE TABLE statement is built using the given data frame's column names and inferred data types
-def import_df_to_db(connection, data_frame, table_name):
-    columns = []
-    for column_name, dtype in zip(data_frame.columns, data_frame.dtypes):
-        sql_type = dtypes.get(str(dtype), 'TEXT')
-        column_name = column_name.replace(":", "_")
-        column_name = column_name.replace(" ", "")
-        columns.append(f"`{column_name}` {sql_type}")
-    create_table_query = f'CREATE TABLE IF NOT EXISTS {table_name} ({", ".join(columns)})'
-    connection.cursor().execute(create_table_query)
-    data_frame.to_sql(table_name, connection, if_exists="replace", index=False)
-
-
-# Map values in the specified metadata column to terms in the specified ontology set
+# The CREATE TABLE statement is built using the given data frame's column names and inferred data types, and declares
+#  the given primary key columns (provided their values are unique). Any existing table with the same name is replaced
+def import_df_to_db(connection, data_frame, table_name, primary_key=()):
+    constraints = []
+    if len(primary_key) > 0:
+        if data_frame.duplicated(subset=list(primary_key)).any() or data_frame[list(primary_key)].isna().any().any():
+            print(f"...warning: values of {list(primary_key)} are not unique in table {table_name}—"
+                  f"creating the table without a primary key")
+        else:
+            constraints.append(f"PRIMARY KEY ({', '.join(f'`{column}`' for column in primary_key)})")
+    chunks = (data_frame.iloc[chunk_start:chunk_start + IMPORT_CHUNK_SIZE]
+              for chunk_start in range(0, max(len(data_frame), 1), IMPORT_CHUNK_SIZE))
+    import_df_chunks_to_db(connection, chunks, table_name, constraints=constraints)
+
+
+# Import the given data frame chunks (e.g., parsed incrementally from a file) to the SQLite database, as a single table
+#  whose columns are declared from the column names and data types of the first chunk, in a single transaction
+#  (i.e., the table is only replaced once all the chunks are imported, and any previous table is left as it was if a
+#  chunk fails). Returns the number of rows imported
+def import_df_chunks_to_db(connection, chunks, table_name, constraints=()):
+    start = time.time()
+    row_count = 0
+    with connection:
+        if not connection.in_transaction:
+            connection.execute("BEGIN")  # sqlite3 would otherwise commit the DROP and CREATE statements right away
+        for chunk_number, chunk in enumerate(chunks):
+            if chunk_number == 0:
+                columns = [f"`{column_name}` {dtypes.get(str(dtype), 'TEXT')}"
+                           for column_name, dtype in zip(chunk.columns, chunk.dtypes)]
+                connection.execute(f"DROP TABLE IF EXISTS `{table_name}`")
+                connection.execute(f"CREATE TABLE `{table_name}` ({', '.join(columns + list(constraints))})")
+                insert_query = f"INSERT INTO `{table_name}` VALUES ({', '.join(['?'] * len(chunk.columns))})"
+            chunk = chunk.astype(object).where(chunk.notna(), None)  # convert to Python values, with NULLs for NAs
+            connection.executemany(insert_query, chunk.itertuples(index=False, name=None))
+            row_count += len(chunk)
+    elapsed_time = time.time() - start
+    print(f"\tImported {row_count} rows into table {table_name} in {elapsed_time:.1f} seconds "
+          f"({row_count / max(elapsed_time, 1e-6):.0f} rows/second)")
+    return row_count
+
+
+# Get the keys (values of the given key column) of the rows that differ between the given table and its staged new
+#  version, that is, the keys whose rows were added, removed or changed. Tables are compared as multisets of rows
+def _get_changed_keys(connection, table_name, key_col):
+    staged_table_name = table_name + STAGED_TABLE_SUFFIX
+    columns = _check_staged_columns(connection, table_name)
+    column_list = ", ".join(f"`{column}`" for column, _ in columns)
+    row_counts = [f"SELECT {column_list}, COUNT(*) AS row_count FROM `{name}` GROUP BY {column_list}"
+                  for name in (table_name, staged_table_name)]
+    query = f"SELECT `{key_col}` FROM ({row_counts[0]} EXCEPT {row_counts[1]}) " \
+            f"UNION SELECT `{key_col}` FROM ({row_counts[1]} EXCEPT {row_counts[0]})"
+    return [row[0] for row in connection.execute(query).fetchall()]
+
+
+# Check that the given table and its staged new version have the same columns (names and declared types, in order),
+#  so that rows can be copied from one to the other. Otherwise, the staged tables are dropped and a ValueError raised
+def _check_staged_columns(connection, table_name):
+    columns = [row[1:3] for row in connection.execute(f"PRAGMA table_info(`{table_name}`)").fetchall()]
+    staged_columns = [row[1:3] for row in connection.execute(
+        f"PRAGMA table_info(`{table_name + STAGED_TABLE_SUFFIX}`)").fetchall()]
+    if columns != staged_columns:
+        _drop_staged_tables(connection)
+        raise ValueError(f"The columns of table {table_name} changed from {columns} to {staged_columns}—"
+                         f"the database must be rebuilt")
+    return columns
+
+
+def _drop_staged_tables(connection):
+    staged_tables = connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?",
+                                       ("%" + STAGED_TABLE_SUFFIX,)).fetchall()
+    for (table_name,) in staged_tables:
+        connection.execute(f"DROP TABLE `{table_name}`")
+
+
+# Replace the rows of the given table that have the given keys with those of its staged new version, and drop the
+#  staged table. Returns the values of the given IRI column (if any) in the rows replaced, both old and new
+def _replace_changed_rows(connection, table_name, key_col, keys, iri_col=None):
+    staged_table_name = table_name + STAGED_TABLE_SUFFIX
+    keys_parameter = (json.dumps(keys),)
+    iris = set()
+    for name in (table_name, staged_table_name):
+        if iri_col is not None:
+            iris.update(row[0] for row in connection.execute(
+                f"SELECT DISTINCT `{iri_col}` FROM `{name}` WHERE `{key_col}` IN (SELECT value FROM json_each(?))",
+                keys_parameter) if row[0] is not None)
+    connection.execute(f"DELETE FROM `{table_name}` WHERE `{key_col}` IN (SELECT value FROM json_each(?))",
+                       keys_parameter)
+    connection.execute(f"INSERT INTO `{table_name}` SELECT * FROM `{staged_table_name}` "
+                       f"WHERE `{key_col}` IN (SELECT value FROM json_each(?))", keys_parameter)
+    connection.execute(f"DROP TABLE `{staged_table_name}`")
+    return iris
+
+
+# Get the IRIs of the ontology terms whose mapping counts are affected by a change in mappings to the given IRIs
+#  (comma-separated IRIs count toward each of their terms): the terms with those IRIs, and all their ancestors
+def _get_affected_term_iris(mapped_iris, labels_df, entailed_edges_df):
+    mapped_iris = pd.Series(list(mapped_iris), dtype=object)
+    mapped_iris = pd.concat([mapped_iris, mapped_iris.str.split(",").explode().str.strip()]).unique()
+    terms = labels_df.loc[labels_df["IRI"].isin(mapped_iris), "Subject"]
+    ancestors = entailed_edges_df.loc[entailed_edges_df["Subject"].isin(terms), "Object"]
+    return set(labels_df.loc[labels_df["Subject"].isin(terms) | labels_df["Subject"].isin(ancestors), "IRI"])
+
+
+# Import the given additional tables into staging tables, checking that their columns match those of the tables in the
+#  database
+def _stage_additional_tables(connection, additional_tables):
+    for table_name in additional_tables:
+        import_df_to_db(connection, data_frame=additional_tables[table_name],
+                        table_name=table_name + STAGED_TABLE_SUFFIX)
+        _check_staged_columns(connection, table_name)
+
+
+# Replace the contents of the given additional tables with those of their staging tables, which are then dropped
+def _replace_additional_tables(connection, additional_tables):
+    for table_name in additional_tables:
+        connection.execute(f"DELETE FROM `{table_name}`")
+        connection.execute(f"INSERT INTO `{table_name}` SELECT * FROM `{table_name + STAGED_TABLE_SUFFIX}`")
+        connection.execute(f"DROP TABLE `{table_name + STAGED_TABLE_SUFFIX}`")
+
+
+# Recompute the counts of the resources in the given table mapped to the terms with the given (mapped) IRIs, and to
+#  their ancestors, and set them in the given columns of the labels table
+def _update_term_counts(connection, labels_table, table_name, id_col, iri_col, direct_col, inherited_col, mapped_iris,
+                        labels_df, entailed_edges_df):
+    term_iris = _get_affected_term_iris(mapped_iris, labels_df, entailed_edges_df)
+    mappings_df = pd.read_sql_query(f"SELECT `{id_col}` AS ResourceID, `{iri_col}` AS IRI FROM `{table_name}`",
+                                    connection)
+    counts_df = get_mapping_counts_for_terms(mappings_df, labels_df, entailed_edges_df, term_iris,
+                                             source_term_id_col="ResourceID", mapped_term_iri_col="IRI")
+    connection.executemany(f"UPDATE `{labels_table}` SET `{direct_col}` = ?, `{inherited_col}` = ? WHERE IRI = ?",
+                           counts_df[["Direct", "Inherited", "IRI"]].itertuples(index=False, name=None))
+    print(f"\tRecomputed the mapping counts of {len(counts_df)} terms from table {table_name}")
+
+
+# Open a connection to the SQLite database at the given path (creating the file if needed), configured for bulk loading
+def connect_to_database(database_filepath):
+    Path(database_filepath).touch()
+    connection = sqlite3.connect(database_filepath)
+    _configure_bulk_load(connection)
+    return connection
+
+
+# Configure the given connection for bulk loading. The database is only usable once the build completes (a failed build
+#  is discarded anyway), so syncing to disk is disabled, and a larger cache is used. The rollback journal is kept in
+#  memory rather than disabled, so that a table whose import fails is still rolled back
+def _configure_bulk_load(connection):
+    connection.execute("PRAGMA journal_mode=MEMORY")
+    connection.execute("PRAGMA synchronous=OFF")
+    connection.execute("PRAGMA cache_size=-262144")  # negative values are in KiB, so 256 MiB
+    connection.execute("PRAGMA temp_store=MEMORY")
+    connection.execute(f"PRAGMA page_size={DB_PAGE_SIZE}")
+
+
+# Create the given indexes, each specified as a (table name, column names) pair, on the tables (and columns) that
+#  exist in the database, and then gather statistics about the tables and indexes for the query planner
+def create_indexes(connection, indexes):
+    print("Creating database indexes...")
+    start = time.time()
+    cursor = connection.cursor()
+    for table_name, index_columns in indexes:
+        table_info = cursor.execute(f"PRAGMA table_info(`{table_name}`)").fetchall()
+        table_columns = [row[1] for row in table_info]
+        primary_key = [row[1] for row in sorted(table_info, key=lambda row: row[5]) if row[5] > 0]
+        if not all(column in table_columns for column in index_columns) or primary_key == list(index_columns):
+            continue  # skip indexes on missing columns, and those that would duplicate the primary key index
+        index_name = "idx_" + table_name + "_" + "_".join(index_columns)
+        index_name = "".join(character if character.isalnum() else "_" for character in index_name)
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON `{table_name}` "
+                       f"({', '.join(f'`{column}`' for column in index_columns)})")
+    cursor.execute("ANALYZE")
+    connection.commit()
+    print(f"...done ({time.time() - start:.1f} seconds)")
+
+
+# Create the table of the resources annotated with each term of the given ontology, either directly or through any of its
+#  entailed subclasses (the sets of resources that searches with subclasses return, and that the Direct and Inherited
+#  mapping counts count), from the given mappings table and the entailed edges table of the ontology. Each (term,
+#  resource) pair is a row, with a Direct flag set if the resource is mapped to the term itself. The table is keyed on
+#  the term and resource, without a separate rowid, so the rows of each term are stored together and the resources
+#  annotated with a term are read with a single range scan of the table. If resource IDs are given, only the rows of
+#  those resources are replaced (e.g., the resources whose mappings changed in an incremental update)
+def create_term_resources_table(connection, ontology_name, mappings_table, resource_id_col, ontology_term_curie_col,
+                                resource_ids=None):
+    start = time.time()
+    table_name = ontology_name + TERM_RESOURCES_TABLE_SUFFIX
+    mapping_columns = [row[1] for row in connection.execute(f"PRAGMA table_info(`{mappings_table}`)").fetchall()]
+    if resource_id_col not in mapping_columns or ontology_term_curie_col not in mapping_columns:
+        return
+    if not _table_exists(connection, table_name):
+        resource_ids = None  # the table is created in full in a database built without it
+    condition = f"mapping.`{resource_id_col}` IS NOT NULL AND mapping.`{ontology_term_curie_col}` IS NOT NULL"
+    parameters = ()
+    if resource_ids is None:
+        connection.execute(f"DROP TABLE IF EXISTS `{table_name}`")
+        connection.execute(f"CREATE TABLE `{table_name}` (`Subject` TEXT, `{resource_id_col}` TEXT, "
+                           f"`Direct` INTEGER, PRIMARY KEY (`Subject`, `{resource_id_col}`)) WITHOUT ROWID")
+    else:
+        condition += f" AND mapping.`{resource_id_col}` IN (SELECT value FROM json_each(?))"
+        parameters = (json.dumps(list(resource_ids)),)
+        connection.execute(f"DELETE FROM `{table_name}` WHERE `{resource_id_col}` IN (SELECT value FROM json_each(?))",
+                           parameters)
+    # The term of each mapping and, through the entailed edges, all its superclasses (and the term itself again)
+    connection.execute(f"""INSERT INTO `{table_name}`
+        SELECT Subject, ResourceID, MAX(Direct)
+        FROM (
+            SELECT mapping.`{ontology_term_curie_col}` AS Subject, mapping.`{resource_id_col}` AS ResourceID, 1 AS Direct
+            FROM `{mappings_table}` mapping
+            WHERE {condition}
+            UNION ALL
+            SELECT ee.Object, mapping.`{resource_id_col}`, 0
+            FROM `{mappings_table}` mapping
+                JOIN `{ontology_name}_entailed_edges` ee ON (ee.Subject = mapping.`{ontology_term_curie_col}`)
+            WHERE {condition}
+        )
+        GROUP BY Subject, ResourceID""", parameters * 2)
+    row_count = connection.execute(f"SELECT COUNT(*) FROM `{table_name}`").fetchone()[0]
+    print(f"\t{'Updated' if resource_ids is not None else 'Created'} table {table_name} of {row_count} term resources "
+          f"in {time.time() - start:.1f} seconds")
+
+
+# Check that the number of resources of each term in the term resources table (see create_term_resources_table),
+#  directly and through its subclasses, are the Direct and Inherited mapping counts of the term in the labels table.
+#  Both are computed from the same entailed edges table, so any term whose counts differ is reported, and a ValueError
+#  is raised
+def check_term_resources_table(connection, ontology_name):
+    table_name = ontology_name + TERM_RESOURCES_TABLE_SUFFIX
+    if not _table_exists(connection, table_name):
+        return
+    counts_df = pd.read_sql_query(f"""SELECT label.Subject, label.Direct, label.Inherited,
+            COALESCE(term.Direct, 0) AS Direct_{table_name}, COALESCE(term.Inherited, 0) AS Inherited_{table_name}
+        FROM `{ontology_name}_labels` label
+            LEFT JOIN (
+                SELECT Subject, SUM(Direct) AS Direct, COUNT(*) - SUM(Direct) AS Inherited
+                FROM `{table_name}`
+                GROUP BY Subject
+            ) term ON (term.Subject = label.Subject)""", connection)
+    differences_df = counts_df[(counts_df["Direct"] != counts_df[f"Direct_{table_name}"]) |
+                               (counts_df["Inherited"] != counts_df[f"Inherited_{table_name}"])]
+    if len(differences_df) > 0:
+        print(differences_df.to_string(index=False, max_rows=20))
+        raise ValueError(f"The resources in table {table_name} of {len(differences_df)} terms differ from their "
+                         f"mapping counts")
+    print(f"...verified the resources in table {table_name} against the mapping counts of {len(counts_df)} terms")
+
+
+def _table_exists(connection, table_name):
+    return connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (table_name,)).fetchone() is not None
+
+
+# Create an FTS5 full-text search table (named after its table, with the text search table suffix) for each of the given
+#  text columns, each specified as a (table name, key column, text column, tokenizer) tuple, of the tables (and columns)
+#  that exist in the database. Each search table holds the key and the (indexed) text of each row of its table, and is
+#  created anew, so that it matches the table after an incremental update
+def create_text_search_tables(connection, text_search_tables):
+    print("Creating full-text search tables...")
+    start = time.time()
+    cursor = connection.cursor()
+    for table_name, key_col, text_col, tokenizer in text_search_tables:
+        table_columns = [row[1] for row in cursor.execute(f"PRAGMA table_info(`{table_name}`)").fetchall()]
+        if key_col not in table_columns or text_col not in table_columns:
+            continue
+        search_table = table_name + TEXT_SEARCH_TABLE_SUFFIX
+        cursor.execute(f"DROP TABLE IF EXISTS `{search_table}`")
+        cursor.execute(f"CREATE VIRTUAL TABLE `{search_table}` USING fts5(Key UNINDEXED, Text, "
+                       f"tokenize='{tokenizer}')")
+        cursor.execute(f"INSERT INTO `{search_table}` (Key, Text) SELECT `{key_col}`, `{text_col}` FROM `{table_name}` "
+                       f"WHERE `{text_col}` IS NOT NULL AND `{text_col}` != ''")
+        cursor.execute(f"INSERT INTO `{search_table}` (`{search_table}`) VALUES ('optimize')")
+    connection.commit()
+    print(f"...done ({time.time() - start:.1f} seconds)")
+
+
+# Get the text columns used in free-text search: the labels and synonyms of the ontology terms, the traits of the
+#  metadata and the abstracts of the references
+def _get_text_search_tables(dataset_name, ontology_name, resource_col, resource_id_col, pmid_col):
+    return [(ontology_name + "_labels", "Subject", "Object", SHORT_TEXT_TOKENIZER),
+            (ontology_name + "_synonyms", "Subject", "Object", SHORT_TEXT_TOKENIZER),
+            (dataset_name + "_metadata", resource_id_col, resource_col, SHORT_TEXT_TOKENIZER),
+            (dataset_name + "_references", pmid_col, "Abstract", LONG_TEXT_TOKENIZER)]
+
+
+# Get the typical search queries (direct, direct-subclass and entailed-subclass searches for the ontology term with
+#  most subclasses, and for the most frequently mapped term) used to report query latency before and after indexing
+def _get_search_queries(connection, dataset_name, ontology_name, resource_id_col, ontology_term_curie_col):
+    mappings_table, metadata_table = dataset_name + "_mappings", dataset_name + "_metadata"
+    cursor = connection.cursor()
+    mapping_columns = [row[1] for row in cursor.execute(f"PRAGMA table_info(`{mappings_table}`)").fetchall()]
+    if ontology_term_curie_col not in mapping_columns or resource_id_col not in mapping_columns:
+        return {}
+    top_term = cursor.execute(f"SELECT Object FROM {ontology_name}_entailed_edges "
+                              f"GROUP BY Object ORDER BY COUNT(*) DESC LIMIT 1").fetchone()
+    mapped_term = cursor.execute(f"SELECT `{ontology_term_curie_col}` FROM `{mappings_table}` "
+                                 f"GROUP BY `{ontology_term_curie_col}` ORDER BY COUNT(*) DESC LIMIT 1").fetchone()
+    queries = {}
+    for term_description, term in (("most general term", top_term), ("most mapped term", mapped_term)):
+        if term is None:
+            continue
+        for search_type, edges_table in (("direct", None), ("direct subclasses", ontology_name + "_edges"),
+                                         ("entailed subclasses", ontology_name + "_entailed_edges")):
+            query = f"SELECT DISTINCT study.* FROM `{metadata_table}` study WHERE study.`{resource_id_col}` IN (" \
+                    f"SELECT mapping.`{resource_id_col}` FROM `{mappings_table}` mapping " \
+                    f"WHERE mapping.`{ontology_term_curie_col}` IN (SELECT value FROM json_each(?))"
+            if edges_table is not None:
+                query += f" UNION SELECT mapping.`{resource_id_col}` FROM `{edges_table}` ee " \
+                         f"JOIN `{mappings_table}` mapping ON (mapping.`{ontology_term_curie_col}` = ee.Subject) " \
+                         f"WHERE ee.Object IN (SELECT value FROM json_each(?))"
+            query += ")"
+            parameters = (json.dumps([term[0]]),) * (1 if edges_table is None else 2)
+            queries[f"{search_type} search on {term_description} ({term[0]})"] = (query, parameters)
+    return queries
+
+
+# Get the time (in milliseconds) taken by each of the given queries, as the fastest of the given number of runs
+def _get_query_latencies(connection, queries, runs=3):
+    latencies = {}
+    for query_name, (query, parameters) in queries.items():
+        run_times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            connection.execute(query, parameters).fetchall()
+            run_times.append((time.perf_counter() - start) * 1000)
+        latencies[query_name] = min(run_times)
+    return latencies
+
+
+# Get the ontology mappings of the metadata: the given mappings table, combined with the text2term mappings of the
+#  values in the resource column if compute_mappings=True (or if no mappings table is given, in which case the column
+#  names of the text2term mappings are used). Returns the mappings table, and its resource, resource ID and mapped
+#  term IRI column names
+def get_ontology_mappings(metadata_df, dataset_name, ontology_url, ontology_mappings_df=None, compute_mappings=False,
+                          ontology_name="", ontology_version="", min_mapping_score=0.7, max_mappings=3, mapping_base_iris=(),
+                          resource_col=t2t_mapping_source_term_col,
+                          resource_id_col=t2t_mapping_source_term_id_col,
+                          ontology_term_col=t2t_mapping_mapped_term_col,
+                          ontology_term_iri_col=t2t_mapping_mapped_term_iri_col,
+                          ontology_term_curie_col=t2t_mapping_mapped_term_curie_col):
+    if ontology_mappings_df is None or compute_mappings:
+        t2t_mappings_df = map_metadata_to_ontologies(metadata_df=metadata_df, dataset_name=dataset_name,
+                                                     ontology_url=ontology_url, ontology_name=ontology_name,
+                                                     ontology_version=ontology_version, min_score=min_mapping_score,
+                                                     source_term_col=resource_col,
+                                                     source_term_id_col=resource_id_col,
+                                                     base_iris=mapping_base_iris,
+                                                     max_mappings=max_mappings)
+        t2t_mappings_df.columns = t2t_mappings_df.columns.str.replace(' ', '')
+        t2t_mappings_df["Source"] = "text2term"
+        if ontology_mappings_df is None:
+            resource_col = t2t_mapping_source_term_col
+            resource_id_col = t2t_mapping_source_term_id_col
+            ontology_term_iri_col = t2t_mapping_mapped_term_iri_col
+            ontology_mappings_df = t2t_mappings_df
+        else:
+            # combine t2t mappings with the given mappings table
+            t2t_mappings_df = t2t_mappings_df.rename(
+                columns={t2t_mapping_source_term_col: resource_col,
+                         t2t_mapping_source_term_id_col: resource_id_col,
+                         t2t_mapping_mapped_term_col: ontology_term_col,
+                         t2t_mapping_mapped_term_iri_col: ontology_term_iri_col,
+                         t2t_mapping_mapped_term_curie_col: ontology_term_curie_col})
+            ontology_mappings_df = pd.concat([t2t_mappings_df, ontology_mappings_df])
+    return ontology_mappings_df, resource_col, resource_id_col, ontology_term_iri_col
+
+
+# Map values in the specified metadata column to terms in the specified ontology set. Each distinct value is mapped
+#  once (see ontology_mapping.map_terms), and its mappings are given to every row that has it. The mappings of each
+#  value are kept in a SQLite cache in the resources folder (keyed by the ontology version and the mapping settings),
+#  so that only values that are new to the metadata (or to the ontology version) are mapped
 def map_metadata_to_ontologies(metadata_df, dataset_name, ontology_url, min_score, source_term_col,
-                               source_term_id_col, base_iris=(), max_mappings=3):
+                               source_term_id_col, base_iris=(), max_mappings=3, ontology_name="", ontology_version="",
+                               refresh_cache=False):
     print(f"Mapping values in metadata column '{source_term_col}' to terms in '{ontology_url}'...")
     start = time.time()
     source_terms = metadata_df[source_term_col].tolist()
@@ -169,45 +750,76 @@ def map_metadata_to_ontologies(metadata_df, dataset_name, ontology_url, min_scor
         source_term_ids = metadata_df[source_term_id_col].tolist()
     else:
         source_term_ids = ()
-    mappings = text2term.map_terms(source_terms=source_terms, source_terms_ids=source_term_ids,
-                                   target_ontology=ontology_url, excl_deprecated=True, save_graphs=False,
-                                   max_mappings=max_mappings, min_score=min_score, save_mappings=True,
-                                   output_file=os.path.join(DB_RESOURCES_FOLDER, dataset_name + "_t2t_mappings.csv"),
-                                   base_iris=base_iris, mapper=Mapper.TFIDF)
+    mappings = map_terms(source_terms=source_terms, source_term_ids=source_term_ids, ontology_url=ontology_url,
+                         base_iris=base_iris, max_mappings=max_mappings, min_score=min_score,
+                         output_file=os.path.join(DB_RESOURCES_FOLDER, dataset_name + "_t2t_mappings.csv"),
+                         cache_file=os.path.join(DB_RESOURCES_FOLDER, dataset_name + "_mappings_cache.db"),
+                         ontology_name=ontology_name, ontology_version=ontology_version, refresh_cache=refresh_cache)
     mappings.columns = mappings.columns.str.replace(" ", "")  # remove spaces from column names
     print(f"...done ({time.time() - start:.1f} seconds)")
     return mappings
 
 
-# Get publication details from PubMed (title, abstract, journal, etc) for the PMIDS in the specified column
-def get_pubmed_details(metadata_df, dataset_name, pmid_col):
+# Get publication details from PubMed (title, abstract, journal, etc) for the PMIDS in the specified column.
+# The details are kept in a SQLite cache (keyed by PMID, with the time each article was fetched) in the resources
+#  folder, so that only PMIDs that are new to the metadata are fetched, and PMIDs no longer in the metadata are dropped
+def get_pubmed_details(metadata_df, dataset_name, pmid_col, efetch_url=PUBMED_EFETCH_URL, refresh_cache=False):
     print("Fetching publication metadata from PubMed...")
     start = time.time()
-    pmids = metadata_df[pmid_col].dropna().unique()
-    fetch = PubMedFetcher()
-    articles = []
-    for pmid in tqdm(pmids):
-        article_details = get_pubmed_article_details(fetch, pmid)
-        if article_details != "":
-            articles.append(article_details)
-    references_df = pd.DataFrame(articles, columns=[pmid_col, 'Journal', 'Title', 'Abstract', 'Year', 'URL'])
+    pmids = [pmid for pmid in metadata_df[pmid_col].dropna().unique() if str(pmid) != "0" and str(pmid) != "nan"]
+    cache_connection = _open_references_cache(dataset_name)
+    try:
+        with cache_connection:
+            if refresh_cache:
+                cache_connection.execute("DELETE FROM references_cache")
+            cached_pmids = {row[0] for row in cache_connection.execute("SELECT PMID FROM references_cache")}
+            current_pmids = {str(pmid) for pmid in pmids}
+            new_pmids = [str(pmid) for pmid in pmids if str(pmid) not in cached_pmids]
+            removed_pmids = cached_pmids - current_pmids
+            cache_connection.executemany("DELETE FROM references_cache WHERE PMID=?",
+                                         [(pmid,) for pmid in removed_pmids])
+
+        # Each batch of articles is cached as soon as it is fetched, so that if another batch fails, the build fetches
+        #  only the articles still missing from the cache when it is resumed
+        articles = fetch_pubmed_articles(new_pmids, efetch_url=efetch_url,
+                                         batch_callback=lambda batch: _cache_articles(cache_connection, batch))
+        cached_references = {row[0]: row[1:] for row in cache_connection.execute(
+            "SELECT PMID, Journal, Title, Abstract, Year, URL FROM references_cache")}
+    finally:
+        cache_connection.close()
+    print(f"...reused {len(current_pmids & cached_pmids)} cached references, fetched {len(articles)} new references "
+          f"({len(new_pmids) - len(articles)} failed), dropped {len(removed_pmids)} references no longer in the metadata")
+
+    references = [(pmid,) + cached_references[str(pmid)] for pmid in pmids if str(pmid) in cached_references]
+    references_df = pd.DataFrame(references, columns=[pmid_col, 'Journal', 'Title', 'Abstract', 'Year', 'URL'])
     references_df.to_csv(os.path.join(DB_RESOURCES_FOLDER, dataset_name + "_references.tsv"), sep="\t", index=False)
     print(f"...done ({time.time() - start:.1f} seconds)")
     return references_df
 
 
-def get_pubmed_article_details(pubmed_fetcher, pmid, repeat=True):
-    if pmid != "0" and pmid != "nan":
-        try:
-            article = pubmed_fetcher.article_by_pmid(pmid)
-            title = article.title
-            journal = article.journal
-            year = article.year
-            abstract = article.abstract
-            url = article.url
-            return pmid, journal, title, abstract, year, url
-        except Exception as e:
-            # Try to fetch details once more. Sometimes the NCBI API errors out, but a second attempt (usually) succeeds
-            if repeat:
-                return get_pubmed_article_details(pubmed_fetcher, pmid, repeat=False)
-    return ""
+# Save the details of the given (newly fetched) articles to the references cache, in a transaction of their own
+def _cache_articles(cache_connection, articles):
+    fetch_timestamp = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    with cache_connection:
+        cache_connection.executemany(
+            "INSERT OR REPLACE INTO references_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(pmid, article.journal, article.title, article.abstract, article.year, article.url, fetch_timestamp)
+             for pmid, article in articles.items()])
+
+
+# Open (creating it if needed) the references cache of the given dataset. A new cache is seeded with the references
+#  table previously saved to the resources folder, if there is one
+def _open_references_cache(dataset_name):
+    cache_file = os.path.join(DB_RESOURCES_FOLDER, dataset_name + "_references_cache.db")
+    is_new_cache = not os.path.isfile(cache_file)
+    connection = sqlite3.connect(cache_file)
+    connection.execute("CREATE TABLE IF NOT EXISTS references_cache (PMID TEXT PRIMARY KEY, Journal TEXT, Title TEXT, "
+                       "Abstract TEXT, Year TEXT, URL TEXT, FetchTimestamp TEXT)")
+    references_table_file = os.path.join(DB_RESOURCES_FOLDER, dataset_name + "_references.tsv")
+    if is_new_cache and os.path.isfile(references_table_file):
+        references_df = pd.read_csv(references_table_file, sep="\t", dtype=str)
+        fetch_timestamp = datetime.fromtimestamp(os.path.getmtime(references_table_file)).strftime("%Y-%m-%dT%H:%M:%S")
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO references_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   [tuple(row) + (fetch_timestamp,) for row in references_df.itertuples(index=False)])
+    return connection
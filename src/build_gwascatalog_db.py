@@ -1,14 +1,16 @@
-import io
 import os
 import sys
-import tarfile
+import sqlite3
 import time
-import requests
+import urllib.error
 import pandas as pd
 from datetime import datetime
-from generate_ontology_tables import get_curie_id_for_term
+from download_cache import download_file
+from database_archive import create_database_archive, DEFAULT_ARCHIVE_MODE
+from export_parquet import export_database_to_parquet
+from generate_ontology_tables import get_curie_ids_for_terms, get_semsql_ontology_version
 
-__version__ = "0.9.1"
+__version__ = "0.17.0"
 
 # Specify whether to download the newest versions of the GWAS Catalog Studies and Associations tables
 DOWNLOAD_NEWEST = True
@@ -16,7 +18,7 @@ DOWNLOAD_NEWEST = True
 # Versions of ontologies and the resulting search database
 EFO_VERSION = "3.62.0"
 UBERON_VERSION = "2024-01-18"
-SEARCH_DB_VERSION = "0.10.0"
+SEARCH_DB_VERSION = "0.11.0"
 
 # Input tables from GWAS Catalog
 GWASCATALOG_STUDIES_TABLE_URL = "https://www.ebi.ac.uk/gwas/api/search/downloads/studies_alternative"
@@ -25,6 +27,8 @@ GWASCATALOG_ASSOCIATIONS_TABLE_URL = "https://www.ebi.ac.uk/gwas/api/search/down
 DATASET_NAME = "gwascatalog"
 OUTPUT_DATABASE_FILEPATH = os.path.join("..", DATASET_NAME + "_search.db")
 RESOURCES_FOLDER = os.path.join("..", "resources")
+DOWNLOADS_FOLDER = os.path.join(RESOURCES_FOLDER, "gwascatalog_downloads")
+BUILD_TIMES_FILE = os.path.join(RESOURCES_FOLDER, DATASET_NAME + "_build_times.tsv")
 
 # Column names of the studies metadata table
 INPUT_METADATA_STUDY_ID_COLUMN = "STUDY ACCESSION"
@@ -40,25 +44,48 @@ MAPPED_TRAIT_CURIE_COLUMN = "MAPPED_TRAIT_CURIE"
 OUTPUT_DB_STUDY_ID_COLUMN = "STUDY.ACCESSION"
 OUTPUT_DB_TRAIT_COLUMN = "DISEASE.TRAIT"
 
-
-def download_gwascatalog_table(table_url):
-    response = requests.get(table_url)
-    if response.status_code == 200:
-        data = response.content
-        df = pd.read_csv(io.StringIO(data.decode('utf-8')), sep="\t", low_memory=False)
-        return df
-    else:
+# Columns of the associations table kept in the output database (named as in the output database), and their types
+ASSOCIATIONS_TABLE_COLUMNS = {
+    OUTPUT_DB_STUDY_ID_COLUMN: str, "REGION": str, "CHR_ID": str, "CHR_POS": str, "REPORTED GENE(S)": str,
+    "MAPPED_GENE": str, "UPSTREAM_GENE_ID": str, "DOWNSTREAM_GENE_ID": str, "SNP_GENE_IDS": str,
+    "UPSTREAM_GENE_DISTANCE": float, "DOWNSTREAM_GENE_DISTANCE": float, "STRONGEST SNP-RISK ALLELE": str, "SNPS": str,
+    "SNP_ID_CURRENT": str, "RISK ALLELE FREQUENCY": str, "P-VALUE": float, "PVALUE_MLOG": float,
+    MAPPED_TRAIT_COLUMN: str, MAPPED_TRAIT_IRI_COLUMN: str
+}
+
+# Number of rows of the associations table parsed (and imported to the database) at a time
+ASSOCIATIONS_CHUNK_SIZE = 100000
+
+
+# Download the GWAS Catalog table at the given URL to the downloads folder, unless the previous download of the table is
+#  still up to date. Returns the path to the downloaded file
+def download_gwascatalog_table(table_url, table_name):
+    output_file = os.path.join(DOWNLOADS_FOLDER, table_name + ".tsv")
+    os.makedirs(DOWNLOADS_FOLDER, exist_ok=True)
+    try:
+        download_file(table_url, output_file)
+    except urllib.error.URLError:
         print(f"Failed to retrieve GWAS Catalog table from the URL {table_url}")
+        raise
+    return output_file
+
+
+# Parse the GWAS Catalog table in the given file incrementally, in data frames of (at most) chunk_size rows of the
+#  given columns only. Floats are parsed exactly, so that they are unchanged when the table is saved and parsed again
+def read_gwascatalog_table_chunks(table_file, usecols=None, dtype=None, chunk_size=ASSOCIATIONS_CHUNK_SIZE):
+    yield from pd.read_csv(table_file, sep="\t", usecols=usecols, dtype=dtype, chunksize=chunk_size,
+                           float_precision="round_trip")
 
 
 def get_gwascatalog_studies_table(download_newest=DOWNLOAD_NEWEST):
     if download_newest:
-        gwascatalog_studies_df = download_gwascatalog_table(GWASCATALOG_STUDIES_TABLE_URL)
+        gwascatalog_studies_df = pd.read_csv(download_gwascatalog_table(GWASCATALOG_STUDIES_TABLE_URL, "studies"),
+                                             sep="\t", low_memory=False)
     else:
         gwascatalog_studies_df = pd.read_csv(os.path.join("..", "resources", "gwascatalog_metadata.tsv"), sep="\t")
     gwascatalog_studies_df = gwascatalog_studies_df.drop(gwascatalog_studies_df.columns[0], axis=1)
-    gwascatalog_studies_df[MAPPED_TRAIT_CURIE_COLUMN] = gwascatalog_studies_df[MAPPED_TRAIT_IRI_COLUMN].apply(
-        get_curie_id_for_term)
+    gwascatalog_studies_df[MAPPED_TRAIT_CURIE_COLUMN] = get_curie_ids_for_terms(
+        gwascatalog_studies_df[MAPPED_TRAIT_IRI_COLUMN])
 
     # In studies v1.0.2 the names of columns changed w.r.t. the previous table
     gwascatalog_studies_df = gwascatalog_studies_df.rename(
@@ -68,119 +95,220 @@ def get_gwascatalog_studies_table(download_newest=DOWNLOAD_NEWEST):
     return gwascatalog_studies_df
 
 
-def get_gwascatalog_associations_table(download_newest=DOWNLOAD_NEWEST):
-    if download_newest:
-        gwascatalog_associations_df = download_gwascatalog_table(GWASCATALOG_ASSOCIATIONS_TABLE_URL)
-    else:
-        gwascatalog_associations_df = pd.read_csv(os.path.join(RESOURCES_FOLDER, "gwascatalog_associations.tsv"),
-                                                  sep="\t", low_memory=False)
-
-    gwascatalog_associations_df = gwascatalog_associations_df.rename(
-        columns={INPUT_METADATA_STUDY_ID_COLUMN: OUTPUT_DB_STUDY_ID_COLUMN})
-
-    # Reduce the table to columns of interest
-    gwascatalog_associations_df = gwascatalog_associations_df[
-        ['STUDY.ACCESSION', 'REGION', 'CHR_ID', 'CHR_POS', 'REPORTED GENE(S)', 'MAPPED_GENE', 'UPSTREAM_GENE_ID',
-         'DOWNSTREAM_GENE_ID', 'SNP_GENE_IDS', 'UPSTREAM_GENE_DISTANCE', 'DOWNSTREAM_GENE_DISTANCE',
-         'STRONGEST SNP-RISK ALLELE', 'SNPS', 'SNP_ID_CURRENT', 'RISK ALLELE FREQUENCY', 'P-VALUE', 'PVALUE_MLOG',
-         'MAPPED_TRAIT', 'MAPPED_TRAIT_URI']]
-
-    gwascatalog_associations_df[MAPPED_TRAIT_CURIE_COLUMN] = gwascatalog_associations_df['MAPPED_TRAIT_URI'].apply(
-        get_curie_id_for_term)
-
-    gwascatalog_associations_df.to_csv(os.path.join(RESOURCES_FOLDER, "gwascatalog_associations.tsv"), sep="\t", index=False)
-    return gwascatalog_associations_df
-
-
+# Stream the GWAS Catalog associations table (downloaded, or from the resources folder) into the given database and
+#  into the resources folder, one chunk at a time, reduced to the columns of interest and with the CURIEs of the mapped
+#  traits added. Returns the mapped trait IRIs of the associations (in table order), which are used to count the
+#  associations mapped to each ontology term
+def get_gwascatalog_associations_table(db_connection, download_newest=DOWNLOAD_NEWEST,
+                                       table_url=GWASCATALOG_ASSOCIATIONS_TABLE_URL,
+                                       chunk_size=ASSOCIATIONS_CHUNK_SIZE, table_name=DATASET_NAME + "_associations"):
+    from build_database import import_df_chunks_to_db
+    output_file = os.path.join(RESOURCES_FOLDER, "gwascatalog_associations.tsv")
+    input_columns = set(ASSOCIATIONS_TABLE_COLUMNS) | {INPUT_METADATA_STUDY_ID_COLUMN}
+    table_file = download_gwascatalog_table(table_url, "associations") if download_newest else output_file
+    input_chunks = read_gwascatalog_table_chunks(table_file,
+                                                 usecols=lambda column: column in input_columns,
+                                                 dtype={**ASSOCIATIONS_TABLE_COLUMNS, INPUT_METADATA_STUDY_ID_COLUMN: str},
+                                                 chunk_size=chunk_size)
+    mapped_trait_iris = []
+    # The table is written to a temporary file first, since it may be being read from the output file. If the table
+    #  cannot be read or imported, the temporary file is removed and the output file is left as is
+    chunks = _process_associations_chunks(input_chunks, output_file + ".tmp", mapped_trait_iris)
+    try:
+        import_df_chunks_to_db(db_connection, chunks, table_name=table_name)
+        os.replace(output_file + ".tmp", output_file)
+    finally:
+        if os.path.exists(output_file + ".tmp"):
+            os.remove(output_file + ".tmp")
+    return pd.concat(mapped_trait_iris, ignore_index=True).to_frame()
+
+
+# Process the given chunks of the associations table. If there are no chunks, a single chunk without rows is processed
+#  instead, so that the table is still created (and saved) with its columns
+def _process_associations_chunks(chunks, output_file, mapped_trait_iris):
+    chunk_number = -1
+    for chunk_number, chunk in enumerate(chunks):
+        yield _process_associations_chunk(chunk, chunk_number, output_file, mapped_trait_iris)
+    if chunk_number == -1:
+        empty_chunk = pd.DataFrame({column: pd.Series(dtype=object if column_type is str else column_type)
+                                    for column, column_type in ASSOCIATIONS_TABLE_COLUMNS.items()})
+        yield _process_associations_chunk(empty_chunk, 0, output_file, mapped_trait_iris)
+
+
+def _process_associations_chunk(chunk, chunk_number, output_file, mapped_trait_iris):
+    chunk = chunk.rename(columns={INPUT_METADATA_STUDY_ID_COLUMN: OUTPUT_DB_STUDY_ID_COLUMN})
+    chunk = chunk[list(ASSOCIATIONS_TABLE_COLUMNS)].copy()  # in the order of the output table
+    chunk[MAPPED_TRAIT_CURIE_COLUMN] = get_curie_ids_for_terms(chunk[MAPPED_TRAIT_IRI_COLUMN])
+    chunk.to_csv(output_file, sep="\t", index=False, header=(chunk_number == 0), mode="w" if chunk_number == 0 else "a")
+    mapped_trait_iris.append(chunk[MAPPED_TRAIT_IRI_COLUMN].copy())
+    return chunk
+
+
+# Get a text2term-formatted table of the ontology mappings in the GWAS Catalog metadata table, with a row for each of
+#  the (comma-separated) IRIs that each study is mapped to. The (comma-separated) labels of the mapped traits are split
+#  in step with the IRIs, provided there are as many labels as IRIs (labels can contain commas, in which case the
+#  mapped traits of the study are kept whole). The CURIE of each distinct IRI is obtained once
 def get_text2term_mappings_table(metadata_df):
-    mappings_list = []
-    for _, row in metadata_df.iterrows():
-        mapped_trait_uri = row[MAPPED_TRAIT_IRI_COLUMN]
-        # TODO split the comma-separated labels as well, or obtain the label for each split out IRI
-        if mapped_trait_uri != "" and not pd.isna(mapped_trait_uri):
-            if "," in mapped_trait_uri:
-                iris_list = mapped_trait_uri.split(',')
-            else:
-                iris_list = [mapped_trait_uri]
-            # Add a new row to the "mappings_df" for each IRI in the list
-            for iri in iris_list:
-                iri = iri.strip()
-                mappings = {OUTPUT_DB_STUDY_ID_COLUMN: row[OUTPUT_DB_STUDY_ID_COLUMN],
-                            OUTPUT_DB_TRAIT_COLUMN: row[OUTPUT_DB_TRAIT_COLUMN],
-                            MAPPED_TRAIT_COLUMN: row[MAPPED_TRAIT_COLUMN],
-                            MAPPED_TRAIT_IRI_COLUMN: iri,
-                            MAPPED_TRAIT_CURIE_COLUMN: get_curie_id_for_term(iri),
-                            "Tags": "None",
-                            "Source": "GWASCatalog"}
-                mappings_list.append(mappings)
-    mappings_df = pd.DataFrame(mappings_list)
+    mappings_df = metadata_df.loc[metadata_df[MAPPED_TRAIT_IRI_COLUMN].notna() &
+                                  (metadata_df[MAPPED_TRAIT_IRI_COLUMN] != ""),
+                                  [OUTPUT_DB_STUDY_ID_COLUMN, OUTPUT_DB_TRAIT_COLUMN, MAPPED_TRAIT_COLUMN,
+                                   MAPPED_TRAIT_IRI_COLUMN]].reset_index(drop=True)
+    iris = mappings_df[MAPPED_TRAIT_IRI_COLUMN].str.split(",")
+    labels = mappings_df[MAPPED_TRAIT_COLUMN].str.split(",")
+    is_split_label = (labels.str.len() == iris.str.len()).to_numpy()
+    mappings_df[MAPPED_TRAIT_IRI_COLUMN] = iris
+    mappings_df = mappings_df.explode(MAPPED_TRAIT_IRI_COLUMN)
+    is_split_label_row = is_split_label[mappings_df.index]
+    mappings_df.loc[is_split_label_row, MAPPED_TRAIT_COLUMN] = labels[is_split_label].explode().str.strip().to_numpy()
+    mappings_df[MAPPED_TRAIT_IRI_COLUMN] = mappings_df[MAPPED_TRAIT_IRI_COLUMN].str.strip()
+    mappings_df[MAPPED_TRAIT_CURIE_COLUMN] = get_curie_ids_for_terms(mappings_df[MAPPED_TRAIT_IRI_COLUMN])
+    mappings_df["Tags"] = "None"
+    mappings_df["Source"] = "GWASCatalog"
+    mappings_df = mappings_df.reset_index(drop=True)
     mappings_df.to_csv(os.path.join(RESOURCES_FOLDER, "gwascatalog_mappings.tsv"), sep="\t", index=False)
     return mappings_df
 
 
-def get_version_info_table(studies_timestamp, associations_timestamp):
+# The versions table records the versions of the ontology tables (from the latest SemanticSQL builds of the
+#  ontologies) under the name of each ontology followed by "-SemSQL"
+def get_version_info_table(studies_timestamp, associations_timestamp, semsql_versions=None):
     data = [("SearchDB", SEARCH_DB_VERSION),
             ("EFO", EFO_VERSION),
-            ("UBERON", UBERON_VERSION),
-            ("Studies", studies_timestamp),
-            ("Associations", associations_timestamp)]
+            ("UBERON", UBERON_VERSION)]
+    data += [(ontology + "-SemSQL", version) for ontology, version in (semsql_versions or {}).items()]
+    data += [("Studies", studies_timestamp),
+             ("Associations", associations_timestamp)]
     df = pd.DataFrame(data, columns=["Resource", "Version"])
     return df
 
 
-def create_tar_archive(source_file):
-    base_filename = os.path.basename(source_file)
-
-    # Create a tar archive using XZ compression
-    with tarfile.open(source_file + ".tar.xz", "w:xz") as tar:
-        tar.add(source_file, arcname=base_filename)
+# Get the versions of the latest SemanticSQL builds of the ontologies whose tables are added to the database (their
+#  database files are downloaded to the resources folder, where the build then finds them)
+def get_semsql_versions(ontologies=("EFO", "UBERON")):
+    return {ontology: get_semsql_ontology_version("https://s3.amazonaws.com/bbop-sqlite/" + ontology.lower() + ".db.gz",
+                                                  ontology_name=ontology, db_output_folder=RESOURCES_FOLDER)
+            for ontology in ontologies}
+
+
+# Check whether the database at the given path can be updated incrementally, that is, whether it exists and was built
+#  with the same versions of the search database and ontologies as the current ones, and with the ontology tables of
+#  the given (current) versions of the SemanticSQL builds of the ontologies, which an incremental update leaves as is
+def can_update_incrementally(database_file, semsql_versions):
+    if not os.path.isfile(database_file):
+        return False
+    connection = sqlite3.connect(database_file)
+    try:
+        versions = dict(connection.execute("SELECT Resource, Version FROM version_info").fetchall())
+    except sqlite3.Error:
+        versions = {}
+    connection.close()
+    current_versions = get_version_info_table("", "", semsql_versions).set_index("Resource")["Version"]
+    return all(versions.get(resource) == current_versions[resource]
+               for resource in current_versions.index if resource not in ("Studies", "Associations"))
+
+
+# Record the time taken by a (full or incremental) build of the database, and report how it compares to the last full
+#  build recorded
+def record_build_time(build_type, build_time, build_times_file=BUILD_TIMES_FILE):
+    if os.path.isfile(build_times_file):
+        build_times_df = pd.read_csv(build_times_file, sep="\t")
+    else:
+        build_times_df = pd.DataFrame(columns=["BuildType", "Finished", "Seconds"])
+    full_build_times = build_times_df.loc[build_times_df["BuildType"] == "full", "Seconds"]
+    if build_type == "incremental" and len(full_build_times) > 0:
+        print(f"Incremental update took {build_time:.1f} seconds, compared to {full_build_times.iloc[-1]:.1f} seconds "
+              f"for the last full build ({full_build_times.iloc[-1] / max(build_time, 1e-6):.1f}x faster)")
+    build_times_df.loc[len(build_times_df)] = [build_type, datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+                                               round(build_time, 1)]
+    build_times_df.to_csv(build_times_file, sep="\t", index=False)
 
 
 if __name__ == "__main__":
+    # With the --incremental option, the existing database is updated with the rows of studies and associations that
+    #  changed, provided it was built with the same versions of the search database and ontologies. The option
+    #  --archive-mode=<mode> sets the compression of the archive of the database (see database_archive.py)
+    arguments = [argument for argument in sys.argv[1:] if not argument.startswith("--")]
+    archive_mode = next((argument.split("=", 1)[1] for argument in sys.argv[1:]
+                         if argument.startswith("--archive-mode=")), DEFAULT_ARCHIVE_MODE)
+    start = time.time()
+    semsql_versions = get_semsql_versions()
+    incremental = "--incremental" in sys.argv[1:] and \
+        can_update_incrementally(OUTPUT_DATABASE_FILEPATH, semsql_versions)
+    if "--incremental" in sys.argv[1:] and not incremental:
+        print("The database cannot be updated incrementally (it does not exist, or was built with different versions "
+              "of the search database or ontologies)—building it from scratch")
+
     print("Downloading GWAS Catalog Studies table...")
     studies_df = get_gwascatalog_studies_table()  # get studies metadata table
     studies_download_timestamp = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
 
     print("Downloading GWAS Catalog Associations table...")
-    associations_df = get_gwascatalog_associations_table()  # get associations table
+    from build_database import connect_to_database, STAGED_TABLE_SUFFIX
+    associations_table = DATASET_NAME + "_associations" + (STAGED_TABLE_SUFFIX if incremental else "")
+    connection = sqlite3.connect(OUTPUT_DATABASE_FILEPATH) if incremental else \
+        connect_to_database(OUTPUT_DATABASE_FILEPATH)
+    associations_df = get_gwascatalog_associations_table(connection, table_name=associations_table)  # stream into db
+    connection.close()
     associations_download_timestamp = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
 
-    version_info_df = get_version_info_table(studies_download_timestamp, associations_download_timestamp)
+    version_info_df = get_version_info_table(studies_download_timestamp, associations_download_timestamp,
+                                             semsql_versions)
 
-    extra_tables = {"version_info": version_info_df,
-                    "gwascatalog_associations": associations_df}
+    extra_tables = {"version_info": version_info_df}
 
     # Generate and save a text2term-formatted table of ontology mappings in the GWAS Catalog metadata table
     ontology_mappings = get_text2term_mappings_table(studies_df)
 
     # Check if an NCBI API Key is provided
-    if len(sys.argv) > 1:
-        os.environ["NCBI_API_KEY"] = sys.argv[1]
+    if len(arguments) > 0:
+        os.environ["NCBI_API_KEY"] = arguments[0]
         print(f"Using NCBI API Key: {os.environ.get('NCBI_API_KEY')}")
     else:
         print("NCBI API Key not provided—PubMed queries will be slower. Provide API Key as a parameter to this module.")
 
-    start = time.time()
-    from build_database import build_database
-    build_database(metadata_df=studies_df,
-                   output_database_filepath=OUTPUT_DATABASE_FILEPATH,
-                   ontology_mappings_df=ontology_mappings,
-                   compute_mappings=True,
-                   include_cross_ontology_references_table=True,
-                   min_mapping_score=0.1,
-                   max_mappings=1,
-                   ontology_url=f"http://www.ebi.ac.uk/efo/releases/v{EFO_VERSION}/efo.owl",
-                   resource_col=OUTPUT_DB_TRAIT_COLUMN,
-                   resource_id_col=OUTPUT_DB_STUDY_ID_COLUMN,
-                   ontology_term_col=MAPPED_TRAIT_COLUMN,
-                   ontology_term_iri_col=MAPPED_TRAIT_IRI_COLUMN,
-                   ontology_term_curie_col=MAPPED_TRAIT_CURIE_COLUMN,
-                   pmid_col=PUBMED_ID_COLUMN,
-                   mapping_base_iris=("http://www.ebi.ac.uk/efo/", "http://purl.obolibrary.org/obo/MONDO",
-                                      "http://purl.obolibrary.org/obo/HP", "http://www.orpha.net/ORDO",
-                                      "http://purl.obolibrary.org/obo/DOID"),
-                   additional_tables=extra_tables,
-                   additional_ontologies=["UBERON"]
-                   )
-    create_tar_archive(source_file=OUTPUT_DATABASE_FILEPATH)
-    print(f"Finished building database ({time.time() - start:.1f} seconds)")
+    database_arguments = dict(metadata_df=studies_df,
+                              dataset_name=DATASET_NAME,
+                              ontology_name="EFO",
+                              output_database_filepath=OUTPUT_DATABASE_FILEPATH,
+                              ontology_mappings_df=ontology_mappings,
+                              compute_mappings=True,
+                              min_mapping_score=0.1,
+                              max_mappings=1,
+                              ontology_url=f"http://www.ebi.ac.uk/efo/releases/v{EFO_VERSION}/efo.owl",
+                              ontology_version=EFO_VERSION,
+                              resource_col=OUTPUT_DB_TRAIT_COLUMN,
+                              resource_id_col=OUTPUT_DB_STUDY_ID_COLUMN,
+                              ontology_term_col=MAPPED_TRAIT_COLUMN,
+                              ontology_term_iri_col=MAPPED_TRAIT_IRI_COLUMN,
+                              ontology_term_curie_col=MAPPED_TRAIT_CURIE_COLUMN,
+                              pmid_col=PUBMED_ID_COLUMN,
+                              mapping_base_iris=("http://www.ebi.ac.uk/efo/", "http://purl.obolibrary.org/obo/MONDO",
+                                                 "http://purl.obolibrary.org/obo/HP", "http://www.orpha.net/ORDO",
+                                                 "http://purl.obolibrary.org/obo/DOID"),
+                              additional_tables=extra_tables,
+                              association_term_iri_col=MAPPED_TRAIT_IRI_COLUMN)
+    if incremental:
+        from build_database import update_database
+        update_database(**database_arguments,
+                        staged_associations_table=associations_table,
+                        association_key_col=OUTPUT_DB_STUDY_ID_COLUMN)
+    else:
+        from build_database import build_database
+        build_database(**database_arguments,
+                       include_cross_ontology_references_table=True,
+                       additional_ontologies=["UBERON"],
+                       associations_df=associations_df,
+                       additional_indexes=[("gwascatalog_associations", [OUTPUT_DB_STUDY_ID_COLUMN])])
+
+    # Export the tables of the database to Parquet files next to it, for columnar (memory-mapped) loading
+    print("Exporting the database tables to Parquet...")
+    try:
+        export_database_to_parquet(OUTPUT_DATABASE_FILEPATH)
+    except ImportError as error:
+        print(f"...skipping the export of the tables to Parquet: {error}")
+
+    print("Compressing the database...")
+    create_database_archive(OUTPUT_DATABASE_FILEPATH, mode=archive_mode)
+    build_time = time.time() - start
+    print(f"Finished {'updating' if incremental else 'building'} database ({build_time:.1f} seconds)")
+    record_build_time("incremental" if incremental else "full", build_time)
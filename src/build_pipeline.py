@@ -0,0 +1,142 @@
+import os
+import time
+import pickle
+import hashlib
+import pandas as pd
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+__version__ = "0.1.0"
+
+# Folder where the output of each finished stage is saved, so that a failed build can be resumed from the stages that
+#  did not finish
+CHECKPOINTS_FOLDER = os.path.join("..", "resources", "build_checkpoints")
+
+# Maximum number of stages run concurrently (each in its own process)
+MAX_WORKERS = 4
+
+
+# A stage of a build: a function called with the given arguments, plus the outputs of the stages it depends on, given
+#  as a dictionary of argument names to the names of those stages
+class Stage:
+    def __init__(self, name, function, arguments=None, inputs=None):
+        self.name = name
+        self.function = function
+        self.arguments = arguments if arguments is not None else {}
+        self.inputs = inputs if inputs is not None else {}
+
+
+# Run the given stages, each once the stages it depends on have finished, running independent stages concurrently in a
+#  pool of (at most) max_workers processes, or one after another in this process if max_workers=1. The output of each
+#  stage is saved to the checkpoints folder, under a fingerprint of the stage's function, arguments and inputs, and a
+#  stage whose checkpoint exists (e.g., from a previous build that failed) is not run again. If a stage fails, the
+#  stages already running are allowed to finish (and are saved), and the error is raised. Returns the outputs of the
+#  stages by name, and a table of the stages with their start time and the time taken to run them or load their output
+def run_stages(stages, checkpoints_folder=CHECKPOINTS_FOLDER, max_workers=MAX_WORKERS):
+    os.makedirs(checkpoints_folder, exist_ok=True)
+    fingerprints = _get_fingerprints(stages)
+    pending_stages = list(stages)
+    running_stages = {}
+    outputs = {}
+    timings = []
+    error = None
+    executor = ProcessPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+    try:
+        while (len(pending_stages) > 0 and error is None) or len(running_stages) > 0:
+            ready_stages = [stage for stage in pending_stages if error is None and
+                            all(input_stage in outputs for input_stage in stage.inputs.values())]
+            for stage in ready_stages:
+                pending_stages.remove(stage)
+                checkpoint_file = _get_checkpoint_file(checkpoints_folder, stage, fingerprints)
+                arguments = {**stage.arguments,
+                             **{argument: outputs[input_stage] for argument, input_stage in stage.inputs.items()}}
+                if os.path.isfile(checkpoint_file):
+                    started = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+                    start = time.time()
+                    outputs[stage.name] = pd.read_pickle(checkpoint_file)
+                    timings.append((stage.name, "resumed", started, round(time.time() - start, 3)))
+                    print(f"Stage {stage.name}: resumed from checkpoint")
+                elif executor is None:
+                    print(f"Stage {stage.name}: started")
+                    _save_stage_output(stage, _run_stage(stage.function, arguments), checkpoint_file, outputs,
+                                       timings)
+                else:
+                    print(f"Stage {stage.name}: started")
+                    running_stages[executor.submit(_run_stage, stage.function, arguments)] = stage
+            if len(running_stages) > 0:
+                finished, _ = wait(running_stages, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running_stages.pop(future)
+                    try:
+                        _save_stage_output(stage, future.result(), _get_checkpoint_file(checkpoints_folder, stage,
+                                                                                        fingerprints),
+                                           outputs, timings)
+                    except Exception as stage_error:
+                        print(f"Stage {stage.name}: failed ({stage_error!r})")
+                        error = error or stage_error
+            elif len(ready_stages) == 0 and len(pending_stages) > 0 and error is None:
+                raise ValueError(f"The inputs of stages {[stage.name for stage in pending_stages]} cannot be resolved")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if error is not None:
+        raise error
+    return outputs, pd.DataFrame(timings, columns=["Stage", "Status", "Started", "Seconds"])
+
+
+# Remove the checkpoints of the given stages (e.g., once the build they were part of completed)
+def clear_checkpoints(stages, checkpoints_folder=CHECKPOINTS_FOLDER):
+    fingerprints = _get_fingerprints(stages)
+    for stage in stages:
+        checkpoint_file = _get_checkpoint_file(checkpoints_folder, stage, fingerprints)
+        if os.path.isfile(checkpoint_file):
+            os.remove(checkpoint_file)
+
+
+def _run_stage(function, arguments):
+    started = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    start = time.time()
+    output = function(**arguments)
+    return output, started, time.time() - start
+
+
+def _save_stage_output(stage, result, checkpoint_file, outputs, timings):
+    output, started, seconds = result
+    pd.to_pickle(output, checkpoint_file + ".part")
+    os.replace(checkpoint_file + ".part", checkpoint_file)
+    outputs[stage.name] = output
+    timings.append((stage.name, "completed", started, round(seconds, 3)))
+    print(f"Stage {stage.name}: done ({seconds:.1f} seconds)")
+
+
+# Fingerprint each stage by its function, its arguments and the fingerprints of the stages it depends on, so that a
+#  checkpoint is only reused by a stage that would compute the same output
+def _get_fingerprints(stages):
+    stages_by_name = {stage.name: stage for stage in stages}
+    fingerprints = {}
+
+    def get_fingerprint(stage):
+        if stage.name not in fingerprints:
+            arguments = sorted((argument, _get_digest(value)) for argument, value in stage.arguments.items())
+            sha256 = hashlib.sha256(pickle.dumps((stage.function.__module__, stage.function.__qualname__, arguments)))
+            for argument, input_stage in sorted(stage.inputs.items()):
+                sha256.update(f"{argument}={get_fingerprint(stages_by_name[input_stage])}".encode())
+            fingerprints[stage.name] = sha256.hexdigest()
+        return fingerprints[stage.name]
+
+    for stage in stages:
+        get_fingerprint(stage)
+    return fingerprints
+
+
+# Data frames are digested by their contents (the pickled representation of equal data frames may differ)
+def _get_digest(value):
+    if isinstance(value, pd.DataFrame):
+        row_hashes = pd.util.hash_pandas_object(value, index=True).to_numpy()
+        return hashlib.sha256(pickle.dumps((list(value.columns), list(value.dtypes.astype(str)))) +
+                              row_hashes.tobytes()).hexdigest()
+    return value
+
+
+def _get_checkpoint_file(checkpoints_folder, stage, fingerprints):
+    return os.path.join(checkpoints_folder, f"{stage.name}-{fingerprints[stage.name][:16]}.pkl")
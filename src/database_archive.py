@@ -0,0 +1,194 @@
+import os
+import sys
+import lzma
+import time
+import shutil
+import tarfile
+import hashlib
+import tempfile
+import subprocess
+import pandas as pd
+from contextlib import contextmanager
+from download_cache import get_sha256
+
+try:
+    import zstandard
+except ImportError:  # optional: zstd archives are otherwise (de)compressed by the zstd command, if it is installed
+    zstandard = None
+
+__version__ = "0.1.0"
+
+# Modes of compression of the tar archive in which the database is distributed, and the extensions of their files:
+#  xz: xz compressed by Python's lzma module, in a single thread (the original format)
+#  xz-threads: xz compressed in blocks by the xz command, with a thread per CPU core. The archive is a standard xz
+#   file (readable by tar and Python's lzma module), whose blocks the xz command also decompresses in parallel
+#  zstd: Zstandard compressed by the zstd command (or the zstandard package), with a thread per CPU core
+ARCHIVE_EXTENSIONS = {"xz": ".tar.xz", "xz-threads": ".tar.xz", "zstd": ".tar.zst"}
+DEFAULT_ARCHIVE_MODE = "xz-threads"
+
+XZ_PRESET = 6
+ZSTD_LEVEL = 19
+
+# Commands that compress the tar stream (from standard input to standard output) in each mode that uses an external
+#  compressor, and that decompress an archive of each extension (to standard output)
+COMPRESS_COMMANDS = {"xz-threads": ["xz", f"-{XZ_PRESET}", "-T0", "-c"],
+                     "zstd": ["zstd", f"-{ZSTD_LEVEL}", "-T0", "-q", "-c"]}
+DECOMPRESS_COMMANDS = {".tar.xz": ["xz", "-d", "-T0", "-c"], ".tar.zst": ["zstd", "-d", "-q", "-c"]}
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+ARCHIVE_MODES_REPORT_FILE = os.path.join("..", "resources", "archive_modes.tsv")
+
+
+# Create a tar archive of the given database file in the given folder (by default, the folder of the database), with
+#  the compression of the given mode, and save the SHA-256 checksum of the database next to it (in the format of
+#  sha256sum), so that an extracted database that is up to date does not need to be extracted again. The tar stream is
+#  compressed as it is written. Returns the path of the archive
+def create_database_archive(database_file, mode=DEFAULT_ARCHIVE_MODE, output_folder=""):
+    if mode == "xz-threads" and shutil.which("xz") is None:
+        print("...the xz command is not installed—compressing the archive in a single thread")
+        mode = "xz"
+    output_folder = output_folder or os.path.dirname(database_file)
+    database_name = os.path.basename(database_file)
+    archive_file = os.path.join(output_folder, database_name + ARCHIVE_EXTENSIONS[mode])
+    start = time.time()
+    with open(archive_file + ".part", "wb") as file_out:
+        with _open_compressed_stream(file_out, mode) as stream, \
+                tarfile.open(fileobj=stream, mode="w|xz" if mode == "xz" else "w|") as tar:
+            tar.add(database_file, arcname=database_name)
+    os.replace(archive_file + ".part", archive_file)
+    with open(os.path.join(output_folder, database_name + ".sha256"), "w") as checksum_file:
+        checksum_file.write(f"{get_sha256(database_file)}  {database_name}\n")
+    print(f"...done creating {os.path.basename(archive_file)} ({mode}, {time.time() - start:.1f} seconds, "
+          f"compression ratio {os.path.getsize(database_file) / max(os.path.getsize(archive_file), 1):.1f})")
+    return archive_file
+
+
+# Extract the database from the given archive (of any mode) to the given folder (by default, the folder of the
+#  archive), decompressing it as a stream straight to the database file, unless the database was already extracted and
+#  matches the checksum saved next to the archive. The extracted database is checked against the checksum, if there is
+#  one. Returns the path of the database file
+def extract_database_archive(archive_file, output_folder=""):
+    extension = next(extension for extension in DECOMPRESS_COMMANDS if archive_file.endswith(extension))
+    database_name = os.path.basename(archive_file)[:-len(extension)]
+    output_folder = output_folder or os.path.dirname(archive_file)
+    database_file = os.path.join(output_folder, database_name)
+    checksum = _read_checksum(os.path.join(os.path.dirname(archive_file), database_name + ".sha256"))
+    if checksum is not None and os.path.isfile(database_file) and get_sha256(database_file) == checksum:
+        print(f"...{database_name} is up to date (matches the checksum of {os.path.basename(archive_file)})")
+        return database_file
+    start = time.time()
+    sha256 = hashlib.sha256()
+    is_extracted = False
+    with _open_decompressed_stream(archive_file, extension) as stream:
+        with tarfile.open(fileobj=stream, mode="r|") as tar:
+            for member in tar:
+                if member.isfile() and member.name == database_name:
+                    with tar.extractfile(member) as file_in, open(database_file + ".part", "wb") as file_out:
+                        for block in iter(lambda: file_in.read(COPY_BUFFER_SIZE), b""):
+                            sha256.update(block)
+                            file_out.write(block)
+                    is_extracted = True
+        while stream.read(COPY_BUFFER_SIZE):  # read the padding after the end of the tar stream
+            pass
+    if not is_extracted:
+        raise ValueError(f"{archive_file} does not contain {database_name}")
+    if checksum is not None and sha256.hexdigest() != checksum:
+        os.remove(database_file + ".part")
+        raise ValueError(f"{database_name} extracted from {archive_file} does not match its checksum")
+    os.replace(database_file + ".part", database_file)
+    print(f"...done extracting {database_name} ({time.time() - start:.1f} seconds)")
+    return database_file
+
+
+# Compare the archive modes available here by the size of the archive of the given database, its compression ratio,
+#  and the time taken to create the archive and to extract the database from it. The archives are created and
+#  extracted in a temporary folder. Returns the comparison table, which is also saved to the given report file
+def compare_archive_modes(database_file, modes=tuple(ARCHIVE_EXTENSIONS), report_file=ARCHIVE_MODES_REPORT_FILE):
+    database_size = os.path.getsize(database_file)
+    report = []
+    for mode in modes:
+        if not is_archive_mode_available(mode):
+            print(f"...skipping archive mode {mode} (not available)")
+            continue
+        with tempfile.TemporaryDirectory() as archive_folder:
+            start = time.time()
+            archive_file = create_database_archive(database_file, mode=mode, output_folder=archive_folder)
+            compress_seconds = time.time() - start
+            extraction_folder = os.path.join(archive_folder, "extracted")
+            os.makedirs(extraction_folder)
+            start = time.time()
+            extract_database_archive(archive_file, output_folder=extraction_folder)
+            decompress_seconds = time.time() - start
+            archive_size = os.path.getsize(archive_file)
+        report.append((mode, round(archive_size / 2 ** 20, 1), round(database_size / max(archive_size, 1), 2),
+                       round(compress_seconds, 1), round(decompress_seconds, 1)))
+    report_df = pd.DataFrame(report, columns=["Mode", "ArchiveSize(MiB)", "CompressionRatio", "CompressSeconds",
+                                              "DecompressSeconds"])
+    report_df.to_csv(report_file, sep="\t", index=False)
+    print(f"Archive modes of {os.path.basename(database_file)} ({database_size / 2 ** 20:.1f} MiB, "
+          f"{os.cpu_count()} CPU cores):")
+    print(report_df.to_string(index=False))
+    return report_df
+
+
+def is_archive_mode_available(mode):
+    if mode == "zstd":
+        return shutil.which("zstd") is not None or zstandard is not None
+    return mode == "xz" or shutil.which("xz") is not None
+
+
+# Open a stream that compresses what is written to it into the given file, with the compressor of the given mode (in
+#  xz mode, the tar stream is compressed by the tarfile module itself)
+@contextmanager
+def _open_compressed_stream(file_out, mode):
+    if mode == "xz":
+        yield file_out
+    elif mode in COMPRESS_COMMANDS and shutil.which(COMPRESS_COMMANDS[mode][0]) is not None:
+        process = subprocess.Popen(COMPRESS_COMMANDS[mode], stdin=subprocess.PIPE, stdout=file_out)
+        try:
+            yield process.stdin
+        finally:
+            process.stdin.close()
+            if process.wait() != 0:
+                raise RuntimeError(f"{' '.join(COMPRESS_COMMANDS[mode])} failed (exit status {process.returncode})")
+    elif mode == "zstd" and zstandard is not None:
+        with zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=-1).stream_writer(file_out, closefd=False) as stream:
+            yield stream
+    else:
+        raise ValueError(f"Archive mode {mode} is not available (install the {mode.split('-')[0]} command)")
+
+
+# Open a stream of the decompressed contents of the given archive, decompressed by the command for its extension if it
+#  is installed, and otherwise by Python's lzma module (xz) or the zstandard package (zstd)
+@contextmanager
+def _open_decompressed_stream(archive_file, extension):
+    if shutil.which(DECOMPRESS_COMMANDS[extension][0]) is not None:
+        process = subprocess.Popen(DECOMPRESS_COMMANDS[extension] + [archive_file], stdout=subprocess.PIPE)
+        try:
+            yield process.stdout
+        finally:
+            process.stdout.close()
+            if process.wait() != 0:
+                raise RuntimeError(f"{' '.join(DECOMPRESS_COMMANDS[extension])} failed "
+                                   f"(exit status {process.returncode})")
+    elif extension == ".tar.xz":
+        with lzma.open(archive_file, "rb") as stream:
+            yield stream
+    elif zstandard is not None:
+        with open(archive_file, "rb") as file_in, zstandard.ZstdDecompressor().stream_reader(file_in) as stream:
+            yield stream
+    else:
+        raise ValueError(f"{archive_file} cannot be decompressed (install the zstd command or the zstandard package)")
+
+
+def _read_checksum(checksum_file):
+    if not os.path.isfile(checksum_file):
+        return None
+    with open(checksum_file) as file_in:
+        return file_in.read().split()[0]
+
+
+# Compare the archive modes for the given database (by default, the GWAS Catalog search database)
+if __name__ == '__main__':
+    compare_archive_modes(sys.argv[1] if len(sys.argv) > 1 else os.path.join("..", "gwascatalog_search.db"))
@@ -0,0 +1,150 @@
+import os
+import gzip
+import json
+import shutil
+import hashlib
+import threading
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, where the manifest is only locked between threads
+    fcntl = None
+
+__version__ = "0.2.0"
+
+# Manifest of the downloaded (and decompressed) files, which records, for each file, where it came from and the state
+#  it was left in (its size and modification time), so that files that have not changed since are not fetched again
+MANIFEST_FILE = os.path.join("..", "resources", "download_manifest.json")
+
+COPY_BUFFER_SIZE = 1024 * 1024
+REQUEST_TIMEOUT_SECONDS = 600
+
+_manifest_lock = threading.Lock()
+
+
+# Download the file at the given URL to the given output file, unless the output file is a previous download of the
+#  URL that is still current. The request is conditional on the ETag and Last-Modified headers of the previous
+#  download, so an unchanged file is not transferred again (by servers that support conditional requests). A file
+#  that is transferred again but whose SHA-256 digest is unchanged is left as is. Returns True if the output file
+#  changed, and False otherwise
+def download_file(url, output_file, manifest_file=MANIFEST_FILE):
+    entry = _get_manifest_entry(manifest_file, output_file)
+    is_cached = entry.get("URL") == url and _is_unchanged(output_file, entry)
+    headers = {}
+    if is_cached and entry.get("ETag"):
+        headers["If-None-Match"] = entry["ETag"]
+    if is_cached and entry.get("LastModified"):
+        headers["If-Modified-Since"] = entry["LastModified"]
+    try:
+        response = urllib.request.urlopen(urllib.request.Request(url, headers=headers),
+                                          timeout=REQUEST_TIMEOUT_SECONDS)
+    except urllib.error.HTTPError as error:
+        if error.code == 304 and is_cached:
+            print(f"...{os.path.basename(output_file)} is up to date (not modified since {entry['Downloaded']})")
+            return False
+        raise
+    with response:
+        sha256 = hashlib.sha256()
+        with open(output_file + ".part", "wb") as file_out:
+            for block in iter(lambda: response.read(COPY_BUFFER_SIZE), b""):
+                sha256.update(block)
+                file_out.write(block)
+        response_headers = response.headers
+    is_changed = not (is_cached and entry.get("SHA256") == sha256.hexdigest())
+    if is_changed:
+        os.replace(output_file + ".part", output_file)
+    else:
+        os.remove(output_file + ".part")
+        print(f"...{os.path.basename(output_file)} is up to date (unchanged content)")
+    previous_entry = {} if is_changed else entry  # keep the validators of an unchanged file if none are given
+    _update_manifest_entry(manifest_file, output_file, {
+        "URL": url,
+        "ETag": response_headers.get("ETag") or previous_entry.get("ETag"),
+        "LastModified": response_headers.get("Last-Modified") or previous_entry.get("LastModified"),
+        "SHA256": sha256.hexdigest(),
+        "Downloaded": datetime.now().strftime("%Y-%m-%dT%H:%M:%S") if is_changed else entry["Downloaded"]
+    })
+    return is_changed
+
+
+# Decompress the given gzip file to the given output file, unless the output file was already decompressed from the
+#  same (by SHA-256 digest) gzip file and has not changed since. The file is decompressed a block at a time. Returns
+#  True if the output file changed, and False otherwise
+def decompress_gzip_file(gz_file, output_file, manifest_file=MANIFEST_FILE):
+    gz_entry = _get_manifest_entry(manifest_file, gz_file)
+    gz_sha256 = gz_entry["SHA256"] if _is_unchanged(gz_file, gz_entry) else get_sha256(gz_file)
+    entry = _get_manifest_entry(manifest_file, output_file)
+    if entry.get("SourceSHA256") == gz_sha256 and _is_unchanged(output_file, entry):
+        print(f"...{os.path.basename(output_file)} is up to date (already decompressed)")
+        return False
+    with gzip.open(gz_file, "rb") as file_in, open(output_file + ".part", "wb") as file_out:
+        shutil.copyfileobj(file_in, file_out, COPY_BUFFER_SIZE)
+    os.replace(output_file + ".part", output_file)
+    _update_manifest_entry(manifest_file, output_file, {"Source": os.path.basename(gz_file),
+                                                        "SourceSHA256": gz_sha256})
+    return True
+
+
+def get_sha256(file):
+    sha256 = hashlib.sha256()
+    with open(file, "rb") as file_in:
+        for block in iter(lambda: file_in.read(COPY_BUFFER_SIZE), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+# Check whether the given file exists and is in the state (size and modification time) recorded in its manifest entry
+def _is_unchanged(file, entry):
+    if not os.path.exists(file) or "Size" not in entry:
+        return False
+    file_stat = os.stat(file)
+    return file_stat.st_size == entry["Size"] and file_stat.st_mtime_ns == entry["ModifiedTime"]
+
+
+# Lock the manifest between threads and, where file locks are available, between processes (such as the build stages
+#  that download ontologies concurrently)
+@contextmanager
+def _lock_manifest(manifest_file):
+    with _manifest_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(manifest_file)), exist_ok=True)
+        with open(manifest_file + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _get_manifest_entry(manifest_file, file):
+    with _lock_manifest(manifest_file):
+        return _read_manifest(manifest_file).get(_get_manifest_key(manifest_file, file), {})
+
+
+def _update_manifest_entry(manifest_file, file, entry):
+    file_stat = os.stat(file)
+    entry = {**entry, "Size": file_stat.st_size, "ModifiedTime": file_stat.st_mtime_ns}
+    with _lock_manifest(manifest_file):
+        manifest = _read_manifest(manifest_file)
+        manifest[_get_manifest_key(manifest_file, file)] = entry
+        with open(manifest_file + ".part", "w") as file_out:
+            json.dump(manifest, file_out, indent=2, sort_keys=True)
+        os.replace(manifest_file + ".part", manifest_file)
+
+
+def _read_manifest(manifest_file):
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as file_in:
+        return json.load(file_in)
+
+
+# Files are recorded by their path relative to the manifest, so that the manifest is valid from any working directory
+def _get_manifest_key(manifest_file, file):
+    return os.path.relpath(os.path.abspath(file), os.path.dirname(os.path.abspath(manifest_file))).replace(os.sep, "/")
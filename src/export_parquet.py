@@ -0,0 +1,95 @@
+import os
+import time
+import sqlite3
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: without it, the tables are only available in the database (and the TSV files)
+    pa = None
+    pq = None
+
+__version__ = "0.3.0"
+
+# The Parquet files of the tables of a database are saved to a folder next to the database file, named after it
+PARQUET_FOLDER_SUFFIX = "_parquet"
+
+# Number of rows in each row group of the Parquet files, which are read from the database and written a row group at a
+#  time
+PARQUET_ROW_GROUP_SIZE = 100000
+
+PARQUET_COMPRESSION = "zstd"
+
+# Columns by which the rows of a table are sorted (the first of them that the table has), so that the row groups hold
+#  non-overlapping ranges of their values, and reads filtered on them skip the row groups that cannot match (by the
+#  minimum and maximum values recorded for each row group)
+SORT_COLUMNS = ("Subject", "STUDY.ACCESSION")
+
+# Arrow types of the columns of each SQLite type declared by build_database.import_df_to_db
+ARROW_TYPES = {"INTEGER": "int64", "REAL": "float64", "TEXT": "string"}
+
+
+# Export every table of the given SQLite database to a compressed, dictionary-encoded Parquet file named after the
+#  table, in the given folder (by default, a folder next to the database named after it). Files of tables that are no
+#  longer in the database are removed. Returns the paths of the Parquet files
+def export_database_to_parquet(database_filepath, output_folder=""):
+    if pq is None:
+        raise ImportError("Exporting the database tables to Parquet requires pyarrow (pip install pyarrow)")
+    if output_folder == "":
+        output_folder = get_parquet_folder(database_filepath)
+    os.makedirs(output_folder, exist_ok=True)
+    start = time.time()
+    connection = sqlite3.connect(database_filepath)
+    table_names = _get_exported_tables(connection)
+    output_files = [export_table_to_parquet(connection, table_name, os.path.join(output_folder, table_name + ".parquet"))
+                    for table_name in table_names]
+    connection.close()
+    for file_name in os.listdir(output_folder):
+        if file_name.endswith(".parquet") and file_name[:-len(".parquet")] not in table_names:
+            os.remove(os.path.join(output_folder, file_name))
+    print(f"...done exporting {len(table_names)} tables to Parquet ({time.time() - start:.1f} seconds)")
+    return output_files
+
+
+# Export the given table of the database to the given Parquet file, with its rows sorted by the first of the sort
+#  columns that the table has (and otherwise in the order of the table), and with the Arrow types of its declared
+#  column types. Returns the path of the Parquet file
+def export_table_to_parquet(connection, table_name, output_file):
+    start = time.time()
+    table_columns = connection.execute(f"PRAGMA table_info(`{table_name}`)").fetchall()
+    schema = pa.schema([(column[1], pa.type_for_alias(ARROW_TYPES.get(column[2].upper(), "string")))
+                        for column in table_columns])
+    sort_column = next((column for column in SORT_COLUMNS if column in schema.names), None)
+    # Tables without a rowid (such as the term resources table) are read in the order of their primary key
+    table_sql = connection.execute("SELECT sql FROM sqlite_master WHERE name = ?", (table_name,)).fetchone()[0]
+    order_by = ([f"`{sort_column}`"] if sort_column is not None else []) + \
+        ([] if table_sql.upper().rstrip().endswith("WITHOUT ROWID") else ["rowid"])
+    cursor = connection.execute(f"SELECT * FROM `{table_name}`" + (f" ORDER BY {', '.join(order_by)}" if order_by else ""))
+    row_count = 0
+    with pq.ParquetWriter(output_file + ".part", schema, compression=PARQUET_COMPRESSION,
+                          use_dictionary=True) as writer:
+        while True:
+            rows = cursor.fetchmany(PARQUET_ROW_GROUP_SIZE)
+            if len(rows) == 0:
+                break
+            columns = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema), row_group_size=PARQUET_ROW_GROUP_SIZE)
+            row_count += len(rows)
+    os.replace(output_file + ".part", output_file)
+    print(f"\tExported {row_count} rows of table {table_name} to {os.path.basename(output_file)} in "
+          f"{time.time() - start:.1f} seconds ({os.path.getsize(output_file) / 2 ** 20:.1f} MiB)")
+    return output_file
+
+
+# Get the names of the tables of the database that are exported: its ordinary tables, leaving out virtual tables (such
+#  as the full-text search tables) and the shadow tables in which they store their data
+def _get_exported_tables(connection):
+    tables = connection.execute("SELECT name, sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' "
+                                "ORDER BY name").fetchall()
+    virtual_tables = [name for name, sql in tables if sql.upper().startswith("CREATE VIRTUAL TABLE")]
+    return [name for name, _ in tables
+            if not any(name == virtual_table or name.startswith(virtual_table + "_") for virtual_table in virtual_tables)]
+
+
+def get_parquet_folder(database_filepath):
+    return os.path.splitext(database_filepath)[0] + PARQUET_FOLDER_SUFFIX
@@ -0,0 +1,121 @@
+import os
+import time
+import random
+import threading
+import requests
+from lxml import etree
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from metapub import PubMedArticle
+
+__version__ = "0.2.0"
+
+PUBMED_EFETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+
+# NCBI E-utilities allow 3 requests per second without an API key, and 10 requests per second with one
+REQUESTS_PER_SECOND = 3
+REQUESTS_PER_SECOND_WITH_API_KEY = 10
+
+BATCH_SIZE = 200  # number of PMIDs fetched in each EFetch request
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1  # initial delay before retrying a failed request, doubled on each subsequent attempt
+REQUEST_TIMEOUT_SECONDS = 60
+
+
+# Fetch the PubMed articles with the given PMIDs, in batches of PMIDs per EFetch request that are sent concurrently
+#  at the request rate allowed by NCBI. Requests that fail transiently (rate limited, server errors, or network errors)
+#  are retried with exponential backoff, and a RuntimeError is raised if one still fails after max_retries retries
+#  (once all the other batches are fetched). A batch that is rejected (any other 4xx status) is split in halves, so
+#  that only the PMIDs rejected by themselves are left out. If given, batch_callback is called (in the calling thread)
+#  with the articles of each batch as soon as it is fetched, so that they can be saved even if another batch fails.
+#  Returns a dictionary of PMID (as a string) to metapub PubMedArticle
+def fetch_pubmed_articles(pmids, efetch_url=PUBMED_EFETCH_URL, batch_size=BATCH_SIZE, api_key=None,
+                          max_retries=MAX_RETRIES, backoff_seconds=BACKOFF_SECONDS, show_progress=True,
+                          batch_callback=None):
+    if api_key is None:
+        api_key = os.environ.get("NCBI_API_KEY")
+    requests_per_second = REQUESTS_PER_SECOND_WITH_API_KEY if api_key else REQUESTS_PER_SECOND
+    rate_limiter = _RateLimiter(requests_per_second)
+    pmids = [str(pmid) for pmid in pmids]
+    batches = [pmids[i:i + batch_size] for i in range(0, len(pmids), batch_size)]
+    articles = {}
+    error = None
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=requests_per_second) as executor:
+        futures = [executor.submit(_fetch_batch, session, rate_limiter, batch, efetch_url, api_key, max_retries,
+                                   backoff_seconds) for batch in batches]
+        for future in tqdm(as_completed(futures), total=len(futures), disable=not show_progress):
+            try:
+                batch_articles = future.result()
+            except Exception as batch_error:  # raised once the other batches are passed on
+                error = error or batch_error
+                continue
+            if batch_callback is not None:
+                batch_callback(batch_articles)
+            articles.update(batch_articles)
+    if error is not None:
+        raise error
+    return articles
+
+
+def _fetch_batch(session, rate_limiter, pmids, efetch_url, api_key, max_retries, backoff_seconds):
+    parameters = {"db": "pubmed", "id": ",".join(pmids), "retmode": "xml"}
+    if api_key:
+        parameters["api_key"] = api_key
+    error = None
+    for attempt in range(max_retries + 1):
+        rate_limiter.wait()
+        try:
+            response = session.post(efetch_url, data=parameters, timeout=REQUEST_TIMEOUT_SECONDS)
+            if response.status_code == 200:
+                return _parse_articles(response.content)
+            if response.status_code != 429 and response.status_code < 500:
+                # the request itself was rejected (e.g. because of a malformed PMID), so do not retry it
+                return _fetch_rejected_batch(session, rate_limiter, pmids, efetch_url, api_key, max_retries,
+                                             backoff_seconds)
+            error = f"HTTP status {response.status_code}"
+        except (requests.RequestException, etree.XMLSyntaxError) as request_error:
+            error = request_error
+        if attempt < max_retries:
+            # back off exponentially, with some jitter so that concurrent requests do not retry in lockstep
+            time.sleep(backoff_seconds * (2 ** attempt) * (1 + random.random() / 2))
+    raise RuntimeError(f"Failed to fetch a batch of {len(pmids)} PubMed articles after {max_retries + 1} attempts "
+                       f"({error})")
+
+
+# Fetch each half of a batch of PMIDs that was rejected separately, so that a single problematic PMID only fails by
+#  itself
+def _fetch_rejected_batch(session, rate_limiter, pmids, efetch_url, api_key, max_retries, backoff_seconds):
+    if len(pmids) > 1:
+        half = len(pmids) // 2
+        articles = _fetch_batch(session, rate_limiter, pmids[:half], efetch_url, api_key, max_retries, backoff_seconds)
+        articles.update(_fetch_batch(session, rate_limiter, pmids[half:], efetch_url, api_key, max_retries,
+                                     backoff_seconds))
+        return articles
+    print(f"...warning: PubMed rejected the request for article {pmids[0]}")
+    return {}
+
+
+# Split an EFetch PubmedArticleSet into its articles. Each article is wrapped in its own PubmedArticleSet, so that
+#  metapub parses it exactly as it does the response to a single-PMID request (e.g. in PubMedFetcher.article_by_pmid)
+def _parse_articles(xml):
+    articles = {}
+    for element in etree.fromstring(xml):
+        if element.tag in ("PubmedArticle", "PubmedBookArticle"):
+            article = PubMedArticle(b"<PubmedArticleSet>" + etree.tostring(element) + b"</PubmedArticleSet>")
+            if article.pmid is not None:
+                articles[str(article.pmid)] = article
+    return articles
+
+
+# Limits the rate of requests made across all threads by spacing them at least 1/requests_per_second seconds apart
+class _RateLimiter:
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second
+        self.next_request_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            request_time = max(self.next_request_time, time.monotonic())
+            self.next_request_time = request_time + self.interval
+        time.sleep(max(0.0, request_time - time.monotonic()))
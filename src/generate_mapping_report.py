@@ -1,8 +1,12 @@
+import os
+import re
+import time
 import uuid
+import numpy as np
 import pandas as pd
 from owlready2 import *
 
-__version__ = "0.8.3"
+__version__ = "0.12.0"
 
 BASE_IRI = "https://computationalbiomed.hms.harvard.edu/ontology/"
 
@@ -14,6 +18,12 @@ SOURCE_TERM_2ND_ID_COL = ''
 SOURCE_TERM_COL = "SourceTerm"
 MAPPED_TERM_IRI_COL = "MappedTermIRI"
 ONTOLOGY_COL = "Ontology"
+
+# Column names of the ontology terms (labels) and entailed edges tables generated by generate_ontology_tables
+TERM_CURIE_COL = "Subject"
+TERM_IRI_COL = "IRI"
+EDGE_SUBJECT_COL = "Subject"
+EDGE_OBJECT_COL = "Object"
 SAVE_ONTOLOGY = False
 USE_REASONING = False
 
@@ -45,6 +55,10 @@ def get_mapping_counts_to_ontologies(mappings_df, ontologies_df,
     return all_mappings
 
 
+# Get the counts of resources mapped directly and indirectly (via a subclass) to each ontology term.
+# When the ontology terms and entailed edges tables are given, the counts are computed from the entailed subclass
+#  closure; otherwise (or additionally when verify=True) the ontology is loaded with owlready2, and the mappings are
+#  represented as instances of the mapped ontology classes
 def get_mapping_counts(mappings_df, ontology_iri,
                        source_term_id_col=SOURCE_TERM_ID_COL,
                        source_term_secondary_id_col=SOURCE_TERM_2ND_ID_COL,
@@ -52,7 +66,255 @@ def get_mapping_counts(mappings_df, ontology_iri,
                        mapped_term_iri_col=MAPPED_TERM_IRI_COL,
                        save_ontology=SAVE_ONTOLOGY,
                        use_reasoning=USE_REASONING,
-                       ontology_term_blocklist=TERM_BLOCKLIST):
+                       ontology_term_blocklist=TERM_BLOCKLIST,
+                       ontology_terms_df=None, entailed_edges_df=None, edges_df=None, verify=False):
+    if ontology_terms_df is None or entailed_edges_df is None:
+        return _get_mapping_counts_owlready(mappings_df, ontology_iri, source_term_id_col=source_term_id_col,
+                                            source_term_secondary_id_col=source_term_secondary_id_col,
+                                            source_term_col=source_term_col, mapped_term_iri_col=mapped_term_iri_col,
+                                            save_ontology=save_ontology, use_reasoning=use_reasoning,
+                                            ontology_term_blocklist=ontology_term_blocklist)
+    counts_df = get_mapping_counts_from_closure(mappings_df, ontology_terms_df, entailed_edges_df, edges_df=edges_df,
+                                                source_term_id_col=source_term_id_col,
+                                                source_term_secondary_id_col=source_term_secondary_id_col,
+                                                mapped_term_iri_col=mapped_term_iri_col,
+                                                ontology_term_blocklist=ontology_term_blocklist)
+    if verify:
+        owlready_counts_df = _get_mapping_counts_owlready(mappings_df, ontology_iri,
+                                                          source_term_id_col=source_term_id_col,
+                                                          source_term_secondary_id_col=source_term_secondary_id_col,
+                                                          source_term_col=source_term_col,
+                                                          mapped_term_iri_col=mapped_term_iri_col,
+                                                          save_ontology=save_ontology, use_reasoning=use_reasoning,
+                                                          ontology_term_blocklist=ontology_term_blocklist)
+        _compare_mapping_counts(counts_df, owlready_counts_df)
+    return counts_df
+
+
+# Compute the mapping counts of each ontology term from the entailed subclass closure. Each resource is given a bit
+#  position, and the bit-packed sets of resources annotated with each term are pushed up the class hierarchy (the
+#  asserted edges, if given, plus any entailed edges they do not imply) in topological order, so that each union of
+#  a term's resource set into a parent's set is done once
+def get_mapping_counts_from_closure(mappings_df, ontology_terms_df, entailed_edges_df, edges_df=None,
+                                    source_term_id_col=SOURCE_TERM_ID_COL,
+                                    source_term_secondary_id_col=SOURCE_TERM_2ND_ID_COL,
+                                    mapped_term_iri_col=MAPPED_TERM_IRI_COL,
+                                    ontology_term_blocklist=TERM_BLOCKLIST):
+    print("Computing mapping counts from the ontology closure...")
+    start = time.time()
+    terms_df = ontology_terms_df[[TERM_CURIE_COL, TERM_IRI_COL]].drop_duplicates(subset=[TERM_IRI_COL])
+
+    # Resources mapped directly to each term, where the mapped IRI is exactly the term's IRI
+    direct_df = mappings_df[[mapped_term_iri_col, source_term_id_col]].drop_duplicates()
+    direct_df.columns = [TERM_IRI_COL, source_term_id_col]
+    direct_counts = direct_df.groupby(TERM_IRI_COL)[source_term_id_col].nunique(dropna=False)
+
+    # Resources annotated with each term or any of its subclasses, excluding those mapped directly to the term
+    annotations_df = _get_annotated_terms(mappings_df, terms_df, source_term_id_col=source_term_id_col,
+                                          source_term_secondary_id_col=source_term_secondary_id_col,
+                                          mapped_term_iri_col=mapped_term_iri_col)
+    hierarchy_df = _get_hierarchy_dag(entailed_edges_df, edges_df)
+    inherited_counts = _count_inherited_mappings(annotations_df, direct_df.merge(terms_df, on=TERM_IRI_COL),
+                                                 hierarchy_df, entailed_edges_df, source_term_id_col)
+
+    terms_df = terms_df[~terms_df[TERM_IRI_COL].str.contains("|".join(map(re.escape, ontology_term_blocklist)))]
+    output_df = pd.DataFrame({"IRI": terms_df[TERM_IRI_COL]})
+    output_df["Direct"] = output_df["IRI"].map(direct_counts).fillna(0).astype(int)
+    output_df["Inherited"] = terms_df[TERM_CURIE_COL].map(inherited_counts).fillna(0).astype(int)
+    print(f"...done ({time.time() - start:.1f} seconds)")
+    return output_df.reset_index(drop=True)
+
+
+# Compute the mapping counts (as get_mapping_counts_from_closure does) of the ontology terms with the given IRIs only,
+#  such as the terms whose counts are affected by a change in the mappings. Each term's resources are gathered from
+#  its own annotations and those of its entailed subclasses, so the counts of a few terms are computed without
+#  propagating resource sets through the whole class hierarchy
+def get_mapping_counts_for_terms(mappings_df, ontology_terms_df, entailed_edges_df, term_iris,
+                                 source_term_id_col=SOURCE_TERM_ID_COL,
+                                 source_term_secondary_id_col=SOURCE_TERM_2ND_ID_COL,
+                                 mapped_term_iri_col=MAPPED_TERM_IRI_COL,
+                                 ontology_term_blocklist=TERM_BLOCKLIST):
+    all_terms_df = ontology_terms_df[[TERM_CURIE_COL, TERM_IRI_COL]].drop_duplicates(subset=[TERM_IRI_COL])
+    terms_df = all_terms_df[all_terms_df[TERM_IRI_COL].isin(set(term_iris))]
+    terms_df = terms_df[~terms_df[TERM_IRI_COL].str.contains("|".join(map(re.escape, ontology_term_blocklist)))]
+
+    direct_df = mappings_df[[mapped_term_iri_col, source_term_id_col]].drop_duplicates()
+    direct_df.columns = [TERM_IRI_COL, source_term_id_col]
+    direct_df = direct_df[direct_df[TERM_IRI_COL].isin(terms_df[TERM_IRI_COL])]
+    direct_counts = direct_df.groupby(TERM_IRI_COL)[source_term_id_col].nunique(dropna=False)
+
+    # Pairs of (term, subclass-or-self) for each term, and the resources annotated with each such subclass
+    subclasses_df = entailed_edges_df[entailed_edges_df[EDGE_OBJECT_COL].isin(terms_df[TERM_CURIE_COL]) &
+                                      (entailed_edges_df[EDGE_SUBJECT_COL] != entailed_edges_df[EDGE_OBJECT_COL])]
+    subclasses_df = pd.concat([subclasses_df[[EDGE_OBJECT_COL, EDGE_SUBJECT_COL]],
+                               pd.DataFrame({EDGE_OBJECT_COL: terms_df[TERM_CURIE_COL],
+                                             EDGE_SUBJECT_COL: terms_df[TERM_CURIE_COL]})]).drop_duplicates()
+    annotations_df = _get_annotated_terms(mappings_df, all_terms_df, source_term_id_col=source_term_id_col,
+                                          source_term_secondary_id_col=source_term_secondary_id_col,
+                                          mapped_term_iri_col=mapped_term_iri_col)
+    inherited_df = subclasses_df.merge(annotations_df, left_on=EDGE_SUBJECT_COL, right_on=TERM_CURIE_COL)
+    inherited_df = inherited_df[[EDGE_OBJECT_COL, source_term_id_col]].drop_duplicates()
+
+    # Excluding the resources mapped directly to the term
+    direct_resources_df = direct_df.merge(terms_df, on=TERM_IRI_COL)[[TERM_CURIE_COL, source_term_id_col]]
+    direct_resources_df.columns = [EDGE_OBJECT_COL, source_term_id_col]
+    inherited_df = inherited_df.merge(direct_resources_df.drop_duplicates(), how="left", indicator=True)
+    inherited_df = inherited_df[inherited_df["_merge"] == "left_only"]
+    inherited_counts = inherited_df.groupby(EDGE_OBJECT_COL)[source_term_id_col].nunique()
+
+    output_df = pd.DataFrame({"IRI": terms_df[TERM_IRI_COL]})
+    output_df["Direct"] = output_df["IRI"].map(direct_counts).fillna(0).astype(int)
+    output_df["Inherited"] = terms_df[TERM_CURIE_COL].map(inherited_counts).fillna(0).astype(int)
+    return output_df.reset_index(drop=True)
+
+
+# Get the subclass edges along which resource sets are propagated: the asserted edges that are also entailed, plus
+#  the entailed edges not implied by an asserted edge followed by an entailed one. The transitive closure of these
+#  edges is the entailed closure, so without asserted edges this is simply the (irreflexive) entailed edges table
+def _get_hierarchy_dag(entailed_edges_df, edges_df=None):
+    entailed_df = entailed_edges_df[[EDGE_SUBJECT_COL, EDGE_OBJECT_COL]].drop_duplicates()
+    entailed_df = entailed_df[entailed_df[EDGE_SUBJECT_COL] != entailed_df[EDGE_OBJECT_COL]]
+    if edges_df is None:
+        return entailed_df
+    asserted_df = edges_df[[EDGE_SUBJECT_COL, EDGE_OBJECT_COL]].drop_duplicates().merge(entailed_df)
+    implied_df = asserted_df.merge(entailed_df, left_on=EDGE_OBJECT_COL, right_on=EDGE_SUBJECT_COL,
+                                   suffixes=("", "_parent"))
+    implied_df = implied_df[[EDGE_SUBJECT_COL, EDGE_OBJECT_COL + "_parent"]]
+    implied_df.columns = [EDGE_SUBJECT_COL, EDGE_OBJECT_COL]
+    implied_df = pd.concat([asserted_df, implied_df]).drop_duplicates()
+    extra_df = entailed_df.merge(implied_df, how="left", indicator=True)
+    extra_df = extra_df.loc[extra_df["_merge"] == "left_only", [EDGE_SUBJECT_COL, EDGE_OBJECT_COL]]
+    return pd.concat([asserted_df, extra_df], ignore_index=True)
+
+
+# Count the resources annotated with each term or any of its subclasses, other than the ones mapped directly to it
+def _count_inherited_mappings(annotations_df, direct_df, hierarchy_df, entailed_edges_df, source_term_id_col):
+    resources = pd.Index(annotations_df[source_term_id_col].unique())
+    bitmap_size = (len(resources) + 7) // 8
+    annotated_positions = _get_positions_by_term(annotations_df, resources, source_term_id_col)
+    direct_positions = _get_positions_by_term(direct_df, resources, source_term_id_col)
+    no_positions = np.array([], dtype=np.int64)
+
+    parents = _group_edges(hierarchy_df[EDGE_SUBJECT_COL], hierarchy_df[EDGE_OBJECT_COL])
+    pending_children = hierarchy_df[EDGE_OBJECT_COL].value_counts().to_dict()
+    terms = set(hierarchy_df[EDGE_SUBJECT_COL]) | set(hierarchy_df[EDGE_OBJECT_COL]) | set(annotated_positions)
+    queue = [term for term in terms if term not in pending_children]  # start from the leaves
+    bitmaps = {}
+    inherited_counts = {}
+    while queue:
+        term = queue.pop()
+        bitmap = bitmaps.pop(term, None)
+        if term in annotated_positions:
+            if bitmap is None:
+                bitmap = np.zeros(bitmap_size, dtype=np.uint8)
+            _set_bits(bitmap, annotated_positions[term])
+        if bitmap is not None:
+            inherited_counts[term] = _count_bits(bitmap) - _count_bits_at(bitmap, direct_positions.get(term, no_positions))
+        for parent in parents.get(term, []):
+            if bitmap is not None:
+                if parent in bitmaps:
+                    np.bitwise_or(bitmaps[parent], bitmap, out=bitmaps[parent])
+                else:
+                    bitmaps[parent] = bitmap.copy()
+            pending_children[parent] -= 1
+            if pending_children[parent] == 0:
+                queue.append(parent)
+
+    # Terms in (or above) subclass cycles are never reached in topological order, so count them from the closure
+    unresolved_terms = [term for term, children in pending_children.items() if children > 0]
+    if unresolved_terms:
+        print(f"...warning: {len(unresolved_terms)} terms are in or above subclass cycles—counting them from the "
+              f"entailed edges instead")
+        descendants = entailed_edges_df[entailed_edges_df[EDGE_OBJECT_COL].isin(unresolved_terms)]
+        descendants = _group_edges(descendants[EDGE_OBJECT_COL], descendants[EDGE_SUBJECT_COL])
+        for term in unresolved_terms:
+            positions = [annotated_positions.get(subclass, no_positions)
+                         for subclass in descendants.get(term, []) + [term]]
+            positions = np.unique(np.concatenate(positions))
+            inherited_counts[term] = len(np.setdiff1d(positions, direct_positions.get(term, no_positions)))
+    return inherited_counts
+
+
+def _group_edges(terms, related_terms):
+    grouped_terms = {}
+    for term, related_term in zip(terms, related_terms):
+        grouped_terms.setdefault(term, []).append(related_term)
+    return grouped_terms
+
+
+# Get the bit positions of the resources associated with each term, as a dictionary of term to positions array
+def _get_positions_by_term(df, resources, source_term_id_col):
+    positions = resources.get_indexer(df[source_term_id_col])
+    term_codes, terms = pd.factorize(df[TERM_CURIE_COL])
+    is_known = positions >= 0
+    positions, term_codes = positions[is_known], term_codes[is_known]
+    order = np.argsort(term_codes, kind="stable")
+    positions, term_codes = positions[order], term_codes[order]
+    boundaries = np.flatnonzero(np.diff(term_codes)) + 1
+    codes = term_codes[np.concatenate(([0], boundaries))] if len(term_codes) > 0 else []
+    return dict(zip(terms[codes], np.split(positions, boundaries)))
+
+
+def _set_bits(bitmap, positions):
+    np.bitwise_or.at(bitmap, positions >> 3, (128 >> (positions & 7)).astype(np.uint8))
+
+
+def _count_bits(bitmap):
+    return int(np.count_nonzero(np.unpackbits(bitmap)))
+
+
+def _count_bits_at(bitmap, positions):
+    return int(((bitmap[positions >> 3] >> (7 - (positions & 7))) & 1).sum())
+
+
+# Get the (resource, ontology term CURIE) pairs that the owlready2 path represents as instances of ontology classes:
+#  mapped IRIs that are not ontology terms but contain commas are split into their constituent IRIs, and resources
+#  identified by IRIs are not counted (their instances are not created in the BASE_IRI namespace)
+def _get_annotated_terms(mappings_df, ontology_terms_df, source_term_id_col, source_term_secondary_id_col,
+                         mapped_term_iri_col):
+    iri_to_curie = dict(zip(ontology_terms_df[TERM_IRI_COL], ontology_terms_df[TERM_CURIE_COL]))
+    columns = [source_term_id_col, mapped_term_iri_col]
+    if source_term_secondary_id_col != '':
+        columns.append(source_term_secondary_id_col)
+    annotations_df = mappings_df[columns].dropna(subset=[mapped_term_iri_col]).reset_index(drop=True)
+    mapped_iris = annotations_df[mapped_term_iri_col]
+    is_multiple = ~mapped_iris.isin(iri_to_curie) & mapped_iris.str.contains(",", regex=False)
+    split_iris = mapped_iris[is_multiple].str.split(",").explode().str.strip()
+    annotations_df = pd.concat([annotations_df[~is_multiple],
+                                annotations_df[is_multiple].drop(columns=[mapped_term_iri_col]).join(split_iris)])
+    annotations_df = annotations_df.sort_index(kind="stable")
+    annotations_df[TERM_CURIE_COL] = annotations_df[mapped_term_iri_col].map(iri_to_curie)
+    annotations_df = annotations_df.dropna(subset=[TERM_CURIE_COL])
+    if source_term_secondary_id_col != '':
+        # instances are identified by the resource IDs, so only the first mapping of each resource is represented
+        annotations_df = annotations_df.drop_duplicates(subset=[source_term_secondary_id_col, source_term_id_col])
+    else:
+        resource_ids = annotations_df[source_term_id_col].astype(str)
+        annotations_df = annotations_df[~resource_ids.str.contains("http://|https://") |
+                                        resource_ids.str.contains(BASE_IRI, regex=False)]
+    return annotations_df[[source_term_id_col, TERM_CURIE_COL]].drop_duplicates()
+
+
+def _compare_mapping_counts(counts_df, owlready_counts_df):
+    merged_df = counts_df.merge(owlready_counts_df, on="IRI", how="inner", suffixes=("", "_owlready"))
+    differences_df = merged_df[(merged_df["Direct"] != merged_df["Direct_owlready"]) |
+                               (merged_df["Inherited"] != merged_df["Inherited_owlready"])]
+    if len(differences_df) == 0:
+        print(f"...verified mapping counts of {len(merged_df)} terms against owlready2")
+    else:
+        print(f"...warning: mapping counts of {len(differences_df)} terms differ from those computed by owlready2:")
+        print(differences_df.to_string(index=False, max_rows=20))
+    return differences_df
+
+
+def _get_mapping_counts_owlready(mappings_df, ontology_iri,
+                                 source_term_id_col=SOURCE_TERM_ID_COL,
+                                 source_term_secondary_id_col=SOURCE_TERM_2ND_ID_COL,
+                                 source_term_col=SOURCE_TERM_COL,
+                                 mapped_term_iri_col=MAPPED_TERM_IRI_COL,
+                                 save_ontology=SAVE_ONTOLOGY,
+                                 use_reasoning=USE_REASONING,
+                                 ontology_term_blocklist=TERM_BLOCKLIST):
     print(f"Computing mapping counts for {ontology_iri}...")
     start = time.time()
     ontology_world = World()
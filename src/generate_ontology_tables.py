@@ -1,13 +1,19 @@
 import os
-import gzip
-import shutil
+import sys
+import time
 import sqlite3
-import urllib.request
+import multiprocessing
 import bioregistry
 import pandas as pd
-from collections import deque
+from functools import lru_cache
+from download_cache import download_file, decompress_gzip_file
 
-__version__ = "0.11.6"
+try:
+    import resource
+except ImportError:  # not available on Windows, where the peak memory of each ontology is not reported
+    resource = None
+
+__version__ = "0.17.0"
 
 SUBJECT_COL = "Subject"
 OBJECT_COL = "Object"
@@ -16,32 +22,54 @@ ONTOLOGY_COL = "Ontology"
 DISEASE_LOCATION_COL = "DiseaseLocation"
 IRI_PRIORITY_LIST = ["obofoundry", "default", "bioregistry"]
 
+# Maximum number of distinct terms whose CURIE/IRI normalization is kept in memory
+IDENTIFIER_CACHE_SIZE = 2 ** 18
+
 ONTOLOGY_TABLES_OUTPUT_FOLDER = os.path.join("..", "ontology-tables")
 DATABASE_OUTPUT_FOLDER = os.path.join("..", "ontology-db")
 
+# Number of rows read at a time from the results of the queries that extract the ontology tables
+FETCH_BATCH_SIZE = 100000
+
+# Maximum number of ontologies whose tables are extracted concurrently (each in its own process)
+EXTRACTION_WORKERS = 4
 
+
+# Get the SemanticSQL tables of the given ontologies, which are downloaded and extracted concurrently, each in its own
+#  process (of at most max_workers processes, or one after another in this process if max_workers=1). The time taken
+#  and the peak memory used to get the tables of each ontology are reported. If single_table_for_all_ontologies=True,
+#  the tables of all ontologies are combined (each with the ontology name in an "Ontology" column) and returned
 def get_semsql_tables_for_ontologies(ontologies,
                                      tables_output_folder=ONTOLOGY_TABLES_OUTPUT_FOLDER,
                                      db_output_folder=DATABASE_OUTPUT_FOLDER,
                                      save_tables=False, single_table_for_all_ontologies=False,
-                                     include_disease_locations=False):
-    all_edges = all_entailed_edges = all_labels = all_dbxrefs = all_synonyms = pd.DataFrame()
-    for ontology in ontologies:
-        ontology_url = "https://s3.amazonaws.com/bbop-sqlite/" + ontology.lower() + ".db.gz"
-        edges, entailed_edges, labels, dbxrefs, synonyms, version = \
-            get_semsql_tables_for_ontology(ontology_url=ontology_url,
-                                           ontology_name=ontology,
-                                           db_output_folder=db_output_folder,
-                                           save_tables=(not single_table_for_all_ontologies),
-                                           include_disease_locations=include_disease_locations)
+                                     include_disease_locations=False, max_workers=EXTRACTION_WORKERS):
+    arguments = [dict(ontology_url="https://s3.amazonaws.com/bbop-sqlite/" + ontology.lower() + ".db.gz",
+                      ontology_name=ontology,
+                      tables_output_folder=tables_output_folder,
+                      db_output_folder=db_output_folder,
+                      save_tables=(not single_table_for_all_ontologies),
+                      include_disease_locations=include_disease_locations) for ontology in ontologies]
+    workers = min(max_workers, len(ontologies))
+    if workers > 1:
+        # a new process for each ontology, so that the peak memory of each process is that of a single ontology
+        with multiprocessing.Pool(processes=workers, maxtasksperchild=1) as pool:
+            results = pool.map(_get_semsql_tables_with_usage, arguments, chunksize=1)
+    else:
+        results = [_get_semsql_tables_with_usage(ontology_arguments) for ontology_arguments in arguments]
+
+    all_tables = [[], [], [], [], []]  # edges, entailed edges, labels, dbxrefs and synonyms of each ontology
+    for ontology, (ontology_tables, _, _) in zip(ontologies, results):
         if single_table_for_all_ontologies:
-            labels[ONTOLOGY_COL] = edges[ONTOLOGY_COL] = entailed_edges[ONTOLOGY_COL] = dbxrefs[ONTOLOGY_COL] = \
-                synonyms[ONTOLOGY_COL] = ontology
-            all_labels = pd.concat([all_labels, labels])
-            all_edges = pd.concat([all_edges, edges])
-            all_entailed_edges = pd.concat([all_entailed_edges, entailed_edges])
-            all_dbxrefs = pd.concat([all_dbxrefs, dbxrefs])
-            all_synonyms = pd.concat([all_synonyms, synonyms])
+            for table_number, table in enumerate(ontology_tables[:5]):
+                table[ONTOLOGY_COL] = ontology
+                all_tables[table_number].append(table)
+    all_edges, all_entailed_edges, all_labels, all_dbxrefs, all_synonyms = \
+        [pd.concat(tables) if len(tables) > 0 else pd.DataFrame() for tables in all_tables]
+    usage_df = pd.DataFrame([(ontology, seconds, peak_memory) for ontology, (_, seconds, peak_memory)
+                             in zip(ontologies, results)], columns=["Ontology", "Seconds", "PeakMemory(MiB)"])
+    print("Time taken and peak memory used to get the tables of each ontology:")
+    print(usage_df.round(1).to_string(index=False))
 
     if save_tables and single_table_for_all_ontologies:
         save_table(all_labels, "ontology_labels.tsv", tables_output_folder)
@@ -52,17 +80,25 @@ def get_semsql_tables_for_ontologies(ontologies,
     return all_edges, all_entailed_edges, all_labels, all_dbxrefs, all_synonyms
 
 
+# Get the SemanticSQL tables of an ontology, along with the time taken (in seconds) and the peak memory (resident set
+#  size, in MiB) of the process while getting them, if it can be measured
+def _get_semsql_tables_with_usage(arguments):
+    start = time.time()
+    ontology_tables = get_semsql_tables_for_ontology(**arguments)
+    return ontology_tables, time.time() - start, _get_peak_memory()
+
+
+def _get_peak_memory():
+    if resource is None:
+        return None
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # in KiB, or in bytes on macOS
+    return peak_memory / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
 def get_semsql_tables_for_ontology(ontology_url, ontology_name, tables_output_folder=ONTOLOGY_TABLES_OUTPUT_FOLDER,
                                    db_output_folder=DATABASE_OUTPUT_FOLDER, save_tables=False,
                                    include_disease_locations=False):
-    db_file = os.path.join(db_output_folder, ontology_name.lower() + ".db")
-    db_gz_file = db_file + ".gz"
-    if not os.path.exists(db_output_folder):
-        os.makedirs(db_output_folder)
-    print(f"Downloading database file for {ontology_name} from {ontology_url}...")
-    urllib.request.urlretrieve(ontology_url, db_gz_file)
-    with gzip.open(db_gz_file, "rb") as file_in, open(db_file, "wb") as file_out:
-        shutil.copyfileobj(file_in, file_out)
+    db_file = _get_semsql_db_file(ontology_url, ontology_name, db_output_folder)
     print(f"Generating tables for {ontology_name}...")
     conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
@@ -76,6 +112,8 @@ def get_semsql_tables_for_ontology(ontology_url, ontology_name, tables_output_fo
     onto_version = _get_ontology_version(cursor)
     if onto_version != "":
         print(f"\t{ontology_name} version: {onto_version}")
+    for identifier_type, cache_info in get_identifier_cache_info().items():
+        print(f"\t{identifier_type} normalization cache: {cache_info.hits} hits, {cache_info.misses} misses")
     cursor.close()
     conn.close()
     if save_tables:
@@ -87,13 +125,36 @@ def get_semsql_tables_for_ontology(ontology_url, ontology_name, tables_output_fo
     return edges_df, entailed_edges_df, labels_df, dbxrefs_df, synonyms_df, onto_version
 
 
+# Get the version (owl:versionInfo) of the latest SemanticSQL build of an ontology, downloading the database file of the
+#  build if it changed since it was last downloaded
+def get_semsql_ontology_version(ontology_url, ontology_name, db_output_folder=DATABASE_OUTPUT_FOLDER):
+    conn = sqlite3.connect(_get_semsql_db_file(ontology_url, ontology_name, db_output_folder))
+    onto_version = _get_ontology_version(conn.cursor())
+    conn.close()
+    return onto_version
+
+
+# Get the local copy of the SemanticSQL database file of an ontology, which is downloaded and decompressed (each step
+#  skipped if the previous one is up to date)
+def _get_semsql_db_file(ontology_url, ontology_name, db_output_folder):
+    db_file = os.path.join(db_output_folder, ontology_name.lower() + ".db")
+    db_gz_file = db_file + ".gz"
+    if not os.path.exists(db_output_folder):
+        os.makedirs(db_output_folder)
+    print(f"Downloading database file for {ontology_name} from {ontology_url}...")
+    download_file(ontology_url, db_gz_file)  # skipped if the previously downloaded file is up to date
+    decompress_gzip_file(db_gz_file, db_file)  # skipped if the file was already decompressed
+    return db_file
+
+
 def _add_views(cursor):
     # In EFO, some disease locations are expressed in universal restrictions—for example:
     # pancreatitis (EFO:0000278) has_disease_location only pancreas
     # Currently there are no views in the SemanticSQL build of EFO for universal restrictions, only for existential ones
 
-    # Create a view that mimics the existing view 'owl_some_values_from' but for universal restrictions instead
-    create_owl_only_values_from_view = "CREATE VIEW IF NOT EXISTS owl_only_values_from AS " \
+    # Create a view that mimics the existing view 'owl_some_values_from' but for universal restrictions instead. The
+    #  views are temporary, so that the (cached) database file is left unchanged
+    create_owl_only_values_from_view = "CREATE TEMP VIEW IF NOT EXISTS owl_only_values_from AS " \
                                        "SELECT onProperty.subject AS id, onProperty.object AS on_property, f.object AS filler " + \
                                        "FROM statements AS onProperty, statements AS f " + \
                                        "WHERE onProperty.predicate = 'owl:onProperty' AND onProperty.subject=f.subject " + \
@@ -102,7 +163,7 @@ def _add_views(cursor):
 
     # Use the view just created to add another convenience view that mimics the existing view
     # 'owl_subclass_of_some_values_from', but again, for universal restrictions instead
-    create_owl_subclass_of_only_values_from_view = "CREATE VIEW IF NOT EXISTS owl_subclass_of_only_values_from AS " + \
+    create_owl_subclass_of_only_values_from_view = "CREATE TEMP VIEW IF NOT EXISTS owl_subclass_of_only_values_from AS " + \
                                                    "SELECT subClassOf.stanza, subClassOf.subject, svf.on_property AS predicate, svf.filler AS object " + \
                                                    "FROM statements AS subClassOf, owl_only_values_from AS svf " + \
                                                    "WHERE subClassOf.predicate = 'rdfs:subClassOf' AND svf.id=subClassOf.object;"
@@ -118,78 +179,90 @@ def _get_ontology_version(cursor):
 
 
 def _get_edges_table(cursor):
-    cursor.execute("SELECT * FROM edge WHERE predicate='rdfs:subClassOf'")
-    edge_columns = [x[0] for x in cursor.description]
-    edge_data = cursor.fetchall()
-    edges_df = pd.DataFrame(edge_data, columns=edge_columns)
-    edges_df = edges_df.drop(columns=["predicate"])
-    edges_df = edges_df.rename(columns={'object': OBJECT_COL, 'subject': SUBJECT_COL})
-    edges_df = edges_df.drop_duplicates()
+    edges_df = _read_query_results(cursor, _get_distinct_pairs_query("edge", "object", "predicate='rdfs:subClassOf'"),
+                                   columns=[SUBJECT_COL, OBJECT_COL])
     edges_df = fix_identifiers(edges_df, columns=[SUBJECT_COL, OBJECT_COL])
     return edges_df
 
 
 def _get_entailed_edges_table(cursor):
-    cursor.execute("SELECT * FROM entailed_edge WHERE predicate='rdfs:subClassOf'")
-    entailed_edge_columns = [x[0] for x in cursor.description]
-    entailed_edge_data = cursor.fetchall()
-    entailed_edges_df = pd.DataFrame(entailed_edge_data, columns=entailed_edge_columns)
-    entailed_edges_df = entailed_edges_df.drop(columns=["predicate"])
-    entailed_edges_df = entailed_edges_df.rename(columns={'object': OBJECT_COL, 'subject': SUBJECT_COL})
-    entailed_edges_df = entailed_edges_df.drop_duplicates()
+    entailed_edges_df = _read_query_results(
+        cursor, _get_distinct_pairs_query("entailed_edge", "object", "predicate='rdfs:subClassOf'"),
+        columns=[SUBJECT_COL, OBJECT_COL])
     entailed_edges_df = fix_identifiers(entailed_edges_df, columns=[SUBJECT_COL, OBJECT_COL])
     return entailed_edges_df
 
 
 def _get_labels_table(cursor, ontology_name, include_disease_locations=False):
-    # Get rdfs:label statements for ontology classes that are not deprecated
-    labels_query = "SELECT * FROM statements WHERE predicate='rdfs:label' AND subject IN " + \
-                   "(SELECT subject FROM statements WHERE predicate='rdf:type' AND object='owl:Class') " + \
-                   "AND subject NOT IN " + \
-                   "(SELECT subject FROM statements WHERE predicate='owl:deprecated' AND value='true')"
-    cursor.execute(labels_query)
-    labels_columns = [x[0] for x in cursor.description]
-    labels_data = cursor.fetchall()
-    labels_df = pd.DataFrame(labels_data, columns=labels_columns)
-    labels_df = labels_df.drop(columns=["stanza", "predicate", "object", "datatype", "language", "graph"])
-    labels_df = labels_df.rename(columns={'value': OBJECT_COL, 'subject': SUBJECT_COL})
-    labels_df = labels_df.drop_duplicates(subset=[SUBJECT_COL])  # remove all but one label for each subject/term
-    labels_df = labels_df[labels_df[SUBJECT_COL].str.startswith("_:") == False]  # remove blank nodes
+    # Get rdfs:label statements for ontology classes that are not deprecated, keeping the first label of each class
+    #  (that is not a blank node), in the order of the statements. Classes are joined (rather than looked up in a
+    #  list), while deprecated terms are excluded with NOT IN (SQLite builds a temporary index of the list once, where
+    #  an anti-join on the subquery would scan it for every label), ignoring NULL subjects, which would otherwise
+    #  exclude every label
+    labels_query = "SELECT label.subject, label.value, MIN(label.rowid) AS first_label FROM statements AS label " + \
+                   "JOIN (SELECT DISTINCT subject FROM statements " + \
+                   "WHERE predicate='rdf:type' AND object='owl:Class') AS class ON class.subject = label.subject " + \
+                   "WHERE label.predicate='rdfs:label' AND " + _get_not_blank_node_condition("label.subject") + \
+                   " AND label.subject NOT IN (SELECT subject FROM statements " + \
+                   "WHERE predicate='owl:deprecated' AND value='true' AND subject IS NOT NULL) " + \
+                   "GROUP BY label.subject ORDER BY first_label"
+    labels_df = _read_query_results(cursor, labels_query, columns=[SUBJECT_COL, OBJECT_COL, None])
     labels_df = fix_identifiers(labels_df, columns=[SUBJECT_COL])
     labels_df[OBJECT_COL] = labels_df[OBJECT_COL].str.strip()
-    labels_df[IRI_COL] = labels_df[SUBJECT_COL].apply(get_iri)
+    labels_df[IRI_COL] = get_iris(labels_df[SUBJECT_COL])
     if include_disease_locations:
-        labels_df[DISEASE_LOCATION_COL] = labels_df[SUBJECT_COL].apply(
-            _get_disease_location_for_term, connection=cursor.connection, ontology=ontology_name)
+        labels_df[DISEASE_LOCATION_COL] = _get_disease_locations_for_terms(
+            cursor, terms=labels_df[SUBJECT_COL].tolist(), ontology=ontology_name)
     return labels_df
 
 
 def _get_db_cross_references_table(cursor):
-    cursor.execute("SELECT * FROM has_dbxref_statement")
-    db_xrefs_columns = [x[0] for x in cursor.description]
-    db_xrefs_data = cursor.fetchall()
-    db_xrefs = pd.DataFrame(db_xrefs_data, columns=db_xrefs_columns)
-    db_xrefs = db_xrefs.drop(columns=["stanza", "predicate", "object", "datatype", "language", "graph"])
-    db_xrefs = db_xrefs.rename(columns={'value': OBJECT_COL, 'subject': SUBJECT_COL})
-    db_xrefs = db_xrefs.drop_duplicates()
-    db_xrefs = db_xrefs[db_xrefs[SUBJECT_COL].str.startswith("_:") == False]  # remove blank nodes
+    # Statements of the has_dbxref_statement view
+    db_xrefs = _read_query_results(
+        cursor, _get_distinct_pairs_query("statements", "value", "predicate='oio:hasDbXref' AND " +
+                                          _get_not_blank_node_condition("subject")),
+        columns=[SUBJECT_COL, OBJECT_COL])
     db_xrefs = fix_identifiers(db_xrefs, columns=[SUBJECT_COL])
     return db_xrefs
 
 
 def _get_synonyms_table(cursor):
-    cursor.execute("SELECT * FROM has_exact_synonym_statement")
-    synonyms_df_columns = [x[0] for x in cursor.description]
-    synonyms_df_data = cursor.fetchall()
-    synonyms_df = pd.DataFrame(synonyms_df_data, columns=synonyms_df_columns)
-    synonyms_df = synonyms_df.drop(columns=["stanza", "predicate", "object", "datatype", "language", "graph"])
-    synonyms_df = synonyms_df.rename(columns={'value': OBJECT_COL, 'subject': SUBJECT_COL})
-    synonyms_df = synonyms_df.drop_duplicates()
-    synonyms_df = synonyms_df[synonyms_df[SUBJECT_COL].str.startswith("_:") == False]  # remove blank nodes
+    # Statements of the has_exact_synonym_statement view
+    synonyms_df = _read_query_results(
+        cursor, _get_distinct_pairs_query("statements", "value", "predicate='oio:hasExactSynonym' AND " +
+                                          _get_not_blank_node_condition("subject")),
+        columns=[SUBJECT_COL, OBJECT_COL])
     synonyms_df = fix_identifiers(synonyms_df, columns=[SUBJECT_COL])
     return synonyms_df
 
 
+# Get the condition that excludes statements about blank nodes (whose identifiers start with "_:")
+def _get_not_blank_node_condition(subject_column):
+    return f"substr({subject_column}, 1, 2) != '_:'"
+
+
+# Get the query of the distinct (subject, object or value) pairs of the given table that meet the given condition
+def _get_distinct_pairs_query(table_name, object_column, condition):
+    return f"SELECT DISTINCT subject, {object_column} FROM {table_name} WHERE {condition}"
+
+
+# Run the given query and read its results into a data frame with the given column names (skipping the columns named
+#  None), a batch of rows at a time, so that the rows of the whole result are never held at once as Python tuples
+def _read_query_results(cursor, query, columns, batch_size=FETCH_BATCH_SIZE):
+    cursor.execute(query)
+    column_names = [column_name for column_name in columns if column_name is not None]
+    batches = []
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+        batches.append(pd.DataFrame(rows, columns=[str(index) if column_name is None else column_name
+                                                   for index, column_name in enumerate(columns)])[column_names])
+    if len(batches) == 0:
+        return pd.DataFrame(columns=column_names, dtype=object)
+    return pd.concat(batches, ignore_index=True)
+
+
 def get_iri(curie):
     if "DBR" in curie:
         term_id = curie.split(":")[1]
@@ -200,10 +273,42 @@ def get_iri(curie):
 
 def fix_identifiers(df, columns=()):
     for column in columns:
-        df[column] = df[column].apply(get_curie_id_for_term)
+        df[column] = get_curie_ids_for_terms(df[column])
     return df
 
 
+# Get the CURIE of each term in the given series. Each distinct term is normalized only once (and cached across calls),
+#  and the results are then mapped back onto the whole series
+def get_curie_ids_for_terms(terms):
+    return _map_unique_values(terms, _get_curie_id_for_term_cached)
+
+
+# Get the IRI of each CURIE in the given series, normalizing each distinct CURIE only once
+def get_iris(curies):
+    return _map_unique_values(curies, _get_iri_cached)
+
+
+# Get the hit/miss statistics of the CURIE and IRI normalization caches
+def get_identifier_cache_info():
+    return {"CURIE": _get_curie_id_for_term_cached.cache_info(), "IRI": _get_iri_cached.cache_info()}
+
+
+def _map_unique_values(series, function):
+    unique_values = series.dropna().unique()
+    mapped_values = {value: function(value) for value in unique_values}
+    return series.map(mapped_values).where(series.notna(), series)
+
+
+@lru_cache(maxsize=IDENTIFIER_CACHE_SIZE)
+def _get_curie_id_for_term_cached(term):
+    return get_curie_id_for_term(term)
+
+
+@lru_cache(maxsize=IDENTIFIER_CACHE_SIZE)
+def _get_iri_cached(curie):
+    return get_iri(curie)
+
+
 def get_curie_id_for_term(term):
     if (not pd.isna(term)) and ("<" in term or "http" in term):
         term = term.replace("<", "")
@@ -235,46 +340,78 @@ def _get_curie(term):
     return curie
 
 
-def _get_disease_locations(connection, subject, table, ontology):
+def _get_disease_location_predicate(ontology):
     if ontology == "EFO":
-        predicate = "EFO:0000784"
+        return "EFO:0000784"
     elif ontology == "NCIT":
-        predicate = "NCIT:R101"
-    else:
-        # default to RO:0001025 ('located in') from Relations Ontology
-        predicate = "RO:0001025"
-    disease_location_query = f"SELECT object FROM {table} " \
-                             f"WHERE predicate='{predicate}' AND subject='{subject}'"
-    locations = pd.read_sql_query(disease_location_query, connection)
-    locations = locations[~locations['object'].str.startswith("_")]  # remove rows where locations are blank nodes
-    return locations["object"].tolist()
-
-
-def _get_parents(connection, subject):
-    parents_query = f"SELECT object FROM edge WHERE subject='{subject}' AND predicate='rdfs:subClassOf'"
-    parents = pd.read_sql_query(parents_query, connection)
-    parents = parents[~parents['object'].str.startswith("_")]  # remove blank nodes
-    return parents["object"].tolist()
-
-
-def _get_disease_location_for_term(subject, connection, ontology):
-    queue = deque([subject])  # Initialize a queue to perform a BFS
-    while queue:
-        current_term = queue.popleft()
-        # first check if a location is stated in existential restrictions (most common)
-        locations = _get_disease_locations(connection, current_term, "owl_subclass_of_some_values_from", ontology)
-        if locations:
-            return locations[0] if len(locations) == 1 else ",".join(locations)
+        return "NCIT:R101"
+    # default to RO:0001025 ('located in') from Relations Ontology
+    return "RO:0001025"
+
+
+def _get_disease_locations(cursor, table, predicate):
+    # Load all (non-blank) disease locations stated in the given restrictions view, grouped by subject
+    cursor.execute(f"SELECT subject, object FROM {table} WHERE predicate=?", (predicate,))
+    locations = {}
+    for subject, location in cursor.fetchall():
+        if not location.startswith("_"):  # skip locations that are blank nodes
+            locations.setdefault(subject, []).append(location)
+    return locations
+
+
+def _get_parents(cursor):
+    # Load all asserted (non-blank) parents of every term, grouped by subject
+    cursor.execute("SELECT subject, object FROM edge WHERE predicate='rdfs:subClassOf'")
+    parents = {}
+    for subject, parent in cursor.fetchall():
+        if not parent.startswith("_") and parent != "owl:Thing":  # skip blank nodes and the root
+            parents.setdefault(subject, []).append(parent)
+    return parents
+
+
+def _get_disease_locations_for_terms(cursor, terms, ontology):
+    # Get the disease location(s) of each given term, or otherwise those of its nearest ancestor that has any.
+    # The restrictions and the class hierarchy are loaded once, and each term is resolved from its parents'
+    # (memoized) results: the nearest location of a term is that of the first parent with the shortest path to one
+    predicate = _get_disease_location_predicate(ontology)
+    # existential restrictions are the most common, universal ones are only checked when there are none
+    locations = _get_disease_locations(cursor, "owl_subclass_of_only_values_from", predicate)
+    locations.update(_get_disease_locations(cursor, "owl_subclass_of_some_values_from", predicate))
+    parents = _get_parents(cursor)
+    resolved = {}  # term -> (distance to the nearest located term, location)
+    for term in terms:
+        _resolve_disease_location(term, locations, parents, resolved)
+    return [resolved[term][1] for term in terms]
+
+
+def _resolve_disease_location(term, locations, parents, resolved):
+    # Depth-first traversal (iterative, to avoid the recursion limit) that resolves parents before their children
+    stack = [term]
+    in_progress = set()
+    while stack:
+        current_term = stack[-1]
+        if current_term in resolved:
+            stack.pop()
+        elif current_term in locations:
+            term_locations = locations[current_term]
+            location = term_locations[0] if len(term_locations) == 1 else ",".join(term_locations)
+            resolved[current_term] = (0, location)
+            stack.pop()
         else:
-            # then check if a location is stated in universal restrictions
-            locations = _get_disease_locations(connection, current_term, "owl_subclass_of_only_values_from", ontology)
-            if locations:
-                return locations[0] if len(locations) == 1 else ",".join(locations)
-            else:
-                # otherwise check if a parent has a stated disease location
-                parents = [parent for parent in _get_parents(connection, current_term) if parent != "owl:Thing"]
-                queue.extend(parents)
-    return pd.NA
+            term_parents = parents.get(current_term, [])
+            if current_term not in in_progress:
+                in_progress.add(current_term)
+                # parents already in progress are part of a cycle, so they cannot contribute a nearer location
+                stack.extend(reversed([parent for parent in term_parents
+                                       if parent not in resolved and parent not in in_progress]))
+                continue
+            nearest = (float("inf"), pd.NA)
+            for parent in term_parents:
+                if parent in resolved and resolved[parent][0] + 1 < nearest[0]:
+                    nearest = (resolved[parent][0] + 1, resolved[parent][1])
+            resolved[current_term] = nearest
+            in_progress.discard(current_term)
+            stack.pop()
 
 
 def save_table(df, output_filename, tables_output_folder):
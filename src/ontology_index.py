@@ -0,0 +1,125 @@
+import os
+import numpy as np
+import pandas as pd
+
+__version__ = "0.1.0"
+
+SUBJECT_COL = "Subject"
+OBJECT_COL = "Object"
+
+ONTOLOGY_TABLES_FOLDER = os.path.join("..", "resources")
+
+
+# In-memory index of the class hierarchy of an ontology, built from its edges (asserted subclass-of edges) and
+#  entailed edges tables. CURIEs are interned as integer IDs, and each relation between terms is stored as a pair of
+#  compressed sparse row (CSR) arrays (indptr, indices), such that the IDs of the terms related to the term with ID i
+#  are indices[indptr[i]:indptr[i + 1]]
+class OntologyIndex:
+    def __init__(self, edges_df, entailed_edges_df):
+        entailed_edges_df = entailed_edges_df[entailed_edges_df[SUBJECT_COL] != entailed_edges_df[OBJECT_COL]]
+        edges_df = edges_df[[SUBJECT_COL, OBJECT_COL]].drop_duplicates()
+        entailed_edges_df = entailed_edges_df[[SUBJECT_COL, OBJECT_COL]].drop_duplicates()
+        codes, self.terms = pd.factorize(np.concatenate([edges_df[SUBJECT_COL].to_numpy(dtype=object),
+                                                         edges_df[OBJECT_COL].to_numpy(dtype=object),
+                                                         entailed_edges_df[SUBJECT_COL].to_numpy(dtype=object),
+                                                         entailed_edges_df[OBJECT_COL].to_numpy(dtype=object)]))
+        self.terms = np.asarray(self.terms, dtype=object)
+        self.term_ids = {term: term_id for term_id, term in enumerate(self.terms)}
+        edge_subjects, edge_objects, entailed_subjects, entailed_objects = \
+            np.split(codes, np.cumsum([len(edges_df), len(edges_df), len(entailed_edges_df)]))
+        self._parents = self._get_csr_arrays(edge_subjects, edge_objects)
+        self._children = self._get_csr_arrays(edge_objects, edge_subjects)
+        self._ancestors = self._get_csr_arrays(entailed_subjects, entailed_objects)
+        self._descendants = self._get_csr_arrays(entailed_objects, entailed_subjects)
+
+    # Build the index from the edges tables of the given ontology in the given database connection
+    @classmethod
+    def from_database(cls, connection, ontology_name="efo"):
+        edges_df = pd.read_sql_query(f"SELECT Subject, Object FROM `{ontology_name}_edges`", connection)
+        entailed_edges_df = pd.read_sql_query(f"SELECT Subject, Object FROM `{ontology_name}_entailed_edges`",
+                                              connection)
+        return cls(edges_df, entailed_edges_df)
+
+    # Build the index from the edges tables of the given ontology saved (as TSV files) in the given folder
+    @classmethod
+    def from_tables(cls, tables_folder=ONTOLOGY_TABLES_FOLDER, ontology_name="efo"):
+        edges_df = pd.read_csv(os.path.join(tables_folder, ontology_name + "_edges.tsv"), sep="\t", dtype=str)
+        entailed_edges_df = pd.read_csv(os.path.join(tables_folder, ontology_name + "_entailed_edges.tsv"), sep="\t",
+                                        dtype=str)
+        return cls(edges_df.dropna(), entailed_edges_df.dropna())
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return term in self.term_ids
+
+    # Get the direct (asserted) superclasses of the given term
+    def parents(self, term):
+        return self.terms[self._get_related_ids(term, self._parents)]
+
+    # Get the direct (asserted) subclasses of the given term
+    def children(self, term):
+        return self.terms[self._get_related_ids(term, self._children)]
+
+    # Get all the (entailed) superclasses of the given term, optionally including the term itself
+    def ancestors(self, term, include_self=False):
+        return self._with_self(term, self.terms[self._get_related_ids(term, self._ancestors)], include_self)
+
+    # Get all the (entailed) subclasses of the given term, optionally including the term itself
+    def descendants(self, term, include_self=False):
+        return self._with_self(term, self.terms[self._get_related_ids(term, self._descendants)], include_self)
+
+    # Get the lowest common ancestors of the given terms, that is, the common ancestors (or the terms themselves) that
+    #  are not a superclass of any other common ancestor. Terms equivalent to each other (i.e., in a cycle of entailed
+    #  edges) are all returned when they are lowest common ancestors
+    def lowest_common_ancestors(self, *terms):
+        if len(terms) == 0 or any(term not in self.term_ids for term in terms):
+            return self.terms[:0]
+        common_ids = None
+        for term in terms:
+            ancestor_ids = np.append(self._get_related_ids(term, self._ancestors), self.term_ids[term])
+            common_ids = ancestor_ids if common_ids is None else np.intersect1d(common_ids, ancestor_ids)
+        # A common ancestor is not lowest if it is a superclass of another common ancestor, unless that other common
+        #  ancestor is also a superclass of it (i.e., they are equivalent)
+        ancestor_slices = [self._get_related_ids_by_id(common_id, self._ancestors) for common_id in common_ids]
+        subclass_ids = np.repeat(common_ids, [len(ancestor_slice) for ancestor_slice in ancestor_slices])
+        superclass_ids = np.concatenate(ancestor_slices or [common_ids[:0]]).astype(np.int64)
+        is_common = np.isin(superclass_ids, common_ids)
+        subclass_ids, superclass_ids = subclass_ids[is_common], superclass_ids[is_common]
+        is_equivalent = np.isin(superclass_ids * len(self.terms) + subclass_ids,
+                                subclass_ids * len(self.terms) + superclass_ids)
+        return self.terms[np.setdiff1d(common_ids, superclass_ids[~is_equivalent])]
+
+    # Expand the given search terms into the terms whose annotations match them, that is, the search terms and
+    #  (optionally) their direct or all entailed subclasses, as searched for by query_database
+    def expand_terms(self, terms, include_subclasses=True, direct_subclasses_only=False):
+        terms = list(terms)
+        if not include_subclasses:
+            return terms
+        relation = self._children if direct_subclasses_only else self._descendants
+        related_ids = [self._get_related_ids(term, relation) for term in terms]
+        subclasses = self.terms[np.unique(np.concatenate(related_ids))] if related_ids else []
+        return list(dict.fromkeys(terms + list(subclasses)))
+
+    def _get_related_ids(self, term, relation):
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return relation[1][:0]
+        return self._get_related_ids_by_id(term_id, relation)
+
+    @staticmethod
+    def _get_related_ids_by_id(term_id, relation):
+        indptr, indices = relation
+        return indices[indptr[term_id]:indptr[term_id + 1]]
+
+    def _with_self(self, term, related_terms, include_self):
+        if include_self and term in self.term_ids:
+            return np.append(self.terms[[self.term_ids[term]]], related_terms)
+        return related_terms
+
+    def _get_csr_arrays(self, sources, targets):
+        order = np.argsort(sources, kind="stable")
+        indptr = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(self.terms)), out=indptr[1:])
+        return indptr, targets[order].astype(np.int32)
@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import sqlite3
+import datetime
+import multiprocessing
+import numpy as np
+import pandas as pd
+import sparse_dot_topn
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from text2term import onto_utils
+from text2term.config import VERSION as TEXT2TERM_VERSION
+from text2term.term import OntologyTermType
+from ontology_term_index import get_ontology_term_index, IRI_COL, LABEL_COL, TARGET_LABEL_COL
+
+__version__ = "0.4.0"
+
+# Number of distinct source terms mapped in each chunk
+MAPPING_CHUNK_SIZE = 1000
+
+# Maximum number of chunks mapped concurrently (each in its own process)
+MAPPING_WORKERS = 4
+
+# Number of the most similar target labels and synonyms considered for each source term (as in text2term), among which
+#  the top-scoring distinct ontology terms are kept
+CANDIDATE_LABELS = 50
+
+# Columns of the mappings table (as in text2term)
+SOURCE_TERM_ID_COL = "Source Term ID"
+SOURCE_TERM_COL = "Source Term"
+MAPPED_TERM_LABEL_COL = "Mapped Term Label"
+MAPPED_TERM_CURIE_COL = "Mapped Term CURIE"
+MAPPED_TERM_IRI_COL = "Mapped Term IRI"
+MAPPING_SCORE_COL = "Mapping Score"
+TAGS_COL = "Tags"
+
+# Mapper whose mappings are computed (and cached)
+MAPPER = "tfidf"
+
+# Columns of the mapping cache that identify the mappings of the same ontology version and mapping settings
+CACHE_KEY_COLUMNS = ("Ontology", "OntologyVersion", "Mapper", "MinScore", "MaxMappings", "BaseIRIs")
+CACHE_KEY_CONDITION = " AND ".join(f"{column}=?" for column in CACHE_KEY_COLUMNS)
+
+# Target index shared by the processes that map the chunks of source terms
+_target_index = None
+
+
+# Map the given source terms to the terms of the given ontology with text2term's TF-IDF mapper, as
+#  text2term.map_terms(..., mapper=Mapper.TFIDF, excl_deprecated=True) does, but mapping each distinct source term only
+#  once. The distinct terms are split into chunks, which are mapped concurrently by a pool of (at most) max_workers
+#  processes that share the TF-IDF index of the ontology's labels and synonyms, and their mappings are then expanded back
+#  to every source term ID. As in text2term, the TF-IDF weights of the source terms are fitted on all the source terms
+#  (duplicates included), and a source term that repeats the previous source term with any candidate mappings gets no
+#  mappings (text2term gives the mappings of a run of the same term to its first occurrence), so the mappings (and
+#  scores) are those text2term gives.
+# If a cache file is given, the mappings of each (normalized) source term are kept in it, keyed by the ontology and its
+#  version (by default, the ontology URL) and the mapping settings, and only the terms not in the cache are mapped (the
+#  ontology is not loaded at all if every term is in the cache). The mappings of other versions of the ontology are
+#  evicted from the cache. The mappings are saved to the given output file (if any) in text2term's format. Returns the
+#  mappings table
+def map_terms(source_terms, source_term_ids, ontology_url, base_iris=(), max_mappings=3, min_score=0.3,
+              output_file="", chunk_size=MAPPING_CHUNK_SIZE, max_workers=MAPPING_WORKERS, cache_file="",
+              ontology_name="", ontology_version="", refresh_cache=False):
+    if len(source_term_ids) != len(source_terms):
+        source_term_ids = onto_utils.generate_iris(len(source_terms))
+    term_codes, distinct_terms = pd.factorize(pd.Series(source_terms, dtype=object))
+    normalized_terms = [onto_utils.normalize(term) for term in distinct_terms]
+
+    cached_mappings_df = pd.DataFrame(columns=["TermCode", "Rank", MAPPED_TERM_LABEL_COL, MAPPED_TERM_CURIE_COL,
+                                               MAPPED_TERM_IRI_COL, MAPPING_SCORE_COL])
+    cache_key = (ontology_name or ontology_url, ontology_version or ontology_url, MAPPER, min_score, max_mappings,
+                 json.dumps(list(base_iris)))
+    if cache_file != "":
+        cache_connection = open_mapping_cache(cache_file)
+        with cache_connection:
+            evicted = cache_connection.execute("DELETE FROM mapping_cache WHERE Ontology=? AND OntologyVersion<>?",
+                                               cache_key[:2]).rowcount
+            if refresh_cache:
+                cache_connection.execute(f"DELETE FROM mapping_cache WHERE {CACHE_KEY_CONDITION}", cache_key)
+        cached_mappings_df = _get_cached_mappings(cache_connection, cache_key, normalized_terms)
+        cached_codes = cached_mappings_df["TermCode"].unique()
+        cached_count = len(cached_codes)
+        print(f"...found {cached_count} of {len(distinct_terms)} distinct source terms in the mapping cache "
+              f"({cached_count / max(len(distinct_terms), 1):.1%} hit rate), evicted {evicted} cached mappings of "
+              f"other versions of the ontology")
+        cached_mappings_df = cached_mappings_df[cached_mappings_df["Rank"] > 0]  # terms cached without mappings
+        uncached_codes = np.setdiff1d(np.arange(len(distinct_terms)), cached_codes)
+    else:
+        uncached_codes = np.arange(len(distinct_terms))
+    term_mappings = [cached_mappings_df]
+    if len(uncached_codes) > 0:
+        new_mappings_df = _map_distinct_terms(normalized_terms, term_codes, uncached_codes, ontology_url, base_iris,
+                                              max_mappings, min_score, chunk_size, max_workers,
+                                              ontology_name=ontology_name, ontology_version=ontology_version)
+        if cache_file != "":
+            _add_mappings_to_cache(cache_connection, cache_key, normalized_terms, uncached_codes, new_mappings_df)
+        term_mappings.append(new_mappings_df)
+    if cache_file != "":
+        cache_connection.close()
+
+    # Expand the mappings of each distinct source term to every source term ID with that term (but the repeats of the
+    #  previous mapped term), in the order of the source terms (and of the mappings of each term)
+    distinct_mappings_df = pd.concat(term_mappings, ignore_index=True).astype({"TermCode": "int64", "Rank": "int64"})
+    sources_df = pd.DataFrame({"TermCode": term_codes, SOURCE_TERM_ID_COL: pd.Series(source_term_ids, dtype=object),
+                               SOURCE_TERM_COL: pd.Series(source_terms, dtype=object)}).reset_index()
+    sources_df = sources_df[~_get_repeated_terms(term_codes, distinct_mappings_df["TermCode"].unique())]
+    mappings_df = sources_df.merge(distinct_mappings_df, on="TermCode")
+    mappings_df = mappings_df.sort_values(["index", "Rank"], kind="stable", ignore_index=True)
+    mappings_df = mappings_df[mappings_df[MAPPING_SCORE_COL] >= min_score]
+    mappings_df[MAPPING_SCORE_COL] = mappings_df[MAPPING_SCORE_COL].astype(float).round(decimals=3)
+    mappings_df[TAGS_COL] = "None"  # text2term's tags of terms given without tags
+    mappings_df = mappings_df[[SOURCE_TERM_ID_COL, SOURCE_TERM_COL, MAPPED_TERM_LABEL_COL, MAPPED_TERM_CURIE_COL,
+                               MAPPED_TERM_IRI_COL, MAPPING_SCORE_COL, TAGS_COL]].reset_index(drop=True)
+    if output_file != "":
+        _save_mappings(mappings_df, output_file, ontology_url, base_iris, max_mappings, min_score, len(source_terms))
+    return mappings_df
+
+
+# Find the source terms (given by the codes of their distinct terms) that text2term's TF-IDF mapper gives no mappings
+#  for, despite having candidate mappings: the mapper takes the candidates of the source terms in order, and the
+#  candidates of a source term that is the same as the previous source term with any candidates are taken as more
+#  candidates of that term (which only adds mappings to ontology terms not already mapped to, up to max_mappings).
+#  Since the candidates of the same term are the same, each such repeat of a term gets no mappings. Returns a boolean
+#  array marking those source terms
+def _get_repeated_terms(term_codes, mapped_codes):
+    term_codes = np.asarray(term_codes)
+    has_candidates = np.isin(term_codes, mapped_codes)
+    candidate_codes = term_codes[has_candidates]
+    repeated = np.zeros(len(term_codes), dtype=bool)
+    repeated[np.flatnonzero(has_candidates)[1:]] = candidate_codes[1:] == candidate_codes[:-1]
+    return repeated
+
+
+# Map the distinct source terms of the given codes, in chunks mapped concurrently by a pool of processes that share the
+#  TF-IDF index of the ontology. The TF-IDF weights of the source terms are fitted on all the source terms (given by
+#  the codes of their distinct terms). Returns the mappings of each of those terms (by its code, and the rank of each
+#  of its mappings)
+def _map_distinct_terms(normalized_terms, term_codes, mapped_codes, ontology_url, base_iris, max_mappings, min_score,
+                        chunk_size, max_workers, ontology_name="", ontology_version=""):
+    start = time.time()
+    target_index = get_target_index(ontology_url, base_iris=base_iris, source_terms=normalized_terms,
+                                    ontology_name=ontology_name, ontology_version=ontology_version)
+    print(f"...built the TF-IDF index of {len(target_index['labels'])} labels and synonyms of the ontology terms "
+          f"({time.time() - start:.1f} seconds)")
+
+    # Weigh the source terms by the document frequencies of their n-grams in all the source terms
+    source_vectorizer = TfidfVectorizer(vocabulary=target_index["vocabulary"], analyzer="char_wb", ngram_range=(3, 3))
+    source_vectorizer.fit(np.asarray(normalized_terms, dtype=object)[term_codes])
+    source_matrix = source_vectorizer.transform([normalized_terms[code] for code in mapped_codes]).tocsr()
+
+    chunks = [(mapped_codes[chunk_start:chunk_start + chunk_size], source_matrix[chunk_start:chunk_start + chunk_size],
+               max_mappings, min_score) for chunk_start in range(0, len(mapped_codes), chunk_size)]
+    workers = min(max_workers, len(chunks))
+    if workers > 1:
+        with multiprocessing.Pool(processes=workers, initializer=_set_target_index,
+                                  initargs=(target_index,)) as pool:
+            results = pool.map(_map_chunk, chunks, chunksize=1)
+    else:
+        _set_target_index(target_index)
+        results = [_map_chunk(chunk) for chunk in chunks]
+
+    usage_df = pd.DataFrame([(chunk_number, chunk_terms, seconds, chunk_terms / max(seconds, 1e-6))
+                             for chunk_number, (_, chunk_terms, seconds) in enumerate(results)],
+                            columns=["Chunk", "Terms", "Seconds", "Terms/second"])
+    print(f"Time taken to map each chunk of distinct source terms ({len(mapped_codes)} distinct of "
+          f"{len(term_codes)} source terms, {workers} processes):")
+    print(usage_df.round(1).to_string(index=False))
+
+    mappings_df = pd.concat([chunk_mappings_df for chunk_mappings_df, _, _ in results], ignore_index=True)
+    mapped_iris = mappings_df[MAPPED_TERM_IRI_COL].unique()
+    curies = dict(zip(mapped_iris, [onto_utils.curie_from_iri(iri) for iri in mapped_iris]))
+    mappings_df.insert(3, MAPPED_TERM_CURIE_COL, mappings_df[MAPPED_TERM_IRI_COL].map(curies))
+    return mappings_df
+
+
+# Build the TF-IDF index of the labels and synonyms of the (non-deprecated) classes of the given ontology, whose terms
+#  start with any of the given base IRIs (taken from the prebuilt term index of the ontology version), over the
+#  vocabulary of the character 3-grams of those labels and synonyms and of the given (normalized) source terms, as
+#  text2term's TF-IDF mapper does
+def get_target_index(ontology_url, base_iris=(), source_terms=(), ontology_name="", ontology_version=""):
+    term_index_df = get_ontology_term_index(ontology_url, ontology_name=ontology_name,
+                                            ontology_version=ontology_version, base_iris=base_iris)
+    target_labels = term_index_df[TARGET_LABEL_COL].tolist()
+    target_iris = term_index_df[IRI_COL].tolist()
+    target_term_labels = term_index_df[LABEL_COL].tolist()
+    vocabulary = CountVectorizer(analyzer="char_wb", ngram_range=(3, 3)).fit(
+        list(source_terms) + target_labels).vocabulary_
+    target_vectorizer = TfidfVectorizer(vocabulary=vocabulary, analyzer="char_wb", ngram_range=(3, 3))
+    target_matrix = target_vectorizer.fit_transform(target_labels).transpose().tocsr()
+    return {"labels": target_labels, "iris": target_iris, "term_labels": target_term_labels,
+            "vocabulary": vocabulary, "matrix": target_matrix}
+
+
+# Open the mapping cache in the given SQLite file, in which the mappings of each normalized source term are kept, with
+#  the rank of each of its mappings (a term without any mapping is kept with rank 0, so that it is not mapped again)
+def open_mapping_cache(cache_file):
+    if os.path.dirname(cache_file):
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    connection = sqlite3.connect(cache_file)
+    connection.execute("CREATE TABLE IF NOT EXISTS mapping_cache (SourceTerm TEXT, Ontology TEXT, OntologyVersion TEXT, "
+                       "Mapper TEXT, MinScore REAL, MaxMappings INTEGER, BaseIRIs TEXT, Rank INTEGER, "
+                       "MappedTermLabel TEXT, MappedTermCURIE TEXT, MappedTermIRI TEXT, MappingScore REAL, "
+                       "MappingTimestamp TEXT, PRIMARY KEY (SourceTerm, Ontology, OntologyVersion, Mapper, MinScore, "
+                       "MaxMappings, BaseIRIs, Rank))")
+    return connection
+
+
+# Get the cached mappings of the given normalized source terms, by the code of each term (its index in the given list),
+#  including the terms cached without any mapping (with rank 0)
+def _get_cached_mappings(cache_connection, cache_key, normalized_terms):
+    cached_df = pd.read_sql_query(f"SELECT SourceTerm, Rank, MappedTermLabel, MappedTermCURIE, MappedTermIRI, "
+                                  f"MappingScore FROM mapping_cache WHERE {CACHE_KEY_CONDITION}", cache_connection,
+                                  params=cache_key)
+    cached_df.columns = ["SourceTerm", "Rank", MAPPED_TERM_LABEL_COL, MAPPED_TERM_CURIE_COL, MAPPED_TERM_IRI_COL,
+                         MAPPING_SCORE_COL]
+    terms_df = pd.DataFrame({"TermCode": np.arange(len(normalized_terms)), "SourceTerm": normalized_terms})
+    return terms_df.merge(cached_df, on="SourceTerm").drop(columns="SourceTerm")
+
+
+# Add the mappings of the (normalized) source terms of the given codes to the cache, including the terms without any
+#  mapping
+def _add_mappings_to_cache(cache_connection, cache_key, normalized_terms, mapped_codes, mappings_df):
+    mapping_timestamp = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    unmapped_codes = np.setdiff1d(mapped_codes, mappings_df["TermCode"].unique())
+    rows = [(normalized_terms[code],) + cache_key + (int(rank), label, curie, iri, float(score), mapping_timestamp)
+            for code, rank, label, curie, iri, score in mappings_df[["TermCode", "Rank", MAPPED_TERM_LABEL_COL,
+                                                                     MAPPED_TERM_CURIE_COL, MAPPED_TERM_IRI_COL,
+                                                                     MAPPING_SCORE_COL]].itertuples(index=False)]
+    rows += [(normalized_terms[code],) + cache_key + (0, None, None, None, None, mapping_timestamp)
+             for code in unmapped_codes]
+    with cache_connection:
+        cache_connection.executemany("INSERT OR REPLACE INTO mapping_cache VALUES "
+                                     "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def _set_target_index(target_index):
+    global _target_index
+    _target_index = target_index
+
+
+# Map a chunk of (the TF-IDF vectors of) distinct source terms to the top-scoring distinct ontology terms among their
+#  most similar target labels and synonyms (whose CURIEs are then obtained once for all the chunks). Returns the
+#  mappings (by the code of each source term, and the rank of each of its mappings), the number of source terms in the
+#  chunk and the time taken to map them
+def _map_chunk(chunk):
+    chunk_codes, chunk_matrix, max_mappings, min_score = chunk
+    start = time.time()
+    results = sparse_dot_topn.awesome_cossim_topn(chunk_matrix, _target_index["matrix"], ntop=CANDIDATE_LABELS,
+                                                  lower_bound=min_score).tocsr()
+    mappings = []
+    for row in range(chunk_matrix.shape[0]):
+        term_iris = set()
+        for column, score in zip(results.indices[results.indptr[row]:results.indptr[row + 1]],
+                                 results.data[results.indptr[row]:results.indptr[row + 1]]):
+            if len(term_iris) == max_mappings:
+                break
+            iri = _target_index["iris"][column]
+            if iri not in term_iris:
+                term_iris.add(iri)
+                mappings.append((chunk_codes[row], len(term_iris), _target_index["term_labels"][column], iri, score))
+    mappings_df = pd.DataFrame(mappings, columns=["TermCode", "Rank", MAPPED_TERM_LABEL_COL, MAPPED_TERM_IRI_COL,
+                                                  MAPPING_SCORE_COL])
+    return mappings_df, chunk_matrix.shape[0], time.time() - start
+
+
+# Save the mappings in the format of the mappings files of text2term (which are appended to the output file)
+def _save_mappings(mappings_df, output_file, ontology_url, base_iris, max_mappings, min_score, source_term_count):
+    if os.path.dirname(output_file):
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open(output_file, "a") as file_out:
+        file_out.write(f"# Timestamp: {datetime.datetime.now()}\n")
+        file_out.write(f"# Target Ontology: {ontology_url}\n")
+        file_out.write(f"# text2term version: {TEXT2TERM_VERSION}\n")
+        file_out.write(f"# Minimum Score: {min_score:.2f}\n")
+        file_out.write("# Mapper: tfidf\n")
+        file_out.write(f"# Base IRIs: {tuple(base_iris)}\n")
+        file_out.write(f"# Max Mappings: {max_mappings}\n")
+        file_out.write(f"# Term Type: {OntologyTermType.CLASS}\n")
+        file_out.write("# Deprecated Terms Excluded\n")
+        file_out.write("# Unmapped Terms Excluded\n")
+        file_out.write(f"# Of {source_term_count} entries, {mappings_df[SOURCE_TERM_ID_COL].nunique()} were mapped to "
+                       f"{mappings_df[MAPPED_TERM_IRI_COL].nunique()} unique terms\n")
+    mappings_df.to_csv(output_file, index=False, mode="a")
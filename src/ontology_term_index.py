@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import hashlib
+import urllib.error
+import pandas as pd
+from text2term.term import OntologyTermType
+from text2term.term_collector import OntologyTermCollector
+from download_cache import download_file
+
+__version__ = "0.2.0"
+
+# Folder of the local copies of the ontologies (OWL files) and of the indexes of their terms
+ONTOLOGY_CACHE_FOLDER = os.path.join("..", "resources", "ontology_cache")
+
+# Columns of the term index: a row per label or synonym of each ontology term, with the term's IRI and main label
+IRI_COL = "IRI"
+LABEL_COL = "Label"
+TARGET_LABEL_COL = "TargetLabel"
+
+
+# Get the local copy of the ontology (OWL file) at the given URL. A given version of the ontology is downloaded once,
+#  and its copy is then used as is, without any request (so it is available offline). Without a version, the copy is
+#  revalidated with a conditional request, and used as is if the URL cannot be reached. Returns the path of the copy
+def get_ontology_file(ontology_url, ontology_name="", ontology_version="", cache_folder=ONTOLOGY_CACHE_FOLDER):
+    if os.path.isfile(ontology_url):  # a local ontology file is used in place
+        return ontology_url
+    ontology_file = os.path.join(cache_folder, _get_ontology_key(ontology_url, ontology_name, ontology_version) + ".owl")
+    if ontology_version != "" and os.path.isfile(ontology_file):
+        return ontology_file
+    os.makedirs(cache_folder, exist_ok=True)
+    print(f"Downloading ontology file from {ontology_url}...")
+    try:
+        download_file(ontology_url, ontology_file)  # skipped if the previously downloaded file is up to date
+    except urllib.error.URLError as error:
+        if not os.path.isfile(ontology_file):
+            raise
+        print(f"...could not check whether {os.path.basename(ontology_file)} is up to date ({error})—using it as is")
+    return ontology_file
+
+
+# Get the index of the labels and synonyms of the (non-deprecated) classes of the given ontology whose IRIs start with
+#  any of the given base IRIs, in the order in which text2term's TF-IDF mapper takes them (the labels and then the
+#  synonyms of each term). The index is built once for each version of the ontology and base IRIs, by collecting the
+#  terms of the ontology with text2term's term collector (as text2term.map_terms does), and saved to a compressed TSV
+#  file that is loaded instead of parsing the ontology again. Without a version, the index is rebuilt when the copy of
+#  the ontology changes. Returns the index table
+def get_ontology_term_index(ontology_url, ontology_name="", ontology_version="", base_iris=(),
+                            cache_folder=ONTOLOGY_CACHE_FOLDER):
+    base_iris_key = hashlib.sha256(json.dumps(list(base_iris)).encode()).hexdigest()[:8] if base_iris else "all"
+    index_file = os.path.join(cache_folder, f"{_get_ontology_key(ontology_url, ontology_name, ontology_version)}_"
+                                            f"{base_iris_key}_terms.tsv.gz")
+    if ontology_version == "" or not os.path.isfile(index_file):
+        ontology_file = get_ontology_file(ontology_url, ontology_name=ontology_name,
+                                          ontology_version=ontology_version, cache_folder=cache_folder)
+        if not os.path.isfile(index_file) or os.path.getmtime(index_file) < os.path.getmtime(ontology_file):
+            build_ontology_term_index(ontology_file, index_file, base_iris=base_iris)
+    start = time.time()
+    index_df = pd.read_csv(index_file, sep="\t", dtype=str, keep_default_na=False)
+    print(f"...loaded the index of {len(index_df)} labels and synonyms of {index_df[IRI_COL].nunique()} ontology terms "
+          f"from {os.path.basename(index_file)} ({time.time() - start:.1f} seconds)")
+    return index_df
+
+
+# Build the index of the labels and synonyms of the (non-deprecated) classes of the given ontology file whose IRIs start
+#  with any of the given base IRIs, and save it to the given (gzip compressed) index file. Returns the index table
+def build_ontology_term_index(ontology_file, index_file, base_iris=()):
+    print(f"Building the term index of {os.path.basename(ontology_file)}...")
+    start = time.time()
+    term_collector = OntologyTermCollector(ontology_iri=ontology_file)
+    ontology_terms = term_collector.get_ontology_terms(base_iris=base_iris, exclude_deprecated=True,
+                                                       term_type=OntologyTermType.CLASS)
+    term_collector.close()
+    if len(ontology_terms) == 0:
+        raise RuntimeError(f"Could not find any terms in the ontology {ontology_file}")
+    index_df = pd.DataFrame([(term.iri, term.label, label) for term in ontology_terms.values()
+                             for label in list(term.labels) + list(term.synonyms)],
+                            columns=[IRI_COL, LABEL_COL, TARGET_LABEL_COL])
+    if os.path.dirname(index_file):
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+    index_df.to_csv(index_file + ".part", sep="\t", index=False, compression="gzip")
+    os.replace(index_file + ".part", index_file)
+    print(f"...done indexing {len(index_df)} labels and synonyms of {len(ontology_terms)} terms "
+          f"({time.time() - start:.1f} seconds)")
+    return index_df
+
+
+# Get the name under which the copy and the term indexes of the given ontology are saved: the ontology name (by default,
+#  the name of the ontology file) and version (by default, a digest of the URL)
+def _get_ontology_key(ontology_url, ontology_name, ontology_version):
+    ontology_name = ontology_name or os.path.splitext(os.path.basename(ontology_url))[0]
+    ontology_version = ontology_version or hashlib.sha256(ontology_url.encode()).hexdigest()[:12]
+    return f"{ontology_name.lower()}_{ontology_version}"
@@ -1,12 +1,168 @@
 import os
+import json
 import sqlite3
-import tarfile
+import numpy as np
 import pandas as pd
+from pathlib import Path
 
-__version__ = "0.3.0"
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # optional: only needed to load the Parquet files of the database tables
+    pq = None
 
+__version__ = "0.10.0"
 
-def resources_annotated_with_terms(db_cursor, search_terms, include_subclasses=True, direct_subclasses_only=False):
+
+# Columns of the metadata table returned by the search functions
+RESOURCE_COLUMNS = ["STUDY.ACCESSION", "DISEASE.TRAIT", "MAPPED_TRAIT", "MAPPED_TRAIT_URI", "MAPPED_TRAIT_CURIE"]
+
+# Size of the per-connection cache of prepared statements of connections opened by open_database
+CACHED_STATEMENTS = 256
+
+# Search queries, one per ontology table consulted for subclasses (None for direct annotations only). The query text
+#  is fixed and the search terms are bound as a single JSON array parameter (expanded into rows by SQLite's json_each
+#  function), so that each query is prepared once per connection and then reused from its statement cache
+_RESOURCES_QUERY = """SELECT DISTINCT
+        """ + ",\n        ".join(f"study.`{column}`" for column in RESOURCE_COLUMNS) + """
+    FROM
+        `gwascatalog_metadata` study
+    WHERE
+        study.`STUDY.ACCESSION` IN (
+            SELECT mapping.`STUDY.ACCESSION`
+            FROM `gwascatalog_mappings` mapping
+            WHERE mapping.MAPPED_TRAIT_CURIE IN (SELECT value FROM json_each(:search_terms)){subclasses_query}
+        )"""
+
+_SUBCLASSES_QUERY = """
+            UNION
+            SELECT mapping.`STUDY.ACCESSION`
+            FROM `{ontology_table}` ee
+                JOIN `gwascatalog_mappings` mapping ON (mapping.MAPPED_TRAIT_CURIE = ee.Subject)
+            WHERE ee.Object IN (SELECT value FROM json_each(:search_terms))"""
+
+# Searches with all (entailed) subclasses can instead read the resources of each search term, precomputed at build
+#  time, from the term resources table (see build_database.create_term_resources_table), with a single range scan of
+#  the table per search term
+_TERM_STUDIES_RESOURCES_QUERY = """SELECT DISTINCT
+        """ + ",\n        ".join(f"study.`{column}`" for column in RESOURCE_COLUMNS) + """
+    FROM
+        `gwascatalog_metadata` study
+    WHERE
+        study.`STUDY.ACCESSION` IN (
+            SELECT term.`STUDY.ACCESSION`
+            FROM `efo_term_studies` term
+            WHERE term.Subject IN (SELECT value FROM json_each(:search_terms))
+        )"""
+
+RESOURCES_QUERIES = {
+    None: _RESOURCES_QUERY.format(subclasses_query=""),
+    "efo_edges": _RESOURCES_QUERY.format(subclasses_query=_SUBCLASSES_QUERY.format(ontology_table="efo_edges")),
+    "efo_entailed_edges": _RESOURCES_QUERY.format(
+        subclasses_query=_SUBCLASSES_QUERY.format(ontology_table="efo_entailed_edges")),
+    "efo_term_studies": _TERM_STUDIES_RESOURCES_QUERY
+}
+
+
+# Lookups of the search terms each resource is annotated with (directly or through a subclass), for batch searches
+_TERM_RESOURCES_QUERY = """SELECT mapping.MAPPED_TRAIT_CURIE, mapping.`STUDY.ACCESSION`
+    FROM `gwascatalog_mappings` mapping
+    WHERE mapping.MAPPED_TRAIT_CURIE IN (SELECT value FROM json_each(:search_terms)){subclasses_query}"""
+
+_TERM_SUBCLASSES_QUERY = """
+    UNION
+    SELECT ee.Object, mapping.`STUDY.ACCESSION`
+    FROM `{ontology_table}` ee
+        JOIN `gwascatalog_mappings` mapping ON (mapping.MAPPED_TRAIT_CURIE = ee.Subject)
+    WHERE ee.Object IN (SELECT value FROM json_each(:search_terms))"""
+
+TERM_RESOURCES_QUERIES = {
+    None: _TERM_RESOURCES_QUERY.format(subclasses_query=""),
+    "efo_edges": _TERM_RESOURCES_QUERY.format(
+        subclasses_query=_TERM_SUBCLASSES_QUERY.format(ontology_table="efo_edges")),
+    "efo_entailed_edges": _TERM_RESOURCES_QUERY.format(
+        subclasses_query=_TERM_SUBCLASSES_QUERY.format(ontology_table="efo_entailed_edges")),
+    "efo_term_studies": """SELECT term.Subject, term.`STUDY.ACCESSION`
+    FROM `efo_term_studies` term
+    WHERE term.Subject IN (SELECT value FROM json_each(:search_terms))"""
+}
+
+# Free-text search query: the ontology terms whose labels or synonyms match the search text are looked up in the
+#  full-text search tables (ranked by the BM25 score of their best match), and expanded into their subclasses, and the
+#  resources annotated with any of them are returned, each with the best-ranked matched term it was found through
+_TEXT_SEARCH_QUERY = """WITH matched_term AS (
+        SELECT Key AS Term, MIN(Score) AS Score
+        FROM (
+            SELECT Key, bm25(efo_labels_fts) AS Score FROM efo_labels_fts WHERE efo_labels_fts MATCH :search_text
+            UNION ALL
+            SELECT Key, bm25(efo_synonyms_fts) FROM efo_synonyms_fts WHERE efo_synonyms_fts MATCH :search_text
+        )
+        GROUP BY Key
+        ORDER BY Score, Key
+        LIMIT :max_terms
+    ),
+    search_term AS (
+        SELECT Term, Term AS MatchedTerm, Score FROM matched_term{subclasses_query}
+    ),
+    resource AS (
+        SELECT mapping.`STUDY.ACCESSION`, search_term.MatchedTerm, MIN(search_term.Score) AS Score
+        FROM search_term
+            JOIN `gwascatalog_mappings` mapping ON (mapping.MAPPED_TRAIT_CURIE = search_term.Term)
+        GROUP BY mapping.`STUDY.ACCESSION`
+    )
+    SELECT
+        """ + ",\n        ".join(f"study.`{column}`" for column in RESOURCE_COLUMNS) + """,
+        resource.MatchedTerm,
+        label.Object AS MatchedTermLabel,
+        -resource.Score AS Score
+    FROM
+        resource
+        JOIN `gwascatalog_metadata` study ON (study.`STUDY.ACCESSION` = resource.`STUDY.ACCESSION`)
+        LEFT JOIN `efo_labels` label ON (label.Subject = resource.MatchedTerm)
+    ORDER BY resource.Score, study.`STUDY.ACCESSION`"""
+
+_TEXT_SEARCH_SUBCLASSES_QUERY = """
+        UNION
+        SELECT ee.Subject, matched_term.Term, matched_term.Score
+        FROM `{ontology_table}` ee
+            JOIN matched_term ON (ee.Object = matched_term.Term)"""
+
+TEXT_SEARCH_QUERIES = {
+    None: _TEXT_SEARCH_QUERY.format(subclasses_query=""),
+    "efo_edges": _TEXT_SEARCH_QUERY.format(
+        subclasses_query=_TEXT_SEARCH_SUBCLASSES_QUERY.format(ontology_table="efo_edges")),
+    "efo_entailed_edges": _TEXT_SEARCH_QUERY.format(
+        subclasses_query=_TEXT_SEARCH_SUBCLASSES_QUERY.format(ontology_table="efo_entailed_edges"))
+}
+
+# Full-text search tables of the database (see build_database.create_text_search_tables), by the table and column whose
+#  text they index
+TEXT_SEARCH_TABLES = {"efo_labels": "efo_labels_fts", "efo_synonyms": "efo_synonyms_fts",
+                      "gwascatalog_metadata": "gwascatalog_metadata_fts",
+                      "gwascatalog_references": "gwascatalog_references_fts"}
+
+RESOURCES_BY_ID_QUERY = """SELECT DISTINCT
+        """ + ",\n        ".join(f"study.`{column}`" for column in RESOURCE_COLUMNS) + """
+    FROM
+        `gwascatalog_metadata` study
+    WHERE
+        study.`STUDY.ACCESSION` IN (SELECT value FROM json_each(:resource_ids))"""
+
+
+def open_database(database_filepath, cached_statements=CACHED_STATEMENTS):
+    """
+    Open a read-only connection to the search database. The connection is meant to be kept open and reused across
+    searches, so that the prepared statements of the search queries are reused
+
+    :param database_filepath:  path to the database file
+    :param cached_statements:  number of prepared statements cached by the connection
+    :return: connection to the database
+    """
+    database_uri = Path(os.path.abspath(database_filepath)).as_uri() + "?mode=ro"
+    return sqlite3.connect(database_uri, uri=True, cached_statements=cached_statements)
+
+
+def resources_annotated_with_terms(db_cursor, search_terms, include_subclasses=True, direct_subclasses_only=False,
+                                   ontology_index=None, use_term_studies=False):
     """
     Retrieve resources annotated with the given search terms and (optionally) subclasses of that term, by specifying
     include_subclasses=True. The argument direct_subclasses_only dictates whether to include only direct subclasses or
@@ -18,80 +174,199 @@ def resources_annotated_with_terms(db_cursor, search_terms, include_subclasses=T
         otherwise only resources explicitly annotated with that term are returned
     :param direct_subclasses_only:  include only the direct subclasses of the given search term,
         otherwise all the resources annotated with inferred subclasses of the given term are returned
+    :param ontology_index:  OntologyIndex (see ontology_index.py) of the ontology, used to expand the search terms into
+        their subclasses in memory, so that only the resources annotated with the expanded terms are looked up in the
+        database. Otherwise, the subclasses are looked up in the ontology edges tables of the database
+    :param use_term_studies:  read the resources annotated with each search term or any of its subclasses from the
+        efo_term_studies table, which holds them precomputed, rather than joining the mappings with the entailed edges.
+        This only applies to searches with all subclasses (and without an ontology_index)
     :return: data frame containing IDs and traits of the GWAS Catalog records found to be annotated with the give term
 
-    An example full-formed SQL query for some example parameters is specified below.
+    The search terms are bound as a parameter of a fixed query, in which the resources annotated directly with the
+    search terms and the resources annotated with their subclasses are looked up separately (each using the table
+    indexes) and combined by a UNION. An example SQL query for some example parameters is specified below.
 
     Function parameters:
     search_terms=['EFO:0009605','EFO:0005741']
     include_subclasses=True
     direct_subclasses_only=False
 
-    SQL query:
+    SQL query (with :search_terms bound to '["EFO:0009605", "EFO:0005741"]'):
     SELECT DISTINCT
         study.`STUDY.ACCESSION`,
         study.`DISEASE.TRAIT`,
-        study.MAPPED_TRAIT,
-        study.MAPPED_TRAIT_URI,
-        study.MAPPED_TRAIT_CURIE
+        study.`MAPPED_TRAIT`,
+        study.`MAPPED_TRAIT_URI`,
+        study.`MAPPED_TRAIT_CURIE`
     FROM
         `gwascatalog_metadata` study
     WHERE
         study.`STUDY.ACCESSION` IN (
-            SELECT DISTINCT mapping.`STUDY.ACCESSION`
+            SELECT mapping.`STUDY.ACCESSION`
             FROM `gwascatalog_mappings` mapping
-                     LEFT JOIN efo_entailed_edges ee ON (mapping.MAPPED_TRAIT_CURIE = ee.Subject)
-            WHERE (mapping.MAPPED_TRAIT_CURIE = 'EFO:0005140' OR ee.Object = 'EFO:0005140')
-        );
+            WHERE mapping.MAPPED_TRAIT_CURIE IN (SELECT value FROM json_each(:search_terms))
+            UNION
+            SELECT mapping.`STUDY.ACCESSION`
+            FROM `efo_entailed_edges` ee
+                JOIN `gwascatalog_mappings` mapping ON (mapping.MAPPED_TRAIT_CURIE = ee.Subject)
+            WHERE ee.Object IN (SELECT value FROM json_each(:search_terms))
+        )
     """
-    if include_subclasses:
-        if direct_subclasses_only:
-            ontology_table = "efo_edges"
-        else:
-            ontology_table = "efo_entailed_edges"
+    if ontology_index is not None:
+        search_terms = ontology_index.expand_terms(search_terms, include_subclasses, direct_subclasses_only)
+        query = RESOURCES_QUERIES[None]
     else:
-        ontology_table = "efo_edges"
-
-    query = '''SELECT DISTINCT
-                    study.`STUDY.ACCESSION`,
-                    study.`DISEASE.TRAIT`,
-                    study.MAPPED_TRAIT,
-                    study.MAPPED_TRAIT_URI,
-                    study.MAPPED_TRAIT_CURIE
-                FROM
-                    `gwascatalog_metadata` study
-                WHERE
-                    study.`STUDY.ACCESSION` IN (
-                        SELECT DISTINCT mapping.`STUDY.ACCESSION`
-                        FROM `gwascatalog_mappings` mapping
-                            LEFT JOIN ''' + ontology_table + ''' ee ON (mapping.MAPPED_TRAIT_CURIE = ee.Subject)'''
-    index = 0
-    where_clause = "\nWHERE ("
-    for term in search_terms:
-        if index == 0:
-            where_clause += "mapping.MAPPED_TRAIT_CURIE = \'" + term + "\'"
-        else:
-            where_clause += " OR mapping.MAPPED_TRAIT_CURIE = \'" + term + "\'"
-        if include_subclasses:
-            where_clause += " OR ee.Object = \'" + term + "\'"
-        index += 1
-    query += where_clause + "))"
-
-    print(query + "\n")
-
-    results = db_cursor.execute(query).fetchall()
+        query = RESOURCES_QUERIES[_get_ontology_table(include_subclasses, direct_subclasses_only, use_term_studies)]
+    results = db_cursor.execute(query, {"search_terms": json.dumps(list(search_terms))}).fetchall()
     results_columns = [x[0] for x in db_cursor.description]
     return pd.DataFrame(results, columns=results_columns)
 
 
+def resources_annotated_with_term_groups(db_cursor, term_groups, include_subclasses=True, direct_subclasses_only=False,
+                                         as_dict=False, use_term_studies=False):
+    """
+    Retrieve the resources annotated with each of the given groups of search terms, as resources_annotated_with_terms
+    does for each group, in a single pass over the database. The resources annotated with each distinct search term
+    (and its subclasses) are looked up once, however many groups the term is in, and then combined per group
+
+    :param db_cursor:  cursor for database connection
+    :param term_groups:  dictionary of query keys to the ontology terms to search on (or to a single ontology term)
+    :param include_subclasses:  include resources annotated with subclasses of the given search terms,
+        otherwise only resources explicitly annotated with those terms are returned
+    :param direct_subclasses_only:  include only the direct subclasses of the given search terms,
+        otherwise all the resources annotated with inferred subclasses of the given terms are returned
+    :param as_dict:  return a dictionary of query keys to arrays of the IDs of the resources found for each group,
+        otherwise a data frame of the resources found for each group is returned
+    :param use_term_studies:  read the resources of each search term from the efo_term_studies table (see
+        resources_annotated_with_terms), in searches with all subclasses
+    :return: data frame with a QueryKey column followed by the columns returned by resources_annotated_with_terms, or
+        a dictionary of query keys to arrays of resource IDs (empty for groups with no resources found)
+
+    For example, resources_annotated_with_term_groups(cursor, {"pancreas": ['EFO:0009605'],
+    "pancreas or infectious": ['EFO:0009605', 'EFO:0005741']}) looks up the resources annotated with (subclasses of)
+    EFO:0009605 only once, and returns them tagged with both query keys.
+    """
+    query_keys = list(term_groups.keys())
+    groups_df = pd.DataFrame([(index, term) for index, terms in enumerate(term_groups.values())
+                              for term in ([terms] if isinstance(terms, str) else terms)],
+                             columns=["QueryIndex", "Term"]).drop_duplicates()
+    search_terms = groups_df["Term"].unique().tolist()
+
+    query = TERM_RESOURCES_QUERIES[_get_ontology_table(include_subclasses, direct_subclasses_only, use_term_studies)]
+    term_resources = db_cursor.execute(query, {"search_terms": json.dumps(search_terms)}).fetchall()
+    term_resources_df = pd.DataFrame(term_resources, columns=["Term", RESOURCE_COLUMNS[0]])
+    group_resources_df = groups_df.merge(term_resources_df, on="Term")[["QueryIndex", RESOURCE_COLUMNS[0]]]
+    group_resources_df = group_resources_df.drop_duplicates().sort_values("QueryIndex", kind="stable")
+
+    if as_dict:
+        resource_ids = group_resources_df[RESOURCE_COLUMNS[0]].to_numpy()
+        boundaries = np.searchsorted(group_resources_df["QueryIndex"].to_numpy(), np.arange(len(query_keys) + 1))
+        return {key: resource_ids[boundaries[index]:boundaries[index + 1]] for index, key in enumerate(query_keys)}
+
+    resource_ids = json.dumps(group_resources_df[RESOURCE_COLUMNS[0]].unique().tolist())
+    resources = db_cursor.execute(RESOURCES_BY_ID_QUERY, {"resource_ids": resource_ids}).fetchall()
+    resources_df = pd.DataFrame(resources, columns=[x[0] for x in db_cursor.description])
+    results_df = group_resources_df.merge(resources_df, on=RESOURCE_COLUMNS[0])
+    results_df.insert(0, "QueryKey", pd.Series(query_keys, dtype=object).to_numpy()[results_df.pop("QueryIndex")])
+    return results_df
+
+
+def resources_matching_text(db_cursor, search_text, include_subclasses=True, direct_subclasses_only=False,
+                            max_terms=None):
+    """
+    Retrieve resources annotated with the ontology terms whose labels or synonyms contain the given text, and
+    (optionally) with subclasses of those terms, in a single query over the full-text search tables of the database.
+    The matched terms are ranked by how well their labels or synonyms match the text (BM25), and the resources by the
+    best-ranked term they were found through
+
+    :param db_cursor:  cursor for database connection
+    :param search_text:  the text to search for (of at least 3 characters), which is matched anywhere in the labels
+        and synonyms, ignoring case, as by LIKE '%search_text%'
+    :param include_subclasses:  include resources annotated with subclasses of the matched terms,
+        otherwise only resources explicitly annotated with those terms are returned
+    :param direct_subclasses_only:  include only the direct subclasses of the matched terms,
+        otherwise all the resources annotated with inferred subclasses of the terms are returned
+    :param max_terms:  maximum number of (best-ranked) matched terms to search on, or None to search on all of them
+    :return: data frame containing IDs and traits of the GWAS Catalog records found, with the matched term they were
+        found through (MatchedTerm and MatchedTermLabel) and its match score (higher is better), best matches first
+
+    For example, resources_matching_text(cursor, 'pancrea') returns the records annotated with (subclasses of) terms
+    such as pancreas disease (EFO:0009605) and pancreatitis (EFO:0000278).
+    """
+    query = TEXT_SEARCH_QUERIES[_get_ontology_table(include_subclasses, direct_subclasses_only)]
+    results = db_cursor.execute(query, {"search_text": _get_match_expression(search_text),
+                                        "max_terms": -1 if max_terms is None else max_terms}).fetchall()
+    return pd.DataFrame(results, columns=[x[0] for x in db_cursor.description])
+
+
+def search_text_table(db_cursor, table_name, search_text, limit=None):
+    """
+    Find the rows of a table whose text (indexed in its full-text search table) matches the given text: the labels
+    (efo_labels) and synonyms (efo_synonyms) of ontology terms and the traits of studies (gwascatalog_metadata) that
+    contain the text, ignoring case, or the abstracts (gwascatalog_references) that contain its words, in any of their
+    inflected forms (e.g., 'diseases' for 'disease')
+
+    :param db_cursor:  cursor for database connection
+    :param table_name:  name of the table searched, one of efo_labels, efo_synonyms, gwascatalog_metadata or
+        gwascatalog_references
+    :param search_text:  the text to search for (of at least 3 characters for the tables other than the references)
+    :param limit:  maximum number of rows returned, or None to return all the matching rows
+    :return: data frame of the key of each matching row (the term CURIE, STUDY.ACCESSION or PUBMEDID), its text and
+        its match score (BM25, higher is better), best matches first
+    """
+    search_table = TEXT_SEARCH_TABLES[table_name]
+    query = f"SELECT Key, Text, -bm25(`{search_table}`) AS Score FROM `{search_table}` " \
+            f"WHERE `{search_table}` MATCH :search_text ORDER BY bm25(`{search_table}`) LIMIT :limit"
+    results = db_cursor.execute(query, {"search_text": _get_match_expression(search_text),
+                                        "limit": -1 if limit is None else limit}).fetchall()
+    return pd.DataFrame(results, columns=["Key", "Text", "Score"])
+
+
+def load_parquet_table(parquet_folder, table_name, columns=None, filters=None, as_arrow=False):
+    """
+    Load a table of the search database from its Parquet file, exported by the build to a folder next to the database
+    (e.g., gwascatalog_search_parquet). The file is memory-mapped, and only the given columns, and the row groups that
+    can hold rows that meet the given filters, are read. The rows of the tables are sorted by Subject (ontology tables)
+    or STUDY.ACCESSION (GWAS Catalog tables), so filters on those columns skip most row groups. Requires pyarrow
+
+    :param parquet_folder:  folder of the Parquet files of the database tables
+    :param table_name:  name of the table, e.g., 'efo_labels'
+    :param columns:  names of the columns to load, or None to load all the columns
+    :param filters:  filters on the rows to load, in the format of pyarrow.parquet.read_table,
+        e.g., [('Subject', 'in', ['EFO:0009605', 'EFO:0005741'])], or None to load all the rows
+    :param as_arrow:  return the Arrow table, whose columns are backed by the memory-mapped file, rather than a
+        data frame
+    :return: data frame (or Arrow table) of the table
+    """
+    if pq is None:
+        raise ImportError("Loading the Parquet files of the database tables requires pyarrow (pip install pyarrow)")
+    table = pq.read_table(os.path.join(parquet_folder, table_name + ".parquet"), columns=columns, filters=filters,
+                          memory_map=True)
+    return table if as_arrow else table.to_pandas()
+
+
+# Get the ontology table consulted for subclasses of the search terms, or None if subclasses are not included
+def _get_ontology_table(include_subclasses, direct_subclasses_only, use_term_studies=False):
+    if not include_subclasses:
+        return None
+    if direct_subclasses_only:
+        return "efo_edges"
+    return "efo_term_studies" if use_term_studies else "efo_entailed_edges"
+
+
+# Get the full-text query that matches the given text as a phrase (i.e., its tokens in sequence), so that characters of
+#  the FTS5 query syntax in the text are matched as is
+def _get_match_expression(search_text):
+    return '"' + search_text.replace('"', '""') + '"'
+
+
 if __name__ == '__main__':
-    tar_file_path = os.path.join("..", "gwascatalog_search.db.tar.xz")
-    database_file_name = "gwascatalog_search.db"
+    from database_archive import extract_database_archive
 
-    with tarfile.open(tar_file_path, "r:xz") as tar:
-        tar.extract(database_file_name, path="..")
+    # Extract the database, unless the extracted database is up to date
+    database_file = extract_database_archive(os.path.join("..", "gwascatalog_search.db.tar.xz"))
 
-    connection = sqlite3.connect(os.path.join("..", database_file_name))
+    connection = open_database(database_file)
     cursor = connection.cursor()
 
     # Search for GWASCatalog studies mapped to either EFO:0009605 (pancreas disease) or EFO:0005741 (infectious disease)
@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import tempfile
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+import build_gwascatalog_db
+from build_gwascatalog_db import get_text2term_mappings_table, OUTPUT_DB_STUDY_ID_COLUMN, OUTPUT_DB_TRAIT_COLUMN, \
+    MAPPED_TRAIT_COLUMN, MAPPED_TRAIT_IRI_COLUMN, MAPPED_TRAIT_CURIE_COLUMN
+from generate_ontology_tables import get_curie_id_for_term
+
+### Benchmarks ###
+#
+# Compare the time taken to build the table of GWAS Catalog ontology mappings from the studies table by the vectorized
+#  get_text2term_mappings_table and by the previous row-by-row implementation below, and check that both tables are
+#  identical, except for the mapped trait labels that are now split in step with the IRIs
+#
+# Run from the repository root, optionally giving the path to the studies table saved by the build:
+#   python test/benchmark_mappings_table.py [resources/gwascatalog_metadata.tsv]
+
+STUDIES_FILE = os.path.join("resources", "gwascatalog_metadata.tsv")
+
+
+def get_text2term_mappings_table_by_row(metadata_df):
+    mappings_list = []
+    for _, row in metadata_df.iterrows():
+        mapped_trait_uri = row[MAPPED_TRAIT_IRI_COLUMN]
+        if mapped_trait_uri != "" and not pd.isna(mapped_trait_uri):
+            for iri in mapped_trait_uri.split(','):
+                iri = iri.strip()
+                mappings_list.append({OUTPUT_DB_STUDY_ID_COLUMN: row[OUTPUT_DB_STUDY_ID_COLUMN],
+                                      OUTPUT_DB_TRAIT_COLUMN: row[OUTPUT_DB_TRAIT_COLUMN],
+                                      MAPPED_TRAIT_COLUMN: row[MAPPED_TRAIT_COLUMN],
+                                      MAPPED_TRAIT_IRI_COLUMN: iri,
+                                      MAPPED_TRAIT_CURIE_COLUMN: get_curie_id_for_term(iri),
+                                      "Tags": "None",
+                                      "Source": "GWASCatalog"})
+    return pd.DataFrame(mappings_list)
+
+
+def benchmark_mappings_table(studies_df):
+    print(f"Building the mappings table of {len(studies_df)} studies")
+    start = time.time()
+    by_row_df = get_text2term_mappings_table_by_row(studies_df)
+    by_row_time = time.time() - start
+    print(f"...row by row: {by_row_time:.2f} seconds")
+
+    start = time.time()
+    mappings_df = get_text2term_mappings_table(studies_df)
+    vectorized_time = time.time() - start
+    print(f"...vectorized: {vectorized_time:.2f} seconds ({by_row_time / max(vectorized_time, 1e-6):.1f}x faster)")
+
+    is_split_label = mappings_df[MAPPED_TRAIT_COLUMN].fillna("") != by_row_df[MAPPED_TRAIT_COLUMN].fillna("")
+    print(f"...{is_split_label.sum()} of {len(mappings_df)} "
+          f"mappings now have the label of their own IRI rather than the labels of all the mapped traits")
+    pd.testing.assert_frame_equal(mappings_df.drop(columns=[MAPPED_TRAIT_COLUMN]),
+                                  by_row_df.drop(columns=[MAPPED_TRAIT_COLUMN]))
+    split_labels = by_row_df.loc[is_split_label, MAPPED_TRAIT_COLUMN].str.split(",")
+    assert all(label in [part.strip() for part in parts]
+               for label, parts in zip(mappings_df.loc[is_split_label, MAPPED_TRAIT_COLUMN], split_labels))
+
+
+def main():
+    studies_df = pd.read_csv(sys.argv[1] if len(sys.argv) > 1 else STUDIES_FILE, sep="\t", low_memory=False)
+    with tempfile.TemporaryDirectory() as resources_folder:  # where the mappings table is saved
+        build_gwascatalog_db.RESOURCES_FOLDER = resources_folder
+        benchmark_mappings_table(studies_df)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+import os
+import sys
+import time
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from src.query_database import open_database, resources_annotated_with_terms, resources_annotated_with_term_groups, \
+    load_parquet_table, resources_matching_text, search_text_table
+from src.ontology_index import OntologyIndex
+
+### Benchmarks ###
+#
+# Compare the time taken to search for the resources annotated with (entailed subclasses of) each EFO term that has
+#  inherited mappings, by calling resources_annotated_with_terms once per term, and by a single call to
+#  resources_annotated_with_term_groups, and check that both return the same resources for every term
+#
+# Compare the latency of searches for the resources annotated with (entailed subclasses of) each EFO term that has
+#  inherited mappings, by joining the mappings with the entailed edges and by reading them from the precomputed
+#  efo_term_studies table, one term at a time and in a single batch, and check that both return the same resources for
+#  every term
+#
+# Measure the time taken to load the in-memory OntologyIndex, and the latency of its hierarchy lookups compared to
+#  the equivalent lookups in the database, and of searches with and without it
+#
+# Compare the time taken to find the rows of each table whose text contains a search text by a LIKE '%text%' scan and
+#  by a query on its full-text search table, and to search for resources from free text by looking up the matching
+#  terms with LIKE and then searching for them, and by a single call to resources_matching_text, and check that both
+#  find the same rows and resources
+#
+# Compare the time taken to load each table of the database from its Parquet file (if the tables were exported), from
+#  the database, and from its TSV file in the resources folder (if there is one)
+#
+# Run from the repository root, optionally giving the path to the database:
+#   python test/benchmark_queries.py [gwascatalog_search.db]
+
+DATABASE_FILE = "gwascatalog_search.db"
+RESOURCES_FOLDER = "resources"
+
+
+def benchmark_batch_search(cursor):
+    terms = [row[0] for row in cursor.execute("SELECT Subject FROM efo_labels WHERE Inherited > 0").fetchall()]
+    print(f"Searching for resources annotated with each of {len(terms)} terms with inherited mappings")
+
+    start = time.time()
+    per_call_results = {term: resources_annotated_with_terms(cursor, [term], True, False) for term in terms}
+    per_call_time = time.time() - start
+    print(f"...per-call loop: {per_call_time:.2f} seconds ({per_call_time / max(len(terms), 1) * 1000:.2f} ms/term)")
+
+    start = time.time()
+    batch_df = resources_annotated_with_term_groups(cursor, {term: term for term in terms}, True, False)
+    batch_time = time.time() - start
+    print(f"...batch (data frame): {batch_time:.2f} seconds ({per_call_time / max(batch_time, 1e-6):.1f}x faster)")
+
+    start = time.time()
+    batch_dict = resources_annotated_with_term_groups(cursor, {term: term for term in terms}, True, False, as_dict=True)
+    batch_dict_time = time.time() - start
+    print(f"...batch (dictionary): {batch_dict_time:.2f} seconds "
+          f"({per_call_time / max(batch_dict_time, 1e-6):.1f}x faster)")
+
+    batch_counts = batch_df["QueryKey"].value_counts()
+    for term, results in per_call_results.items():
+        assert batch_counts.get(term, 0) == len(results), f"Batch search results differ for {term}"
+        assert set(batch_dict[term]) == set(results["STUDY.ACCESSION"]), f"Batch search results differ for {term}"
+
+    ############################ Benchmarks End ##############################
+
+
+def benchmark_term_studies(cursor):
+    terms = [row[0] for row in cursor.execute("SELECT Subject FROM efo_labels WHERE Inherited > 0").fetchall()]
+    print(f"Searching for resources annotated with each of {len(terms)} terms with inherited mappings")
+    search_results = {}
+    for search_name, use_term_studies in (("entailed edges join", False), ("efo_term_studies", True)):
+        start = time.time()
+        search_results[use_term_studies] = [resources_annotated_with_terms(cursor, [term], True, False,
+                                                                           use_term_studies=use_term_studies)
+                                            for term in terms]
+        print(f"...search with {search_name}: {(time.time() - start) / max(len(terms), 1) * 1000:.2f} ms/term")
+    batch_results = {}
+    for search_name, use_term_studies in (("entailed edges join", False), ("efo_term_studies", True)):
+        start = time.time()
+        batch_results[use_term_studies] = resources_annotated_with_term_groups(
+            cursor, {term: term for term in terms}, True, False, as_dict=True, use_term_studies=use_term_studies)
+        print(f"...batch search (dictionary) with {search_name}: {time.time() - start:.2f} seconds")
+    for term, join_df, term_studies_df in zip(terms, search_results[False], search_results[True]):
+        assert set(join_df["STUDY.ACCESSION"]) == set(term_studies_df["STUDY.ACCESSION"]), \
+            f"efo_term_studies search results differ for {term}"
+        assert set(batch_results[False][term]) == set(batch_results[True][term]), \
+            f"efo_term_studies batch search results differ for {term}"
+
+
+def benchmark_ontology_index(connection, cursor):
+    start = time.time()
+    ontology_index = OntologyIndex.from_database(connection)
+    print(f"Loaded ontology index of {len(ontology_index)} terms in {time.time() - start:.2f} seconds")
+    terms = [row[0] for row in cursor.execute("SELECT Subject FROM efo_labels").fetchall()]
+    lookups = {
+        "ancestors": (ontology_index.ancestors,
+                      "SELECT Object FROM efo_entailed_edges WHERE Subject = ? AND Object != Subject"),
+        "descendants": (ontology_index.descendants,
+                        "SELECT Subject FROM efo_entailed_edges WHERE Object = ? AND Object != Subject"),
+        "children": (ontology_index.children, "SELECT Subject FROM efo_edges WHERE Object = ?")
+    }
+    for lookup_name, (lookup, query) in lookups.items():
+        start = time.time()
+        index_results = [lookup(term) for term in terms]
+        index_time = time.time() - start
+        start = time.time()
+        db_results = [cursor.execute(query, (term,)).fetchall() for term in terms]
+        db_time = time.time() - start
+        print(f"...{lookup_name}: {index_time / max(len(terms), 1) * 1e6:.1f} us/lookup in memory, "
+              f"{db_time / max(len(terms), 1) * 1e6:.1f} us/lookup in the database")
+        for index_result, db_result in zip(index_results, db_results):
+            assert sorted(index_result) == sorted(row[0] for row in db_result), f"{lookup_name} lookups differ"
+
+    term_pairs = list(zip(terms, reversed(terms)))
+    start = time.time()
+    for term, other_term in term_pairs:
+        ontology_index.lowest_common_ancestors(term, other_term)
+    print(f"...lowest_common_ancestors: {(time.time() - start) / max(len(term_pairs), 1) * 1e6:.1f} us/lookup")
+
+    for search_name, ontology_index_argument in (("database", None), ("in-memory", ontology_index)):
+        start = time.time()
+        for term in terms:
+            resources_annotated_with_terms(cursor, [term], True, False, ontology_index=ontology_index_argument)
+        print(f"...search with {search_name} expansion of subclasses: "
+              f"{(time.time() - start) / max(len(terms), 1) * 1000:.2f} ms/term")
+
+
+def benchmark_text_search(cursor, search_texts_count=50):
+    # Search texts: the first word (of at least 4 letters) of a sample of term labels, e.g. 'diabetes' or 'pancreatic'
+    search_texts = [row[0] for row in cursor.execute(
+        "SELECT DISTINCT lower(rtrim(substr(Object, 1, instr(Object || ' ', ' ')), ' ')) AS Word FROM efo_labels "
+        "WHERE length(Word) >= 4 AND Word GLOB '[a-z]*' ORDER BY Subject LIMIT ?", (search_texts_count,)).fetchall()]
+    print(f"Searching for {len(search_texts)} texts")
+    tables = {"efo_labels": ("Subject", "Object"), "efo_synonyms": ("Subject", "Object"),
+              "gwascatalog_metadata": ("`STUDY.ACCESSION`", "`DISEASE.TRAIT`"),
+              "gwascatalog_references": ("PUBMEDID", "Abstract")}
+    for table_name, (key_column, text_column) in tables.items():
+        start = time.time()
+        like_results = [cursor.execute(f"SELECT {key_column} FROM `{table_name}` WHERE {text_column} LIKE ?",
+                                       (f"%{search_text}%",)).fetchall() for search_text in search_texts]
+        like_time = time.time() - start
+        start = time.time()
+        search_results = [search_text_table(cursor, table_name, search_text) for search_text in search_texts]
+        search_time = time.time() - start
+        print(f"...{table_name}: {like_time / max(len(search_texts), 1) * 1000:.2f} ms/search with LIKE, "
+              f"{search_time / max(len(search_texts), 1) * 1000:.2f} ms/search with full-text search "
+              f"({like_time / max(search_time, 1e-6):.1f}x faster)")
+        # The abstracts are searched by word (stem) rather than by substring, so only their timings are compared
+        if table_name != "gwascatalog_references":
+            for search_text, like_result, search_df in zip(search_texts, like_results, search_results):
+                assert set(str(row[0]) for row in like_result) == set(search_df["Key"].astype(str)), \
+                    f"Full-text search results differ for '{search_text}' in {table_name}"
+
+    start = time.time()
+    like_results = {}
+    for search_text in search_texts:
+        terms = [row[0] for row in cursor.execute(
+            "SELECT Subject FROM efo_labels WHERE Object LIKE :text UNION "
+            "SELECT Subject FROM efo_synonyms WHERE Object LIKE :text", {"text": f"%{search_text}%"}).fetchall()]
+        like_results[search_text] = resources_annotated_with_terms(cursor, terms, True, False)
+    like_time = time.time() - start
+    print(f"...resources by terms matched with LIKE: {like_time / max(len(search_texts), 1) * 1000:.2f} ms/search")
+    start = time.time()
+    search_results = {search_text: resources_matching_text(cursor, search_text) for search_text in search_texts}
+    search_time = time.time() - start
+    print(f"...resources_matching_text: {search_time / max(len(search_texts), 1) * 1000:.2f} ms/search "
+          f"({like_time / max(search_time, 1e-6):.1f}x faster)")
+    for search_text, like_df in like_results.items():
+        assert set(like_df["STUDY.ACCESSION"]) == set(search_results[search_text]["STUDY.ACCESSION"]), \
+            f"Resources found for '{search_text}' differ"
+
+
+def benchmark_table_loading(connection, parquet_folder):
+    if not os.path.isdir(parquet_folder):
+        print(f"No Parquet files of the database tables in {parquet_folder}—skipping the table loading benchmark")
+        return
+    print("Time taken to load each table (seconds)")
+    print(f"{'Table':<28}{'Rows':>10}{'Parquet':>10}{'SQLite':>10}{'TSV':>10}")
+    for file_name in sorted(os.listdir(parquet_folder)):
+        table_name = file_name[:-len(".parquet")]
+        start = time.time()
+        parquet_df = load_parquet_table(parquet_folder, table_name)
+        parquet_time = time.time() - start
+        start = time.time()
+        sqlite_df = pd.read_sql(f"SELECT * FROM `{table_name}`", connection)
+        sqlite_time = time.time() - start
+        tsv_file = os.path.join(RESOURCES_FOLDER, table_name + ".tsv")
+        tsv_time = float("nan")
+        if os.path.isfile(tsv_file):
+            start = time.time()
+            pd.read_csv(tsv_file, sep="\t", low_memory=False)
+            tsv_time = time.time() - start
+        assert len(parquet_df) == len(sqlite_df), f"The Parquet file of {table_name} has a different number of rows"
+        print(f"{table_name:<28}{len(parquet_df):>10}{parquet_time:>10.3f}{sqlite_time:>10.3f}{tsv_time:>10.3f}")
+
+
+def main():
+    database_file = sys.argv[1] if len(sys.argv) > 1 else DATABASE_FILE
+    connection = open_database(database_file)
+    cursor = connection.cursor()
+    benchmark_batch_search(cursor)
+    benchmark_term_studies(cursor)
+    benchmark_ontology_index(connection, cursor)
+    benchmark_text_search(cursor)
+    benchmark_table_loading(connection, os.path.splitext(database_file)[0] + "_parquet")
+    cursor.close()
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import os
+import sys
+import gzip
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from download_cache import download_file, decompress_gzip_file
+
+### Tests ###
+#
+# A gzip file is served twice by a local HTTP server that gives its ETag and/or Last-Modified validators and answers
+#  conditional requests for an unchanged file with 304 Not Modified, to check:
+# 1) that the second run sends a conditional request, and skips both the download and the decompression of the file
+# 2) that the same holds for a server that only gives a Last-Modified date
+# 3) that a file whose content changed is downloaded and decompressed again
+
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+class FileServer(BaseHTTPRequestHandler):
+    content = b""
+    etag = None  # if None, the server gives no ETag
+    sent_statuses = []  # the status of each response sent
+
+    def do_GET(self):
+        if (self.etag is not None and self.headers.get("If-None-Match") == self.etag) or \
+                (self.etag is None and self.headers.get("If-Modified-Since") == LAST_MODIFIED):
+            self.sent_statuses.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.sent_statuses.append(200)
+        self.send_response(200)
+        if self.etag is not None:
+            self.send_header("ETag", self.etag)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.send_header("Content-Length", str(len(self.content)))
+        self.end_headers()
+        self.wfile.write(self.content)
+
+    def log_message(self, *arguments):
+        pass
+
+
+@pytest.fixture
+def file_url():
+    FileServer.content, FileServer.etag, FileServer.sent_statuses = gzip.compress(b"version 1\n"), '"v1"', []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FileServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/table.tsv.gz"
+    server.shutdown()
+    server.server_close()
+
+
+def download_and_decompress(url, folder):
+    gz_file, output_file = os.path.join(folder, "table.tsv.gz"), os.path.join(folder, "table.tsv")
+    manifest_file = os.path.join(folder, "download_manifest.json")
+    downloaded = download_file(url, gz_file, manifest_file=manifest_file)
+    decompressed = decompress_gzip_file(gz_file, output_file, manifest_file=manifest_file)
+    return downloaded, decompressed, output_file
+
+
+def test_second_run_skips_download_and_decompression(file_url, tmp_path):
+    downloaded, decompressed, output_file = download_and_decompress(file_url, tmp_path)
+    assert (downloaded, decompressed) == (True, True)
+    modified_time = os.stat(output_file).st_mtime_ns
+    assert download_and_decompress(file_url, tmp_path)[:2] == (False, False)
+    assert FileServer.sent_statuses == [200, 304]
+    assert os.stat(output_file).st_mtime_ns == modified_time
+    with open(output_file, "rb") as file_in:
+        assert file_in.read() == b"version 1\n"
+
+
+def test_revalidates_with_last_modified_date(file_url, tmp_path):
+    FileServer.etag = None
+    assert download_and_decompress(file_url, tmp_path)[:2] == (True, True)
+    assert download_and_decompress(file_url, tmp_path)[:2] == (False, False)
+    assert FileServer.sent_statuses == [200, 304]
+
+
+def test_changed_file_is_downloaded_and_decompressed_again(file_url, tmp_path):
+    download_and_decompress(file_url, tmp_path)
+    FileServer.content, FileServer.etag = gzip.compress(b"version 2\n"), '"v2"'
+    downloaded, decompressed, output_file = download_and_decompress(file_url, tmp_path)
+    assert (downloaded, decompressed) == (True, True)
+    assert FileServer.sent_statuses == [200, 200]
+    with open(output_file, "rb") as file_in:
+        assert file_in.read() == b"version 2\n"
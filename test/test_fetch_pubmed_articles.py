@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+import sqlite3
+import functools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import build_database
+from fetch_pubmed_articles import fetch_pubmed_articles
+
+### Tests ###
+#
+# fetch_pubmed_articles is run against a local stand-in for the NCBI EFetch endpoint, which answers each request with
+#  the status codes queued for it (and with the articles of the requested PMIDs once the queue is empty), to check:
+# 1) that the PMIDs are fetched in batches of batch_size PMIDs per request
+# 2) that requests that are rate limited (429) or fail on the server (5xx) are retried, with a growing delay
+# 3) that a batch that is rejected (other 4xx) is split in halves until the rejected PMID is left out by itself
+# 4) that a RuntimeError is raised, rather than the batch being split, when the retries of a batch are exhausted
+# 5) that the other batches are still fetched and passed to the batch callback before that error is raised
+# 6) that get_pubmed_details caches those batches, so that once resumed it only fetches the batch that failed
+
+
+def article_xml(pmid):
+    return (f"<PubmedArticle><MedlineCitation><PMID>{pmid}</PMID><Article><Journal><Title>Journal {pmid}</Title>"
+            f"</Journal><ArticleTitle>Title {pmid}</ArticleTitle></Article></MedlineCitation></PubmedArticle>")
+
+
+class EFetchStandIn(BaseHTTPRequestHandler):
+    requests = []  # the PMIDs of each request received
+    request_times = []
+    queued_statuses = []  # the statuses of the next requests (then 200)
+    rejected_pmids = set()  # requests including any of these PMIDs are rejected with a 400 status
+    failing_pmids = set()  # requests including any of these PMIDs fail with a 503 status
+
+    def do_POST(self):
+        pmids = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())["id"][0].split(",")
+        self.requests.append(pmids)
+        self.request_times.append(time.monotonic())
+        status = self.queued_statuses.pop(0) if len(self.queued_statuses) > 0 else 200
+        if status == 200 and self.rejected_pmids.intersection(pmids):
+            status = 400
+        if status == 200 and self.failing_pmids.intersection(pmids):
+            status = 503
+        self.send_response(status)
+        self.end_headers()
+        if status == 200:
+            xml = "<PubmedArticleSet>" + "".join(article_xml(pmid) for pmid in pmids) + "</PubmedArticleSet>"
+            self.wfile.write(xml.encode())
+
+    def log_message(self, *arguments):
+        pass
+
+
+@pytest.fixture
+def efetch_url():
+    EFetchStandIn.requests, EFetchStandIn.request_times = [], []
+    EFetchStandIn.queued_statuses, EFetchStandIn.rejected_pmids, EFetchStandIn.failing_pmids = [], set(), set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EFetchStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/efetch.fcgi"
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(pmids, efetch_url, backoff_seconds=0.01, **arguments):
+    return fetch_pubmed_articles(pmids, efetch_url=efetch_url, api_key="key", backoff_seconds=backoff_seconds,
+                                 show_progress=False, **arguments)
+
+
+def test_batches(efetch_url):
+    pmids = [str(pmid) for pmid in range(1000, 1025)]
+    articles = fetch(pmids, efetch_url, batch_size=10)
+    assert sorted(articles) == pmids
+    assert articles["1003"].title == "Title 1003"
+    assert sorted(len(batch) for batch in EFetchStandIn.requests) == [5, 10, 10]
+
+
+def test_retries_rate_limited_and_server_errors(efetch_url):
+    EFetchStandIn.queued_statuses = [429, 503, 500]
+    articles = fetch(["1", "2", "3"], efetch_url, backoff_seconds=0.2)
+    assert sorted(articles) == ["1", "2", "3"]
+    assert EFetchStandIn.requests == [["1", "2", "3"]] * 4  # the whole batch is retried, not split
+    times = EFetchStandIn.request_times
+    delays = [next_time - request_time for request_time, next_time in zip(times, times[1:])]
+    assert all(delay >= 0.2 * 2 ** attempt for attempt, delay in enumerate(delays))  # backing off exponentially
+
+
+def test_splits_rejected_batch(efetch_url):
+    EFetchStandIn.rejected_pmids = {"bad"}
+    pmids = ["1", "2", "3", "bad", "5", "6", "7", "8"]
+    articles = fetch(pmids, efetch_url)
+    assert sorted(articles) == ["1", "2", "3", "5", "6", "7", "8"]
+    assert EFetchStandIn.requests[0] == pmids
+    assert ["bad"] in EFetchStandIn.requests
+    assert len(EFetchStandIn.requests) == 7  # the batch, then 2 halves, 2 quarters and 2 eighths of the rejected half
+
+
+def test_fails_when_retries_are_exhausted(efetch_url):
+    EFetchStandIn.queued_statuses = [503] * 3
+    with pytest.raises(RuntimeError):
+        fetch(["1", "2", "3", "4"], efetch_url, max_retries=2)
+    assert EFetchStandIn.requests == [["1", "2", "3", "4"]] * 3
+
+
+def test_passes_on_other_batches_before_failing(efetch_url):
+    EFetchStandIn.failing_pmids = {"3"}
+    batches = []
+    with pytest.raises(RuntimeError):
+        fetch([str(pmid) for pmid in range(1, 9)], efetch_url, batch_size=2, max_retries=1,
+              batch_callback=lambda articles: batches.append(sorted(articles)))
+    assert sorted(batches) == [["1", "2"], ["5", "6"], ["7", "8"]]
+
+
+def test_resumed_references_only_fetch_failed_batch(efetch_url, tmp_path, monkeypatch):
+    (tmp_path / "work").mkdir()
+    (tmp_path / "resources").mkdir()
+    monkeypatch.chdir(tmp_path / "work")  # the resources folder is ../resources
+    monkeypatch.setattr(build_database, "fetch_pubmed_articles", functools.partial(
+        fetch_pubmed_articles, batch_size=2, max_retries=1, backoff_seconds=0.01, show_progress=False))
+    metadata_df = pd.DataFrame({"PUBMEDID": range(1, 9)})
+    EFetchStandIn.failing_pmids = {"3"}
+    with pytest.raises(RuntimeError):
+        build_database.get_pubmed_details(metadata_df, "test", "PUBMEDID", efetch_url=efetch_url)
+    connection = sqlite3.connect(tmp_path / "resources" / "test_references_cache.db")
+    cached_pmids = sorted(row[0] for row in connection.execute("SELECT PMID FROM references_cache"))
+    connection.close()
+    assert cached_pmids == ["1", "2", "5", "6", "7", "8"]
+
+    EFetchStandIn.failing_pmids, EFetchStandIn.requests = set(), []
+    references_df = build_database.get_pubmed_details(metadata_df, "test", "PUBMEDID", efetch_url=efetch_url)
+    assert EFetchStandIn.requests == [["3", "4"]]
+    assert references_df["PUBMEDID"].tolist() == list(range(1, 9))
+    assert references_df["Title"].tolist() == [f"Title {pmid}" for pmid in range(1, 9)]
@@ -0,0 +1,130 @@
+import os
+import sys
+import sqlite3
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from build_gwascatalog_db import get_gwascatalog_associations_table, _process_associations_chunks, \
+    ASSOCIATIONS_TABLE_COLUMNS, MAPPED_TRAIT_CURIE_COLUMN, MAPPED_TRAIT_IRI_COLUMN
+from build_database import import_df_chunks_to_db, import_df_to_db, connect_to_database
+
+### Tests ###
+#
+# The GWAS Catalog associations table is served by a local stand-in for the GWAS Catalog download URL, and streamed
+#  into a database (and the resources folder, relative to the working directory) in chunks of a few rows, to check:
+# 1) that every row is imported, reduced to the columns of the output table and with the CURIEs of the mapped traits
+# 2) that a table without rows (or without any chunk) is still created with the columns of the output table
+# 3) that a table that fails to parse partway leaves no temporary file behind, and both the saved table and the table
+#     in the database as they were (also when the database is configured for bulk loading)
+
+OUTPUT_COLUMNS = list(ASSOCIATIONS_TABLE_COLUMNS) + [MAPPED_TRAIT_CURIE_COLUMN]
+
+
+def associations_tsv(row_count, p_value="1e-8"):
+    input_columns = ["DATE ADDED TO CATALOG", "STUDY ACCESSION"] + list(ASSOCIATIONS_TABLE_COLUMNS)[1:]
+    rows = []
+    for row in range(row_count):
+        values = {column: f"{column.lower()} {row}" for column in input_columns}
+        values.update({"STUDY ACCESSION": f"GCST{row:06d}", "UPSTREAM_GENE_DISTANCE": "1000",
+                       "DOWNSTREAM_GENE_DISTANCE": "", "P-VALUE": p_value if row == row_count - 1 else "1e-8",
+                       "PVALUE_MLOG": "8", MAPPED_TRAIT_IRI_COLUMN: f"http://www.ebi.ac.uk/efo/EFO_{row:07d}"})
+        rows.append("\t".join(values[column] for column in input_columns))
+    return "\n".join(["\t".join(input_columns)] + rows) + "\n"
+
+
+class DownloadStandIn(BaseHTTPRequestHandler):
+    content = b""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.content)))
+        self.end_headers()
+        self.wfile.write(self.content)
+
+    def log_message(self, *arguments):
+        pass
+
+
+@pytest.fixture
+def table_url(tmp_path, monkeypatch):
+    (tmp_path / "work").mkdir()
+    (tmp_path / "resources").mkdir()
+    monkeypatch.chdir(tmp_path / "work")  # the resources folder is ../resources
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DownloadStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/alternative"
+    server.shutdown()
+    server.server_close()
+
+
+def stream_table(table_url, tmp_path):
+    connection = sqlite3.connect(tmp_path / "test.db")
+    try:
+        mapped_trait_iris = get_gwascatalog_associations_table(connection, download_newest=True, table_url=table_url,
+                                                               chunk_size=2)
+        table_df = pd.read_sql_query("SELECT * FROM gwascatalog_associations", connection)
+    finally:
+        connection.close()
+    return mapped_trait_iris, table_df
+
+
+def test_streams_table_in_chunks(table_url, tmp_path):
+    DownloadStandIn.content = associations_tsv(5).encode()
+    mapped_trait_iris, table_df = stream_table(table_url, tmp_path)
+    assert list(table_df.columns) == OUTPUT_COLUMNS
+    assert table_df["STUDY.ACCESSION"].tolist() == [f"GCST{row:06d}" for row in range(5)]
+    assert table_df[MAPPED_TRAIT_CURIE_COLUMN].tolist() == [f"EFO:{row:07d}" for row in range(5)]
+    assert mapped_trait_iris[MAPPED_TRAIT_IRI_COLUMN].tolist() == table_df[MAPPED_TRAIT_IRI_COLUMN].tolist()
+    saved_df = pd.read_csv(tmp_path / "resources" / "gwascatalog_associations.tsv", sep="\t", dtype=str)
+    assert saved_df["STUDY.ACCESSION"].tolist() == table_df["STUDY.ACCESSION"].tolist()
+    assert not os.path.exists(tmp_path / "resources" / "gwascatalog_associations.tsv.tmp")
+
+
+def test_creates_table_without_rows(table_url, tmp_path):
+    DownloadStandIn.content = associations_tsv(0).encode()
+    mapped_trait_iris, table_df = stream_table(table_url, tmp_path)
+    assert list(table_df.columns) == OUTPUT_COLUMNS
+    assert len(table_df) == 0 and len(mapped_trait_iris) == 0
+
+
+def test_creates_table_without_chunks(tmp_path):
+    connection = sqlite3.connect(tmp_path / "test.db")
+    chunks = _process_associations_chunks(iter([]), str(tmp_path / "associations.tsv"), [])
+    assert import_df_chunks_to_db(connection, chunks, table_name="gwascatalog_associations") == 0
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(gwascatalog_associations)").fetchall()]
+    connection.close()
+    assert columns == OUTPUT_COLUMNS
+
+
+def test_failure_partway_removes_temporary_file(table_url, tmp_path):
+    output_file = tmp_path / "resources" / "gwascatalog_associations.tsv"
+    output_file.write_text("previous table\n")
+    connection = sqlite3.connect(tmp_path / "test.db")
+    previous_df = pd.DataFrame({"Table": ["previous"]})
+    import_df_to_db(connection, data_frame=previous_df, table_name="gwascatalog_associations")
+    connection.close()
+    DownloadStandIn.content = associations_tsv(5, p_value="not a number").encode()  # in the last chunk
+    with pytest.raises(ValueError):
+        stream_table(table_url, tmp_path)
+    assert not os.path.exists(str(output_file) + ".tmp")
+    assert output_file.read_text() == "previous table\n"
+    connection = sqlite3.connect(tmp_path / "test.db")
+    assert pd.read_sql_query("SELECT * FROM gwascatalog_associations", connection).equals(previous_df)
+    connection.close()
+
+
+def test_failure_partway_keeps_previous_table_when_bulk_loading(tmp_path):
+    def failing_chunks():
+        yield pd.DataFrame({"Row": [3, 4]})
+        raise ValueError("cannot parse the next chunk")
+
+    connection = connect_to_database(str(tmp_path / "test.db"))
+    import_df_chunks_to_db(connection, iter([pd.DataFrame({"Row": [1, 2]})]), table_name="rows")
+    with pytest.raises(ValueError):
+        import_df_chunks_to_db(connection, failing_chunks(), table_name="rows")
+    rows = connection.execute("SELECT * FROM rows").fetchall()
+    connection.close()
+    assert rows == [(1,), (2,)]
@@ -0,0 +1,104 @@
+import os
+import sys
+import sqlite3
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from ontology_index import OntologyIndex
+
+### Tests ###
+#
+# OntologyIndex is built from a toy class hierarchy with a term that has two parents (D, under B and C) and a cycle of
+#  equivalent terms (G and H, each a subclass of the other), with entailed edges that include each term itself, as the
+#  SemanticSQL tables do, to check:
+# 1) the direct (asserted) parents and children of a term
+# 2) the (entailed) ancestors and descendants of a term, which exclude the term itself unless asked to include it, and
+#     which include the terms equivalent to it
+# 3) the lowest common ancestors of terms, including both terms of the equivalence cycle when they are lowest
+# 4) the expansion of search terms into their direct or entailed subclasses, without repeated terms
+# 5) that unknown terms have no related terms, and that the index loads the same from a database
+
+#        A
+#      /   \
+#     B     C
+#   / | \  / \
+#  G==H  D    F
+#  |  |  |
+#  I  J  E
+EDGES = [("B", "A"), ("C", "A"), ("D", "B"), ("D", "C"), ("E", "D"), ("F", "C"), ("G", "B"), ("H", "B"), ("G", "H"),
+         ("H", "G"), ("I", "G"), ("J", "H")]
+
+
+def entailed_edges(edges):
+    terms = {term for edge in edges for term in edge}
+    closure = {(term, term) for term in terms} | set(edges)
+    while True:
+        new_edges = {(subclass, superclass) for subclass, middle in closure for other, superclass in closure
+                     if middle == other} - closure
+        if len(new_edges) == 0:
+            return sorted(closure)
+        closure |= new_edges
+
+
+@pytest.fixture
+def index():
+    return OntologyIndex(pd.DataFrame(EDGES, columns=["Subject", "Object"]),
+                         pd.DataFrame(entailed_edges(EDGES), columns=["Subject", "Object"]))
+
+
+def test_parents_and_children(index):
+    assert len(index) == 10 and "D" in index
+    assert sorted(index.parents("D")) == ["B", "C"]
+    assert sorted(index.parents("G")) == ["B", "H"]
+    assert sorted(index.children("B")) == ["D", "G", "H"]
+    assert sorted(index.children("C")) == ["D", "F"]
+    assert list(index.children("E")) == []
+
+
+def test_ancestors_and_descendants(index):
+    assert sorted(index.ancestors("E")) == ["A", "B", "C", "D"]
+    assert list(index.ancestors("E", include_self=True))[0] == "E"
+    assert sorted(index.ancestors("I")) == ["A", "B", "G", "H"]
+    assert sorted(index.descendants("C")) == ["D", "E", "F"]
+    assert sorted(index.descendants("G")) == ["H", "I", "J"]
+    assert sorted(index.descendants("H", include_self=True)) == ["G", "H", "I", "J"]
+    assert sorted(index.descendants("A")) == ["B", "C", "D", "E", "F", "G", "H", "I", "J"]
+
+
+def test_lowest_common_ancestors(index):
+    assert list(index.lowest_common_ancestors("E", "F")) == ["C"]
+    assert list(index.lowest_common_ancestors("E", "D")) == ["D"]  # a term is its own ancestor
+    assert list(index.lowest_common_ancestors("E", "I")) == ["B"]  # not A, which is above B
+    assert list(index.lowest_common_ancestors("F", "I")) == ["A"]
+    assert sorted(index.lowest_common_ancestors("I", "J")) == ["G", "H"]  # equivalent, so neither is lower
+    assert sorted(index.lowest_common_ancestors("G", "J")) == ["G", "H"]
+    assert list(index.lowest_common_ancestors("D")) == ["D"]
+    assert list(index.lowest_common_ancestors()) == []
+    assert list(index.lowest_common_ancestors("E", "unknown")) == []
+
+
+def test_expand_terms(index):
+    assert index.expand_terms(["C"], include_subclasses=False) == ["C"]
+    assert index.expand_terms(["C"], direct_subclasses_only=True)[0] == "C"
+    assert sorted(index.expand_terms(["C"], direct_subclasses_only=True)) == ["C", "D", "F"]
+    expanded_terms = index.expand_terms(["C", "D"])
+    assert expanded_terms[:2] == ["C", "D"]
+    assert sorted(expanded_terms) == ["C", "D", "E", "F"]  # E (a subclass of both) only once
+    assert sorted(index.expand_terms(["G"])) == ["G", "H", "I", "J"]
+    assert index.expand_terms([]) == []
+
+
+def test_unknown_terms_and_database(index):
+    assert "unknown" not in index
+    assert list(index.parents("unknown")) == [] and list(index.ancestors("unknown", include_self=True)) == []
+    assert index.expand_terms(["unknown"]) == ["unknown"]
+    connection = sqlite3.connect(":memory:")
+    pd.DataFrame(EDGES, columns=["Subject", "Object"]).to_sql("efo_edges", connection, index=False)
+    pd.DataFrame(entailed_edges(EDGES), columns=["Subject", "Object"]).to_sql("efo_entailed_edges", connection,
+                                                                              index=False)
+    database_index = OntologyIndex.from_database(connection)
+    connection.close()
+    for term in index.terms:
+        assert sorted(database_index.ancestors(term)) == sorted(index.ancestors(term))
+        assert sorted(database_index.children(term)) == sorted(index.children(term))
@@ -0,0 +1,152 @@
+import os
+import sys
+import sqlite3
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from build_database import import_df_to_db, create_term_resources_table, create_text_search_tables, \
+    _get_text_search_tables
+from query_database import open_database, resources_annotated_with_terms, resources_annotated_with_term_groups, \
+    resources_matching_text, search_text_table, RESOURCE_COLUMNS
+from ontology_index import OntologyIndex
+
+### Tests ###
+#
+# A search database of a toy ontology (with a term that has two parents, and a term no study is mapped to) and a few
+#  studies (one mapped to two terms, and one not mapped) is built with the build_database functions, to check:
+# 1) that batch searches for groups of terms, both as a data frame and as a dictionary, return the same studies as
+#     resources_annotated_with_terms for each group, with and without (direct or all) subclasses, including groups
+#     with no studies and terms shared between groups
+# 2) that searches that read the efo_term_studies table, or expand the terms with an OntologyIndex, return the same
+#     studies as those that join the mappings with the entailed edges
+# 3) that free-text searches return the studies of the terms whose labels or synonyms contain the text, each with the
+#     term it was found through, as resources_annotated_with_terms does for those terms
+# 4) that the full-text search tables find the rows whose text contains the search text (or, for the abstracts, its
+#     stemmed words)
+
+LABELS = {"EFO:1": "disease", "EFO:2": "pancreas disease", "EFO:3": "infectious disease", "EFO:4": "pancreatitis",
+          "EFO:5": "acute pancreatitis", "EFO:6": "liver disease", "EFO:7": "rare disorder"}
+SYNONYMS = [("EFO:3", "infection"), ("EFO:6", "hepatic disease")]
+PARENTS = {"EFO:2": ["EFO:1"], "EFO:3": ["EFO:1"], "EFO:4": ["EFO:2", "EFO:3"], "EFO:5": ["EFO:4"],
+           "EFO:6": ["EFO:1"], "EFO:7": ["EFO:1"]}
+MAPPINGS = [("GCST1", "EFO:4"), ("GCST2", "EFO:5"), ("GCST3", "EFO:2"), ("GCST3", "EFO:6"), ("GCST4", "EFO:1"),
+            ("GCST5", "EFO:3")]
+STUDIES = ["GCST1", "GCST2", "GCST3", "GCST4", "GCST5", "GCST6"]  # GCST6 is not mapped
+
+TERM_GROUPS = {"pancreas": ["EFO:2"], "pancreas or infectious": ["EFO:2", "EFO:3"], "pancreatitis": "EFO:4",
+               "rare": ["EFO:7"], "unknown": ["EFO:0"], "all": ["EFO:1", "EFO:2"]}
+SEARCH_MODES = [dict(include_subclasses=False), dict(include_subclasses=True, direct_subclasses_only=True),
+                dict(include_subclasses=True), dict(include_subclasses=True, use_term_studies=True)]
+
+
+def iri(curie):
+    return "http://www.ebi.ac.uk/efo/EFO_" + curie.split(":")[1]
+
+
+def ancestors(term):
+    return {term}.union(*[ancestors(parent) for parent in PARENTS.get(term, [])])
+
+
+@pytest.fixture(scope="module")
+def cursor(tmp_path_factory):
+    database_file = str(tmp_path_factory.mktemp("database") / "test_search.db")
+    connection = sqlite3.connect(database_file)
+    traits = {study: ", ".join(LABELS[term] for mapped_study, term in MAPPINGS if mapped_study == study) or "unmapped"
+              for study in STUDIES}
+    tables = {
+        "gwascatalog_metadata": pd.DataFrame({
+            "STUDY.ACCESSION": STUDIES, "DISEASE.TRAIT": [traits[study] + " trait" for study in STUDIES],
+            "MAPPED_TRAIT": [traits[study] for study in STUDIES], "MAPPED_TRAIT_URI": "",
+            "MAPPED_TRAIT_CURIE": "", "PUBMEDID": [str(1000 + index) for index in range(len(STUDIES))]}),
+        "gwascatalog_mappings": pd.DataFrame({"STUDY.ACCESSION": [study for study, _ in MAPPINGS],
+                                              "MAPPED_TRAIT_CURIE": [term for _, term in MAPPINGS],
+                                              "MAPPED_TRAIT_URI": [iri(term) for _, term in MAPPINGS]}),
+        "gwascatalog_references": pd.DataFrame({"PUBMEDID": ["1000", "1001"],
+                                                "Abstract": ["Variants associated with diseases of the pancreas.",
+                                                             "A study of liver function."]}),
+        "efo_labels": pd.DataFrame({"Subject": list(LABELS), "Object": list(LABELS.values()),
+                                    "IRI": [iri(term) for term in LABELS]}),
+        "efo_synonyms": pd.DataFrame(SYNONYMS, columns=["Subject", "Object"]),
+        "efo_edges": pd.DataFrame([(term, parent) for term, parents in PARENTS.items() for parent in parents],
+                                  columns=["Subject", "Object"]),
+        "efo_entailed_edges": pd.DataFrame([(term, ancestor) for term in LABELS for ancestor in sorted(ancestors(term))],
+                                           columns=["Subject", "Object"])}
+    for table_name, table_df in tables.items():
+        import_df_to_db(connection, data_frame=table_df, table_name=table_name)
+    create_term_resources_table(connection, "efo", "gwascatalog_mappings", resource_id_col="STUDY.ACCESSION",
+                                ontology_term_curie_col="MAPPED_TRAIT_CURIE")
+    create_text_search_tables(connection, _get_text_search_tables("gwascatalog", "efo", resource_col="DISEASE.TRAIT",
+                                                                  resource_id_col="STUDY.ACCESSION",
+                                                                  pmid_col="PUBMEDID"))
+    connection.close()
+
+    connection = open_database(database_file)
+    yield connection.cursor()
+    connection.close()
+
+
+def studies(results_df):
+    return sorted(results_df["STUDY.ACCESSION"])
+
+
+def per_call_results(cursor, terms, **search_mode):
+    return resources_annotated_with_terms(cursor, [terms] if isinstance(terms, str) else terms, **search_mode)
+
+
+@pytest.mark.parametrize("search_mode", SEARCH_MODES)
+def test_term_groups_match_per_call_searches(cursor, search_mode):
+    batch_df = resources_annotated_with_term_groups(cursor, TERM_GROUPS, **search_mode)
+    batch_dict = resources_annotated_with_term_groups(cursor, TERM_GROUPS, as_dict=True, **search_mode)
+    assert list(batch_df.columns) == ["QueryKey"] + RESOURCE_COLUMNS
+    assert list(batch_dict) == list(TERM_GROUPS)
+    for key, terms in TERM_GROUPS.items():
+        expected_df = per_call_results(cursor, terms, **search_mode).sort_values("STUDY.ACCESSION")
+        group_df = batch_df[batch_df["QueryKey"] == key].drop(columns="QueryKey").sort_values("STUDY.ACCESSION")
+        assert group_df.reset_index(drop=True).equals(expected_df.reset_index(drop=True))
+        assert sorted(batch_dict[key]) == studies(expected_df)
+    assert len(batch_dict["rare"]) == 0 and len(batch_dict["unknown"]) == 0
+
+
+def test_search_modes(cursor):
+    assert studies(per_call_results(cursor, ["EFO:2"], include_subclasses=False)) == ["GCST3"]
+    assert studies(per_call_results(cursor, ["EFO:2"], direct_subclasses_only=True)) == ["GCST1", "GCST3"]
+    assert studies(per_call_results(cursor, ["EFO:2"])) == ["GCST1", "GCST2", "GCST3"]
+    assert studies(per_call_results(cursor, ["EFO:1"])) == ["GCST1", "GCST2", "GCST3", "GCST4", "GCST5"]
+
+
+def test_term_studies_and_ontology_index_match_entailed_edges(cursor):
+    ontology_index = OntologyIndex.from_database(cursor.connection)
+    for term in list(LABELS) + ["EFO:0"]:
+        expected_studies = studies(per_call_results(cursor, [term]))
+        assert studies(per_call_results(cursor, [term], use_term_studies=True)) == expected_studies
+        assert studies(per_call_results(cursor, [term], ontology_index=ontology_index)) == expected_studies
+        assert studies(per_call_results(cursor, [term], direct_subclasses_only=True,
+                                        ontology_index=ontology_index)) == \
+            studies(per_call_results(cursor, [term], direct_subclasses_only=True))
+
+
+@pytest.mark.parametrize("search_mode", SEARCH_MODES[:3])
+@pytest.mark.parametrize("search_text", ["pancrea", "Hepatic", "infect", "no such text"])
+def test_text_search_matches_term_search(cursor, search_text, search_mode):
+    matched_terms = [term for term, label in LABELS.items() if search_text.lower() in label] + \
+                    [term for term, synonym in SYNONYMS if search_text.lower() in synonym]
+    results_df = resources_matching_text(cursor, search_text, **search_mode)
+    assert studies(results_df) == studies(per_call_results(cursor, matched_terms, **search_mode))
+    assert set(results_df["MatchedTerm"]) <= set(matched_terms)
+    assert results_df["MatchedTermLabel"].tolist() == [LABELS[term] for term in results_df["MatchedTerm"]]
+    assert results_df["Score"].is_monotonic_decreasing
+
+    # Only the studies of the best-ranked matched term
+    best_df = resources_matching_text(cursor, search_text, max_terms=1, **search_mode)
+    assert best_df["MatchedTerm"].nunique() <= 1
+    if len(best_df) > 0:
+        assert studies(best_df) == studies(per_call_results(cursor, [best_df["MatchedTerm"][0]], **search_mode))
+
+
+def test_search_text_tables(cursor):
+    assert sorted(search_text_table(cursor, "efo_labels", "PANCREA")["Key"]) == ["EFO:2", "EFO:4", "EFO:5"]
+    assert search_text_table(cursor, "efo_synonyms", "hepatic")["Key"].tolist() == ["EFO:6"]
+    assert sorted(search_text_table(cursor, "gwascatalog_metadata", "liver")["Key"]) == ["GCST3"]
+    assert search_text_table(cursor, "gwascatalog_references", "disease")["Key"].tolist() == ["1000"]  # 'diseases'
+    assert len(search_text_table(cursor, "efo_labels", "disease", limit=2)) == 2
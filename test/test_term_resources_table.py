@@ -0,0 +1,78 @@
+import os
+import sys
+import sqlite3
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from build_database import import_df_to_db, create_term_resources_table, check_term_resources_table
+from generate_mapping_report import get_mapping_counts
+
+### Tests ###
+#
+# A toy ontology (with a term that has two parents) and a few resources mapped to its terms are imported into a
+#  database, with the mapping counts computed from the same entailed edges table as the term resources table, to check:
+# 1) that the term resources table agrees with the mapping counts, both when created and when the rows of some
+#     resources are replaced
+# 2) that a term whose counts differ from its resources fails the check with a ValueError
+
+TERMS = ["EFO:1", "EFO:2", "EFO:3", "EFO:4", "EFO:5"]
+PARENTS = {"EFO:2": ["EFO:1"], "EFO:3": ["EFO:1"], "EFO:4": ["EFO:2", "EFO:3"], "EFO:5": ["EFO:4"]}
+MAPPINGS = [("S1", "EFO:4"), ("S2", "EFO:5"), ("S3", "EFO:2"), ("S3", "EFO:4"), ("S4", "EFO:1")]
+
+
+def iri(curie):
+    return "http://www.ebi.ac.uk/efo/EFO_" + curie.split(":")[1]
+
+
+def ancestors(term):
+    return {term}.union(*[ancestors(parent) for parent in PARENTS.get(term, [])])
+
+
+def mappings_table(mappings):
+    return pd.DataFrame({"SourceTermID": [resource for resource, _ in mappings],
+                         "MappedTermCURIE": [term for _, term in mappings],
+                         "MappedTermIRI": [iri(term) for _, term in mappings]})
+
+
+def update_labels(connection, mappings_df):
+    labels_df = pd.DataFrame({"Subject": TERMS, "IRI": [iri(term) for term in TERMS]})
+    entailed_edges_df = pd.read_sql_query("SELECT * FROM efo_entailed_edges", connection)
+    counts_df = get_mapping_counts(mappings_df, ontology_iri="", ontology_terms_df=labels_df,
+                                   entailed_edges_df=entailed_edges_df)
+    import_df_to_db(connection, data_frame=labels_df.merge(counts_df, on="IRI"), table_name="efo_labels")
+
+
+@pytest.fixture
+def connection():
+    connection = sqlite3.connect(":memory:")
+    entailed_edges_df = pd.DataFrame([(term, ancestor) for term in TERMS for ancestor in sorted(ancestors(term))],
+                                     columns=["Subject", "Object"])
+    import_df_to_db(connection, data_frame=entailed_edges_df, table_name="efo_entailed_edges")
+    mappings_df = mappings_table(MAPPINGS)
+    import_df_to_db(connection, data_frame=mappings_df, table_name="gwascatalog_mappings")
+    update_labels(connection, mappings_df)
+    create_term_resources_table(connection, "efo", "gwascatalog_mappings", resource_id_col="SourceTermID",
+                                ontology_term_curie_col="MappedTermCURIE")
+    yield connection
+    connection.close()
+
+
+def test_agrees_with_mapping_counts(connection):
+    check_term_resources_table(connection, "efo")
+    counts = dict(connection.execute("SELECT Subject, Direct || '/' || Inherited FROM efo_labels").fetchall())
+    assert counts == {"EFO:1": "1/3", "EFO:2": "1/2", "EFO:3": "0/3", "EFO:4": "2/1", "EFO:5": "1/0"}
+
+    # S2 is now mapped to EFO:3, and S4 no longer mapped
+    mappings_df = mappings_table([mapping for mapping in MAPPINGS if mapping[0] not in ("S2", "S4")] + [("S2", "EFO:3")])
+    import_df_to_db(connection, data_frame=mappings_df, table_name="gwascatalog_mappings")
+    update_labels(connection, mappings_df)
+    create_term_resources_table(connection, "efo", "gwascatalog_mappings", resource_id_col="SourceTermID",
+                                ontology_term_curie_col="MappedTermCURIE", resource_ids=["S2", "S4"])
+    check_term_resources_table(connection, "efo")
+
+
+def test_fails_on_any_difference(connection):
+    connection.execute("UPDATE efo_labels SET Inherited = Inherited + 1 WHERE Subject = 'EFO:3'")
+    with pytest.raises(ValueError, match="of 1 terms differ"):
+        check_term_resources_table(connection, "efo")